@@ -1,8 +1,41 @@
-from .htcsession import HtcSession
-from . import internals
-from . import htcprojects
-from . import htctasks
-from . import htcjobs
-from . import api
-from . import container_registry
-from . import exceptions
+# Submodules are imported on first use, so that e.g. a script that only needs
+# rescalehtc.bearer_token doesn't pay for importing requests and the api module.
+import importlib
+
+_submodules = [
+    "api",
+    "api_async",
+    "bearer_token",
+    "container_registry",
+    "exceptions",
+    "htcjobs",
+    "htcprojects",
+    "htcsession",
+    "htctasks",
+    "internals",
+    "journal",
+    "monitor",
+    "multi_workspace",
+    "records",
+    "submission",
+]
+
+_attributes = {
+    "HtcSession": "htcsession",
+    "AsyncHtcSession": "htcsession",
+    "MultiWorkspaceSession": "multi_workspace",
+}
+
+__all__ = _submodules + list(_attributes)
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f".{name}", __name__)
+    if name in _attributes:
+        return getattr(importlib.import_module(f".{_attributes[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -7,15 +7,25 @@ E.g. POST /htc/projects/{projectId}/tasks/{taskId}/jobs/batch
 
 Becomes: post_htc_projects_tasks_jobs_batch(...)
 
+Paginated list endpoints also have a streaming variant prefixed with iter\_
+instead of the HTTP method, e.g. iter_htc_projects_tasks_jobs(...). These
+return a generator that yields the items as each page arrives, instead of
+collecting every page into one list first.
+
 API calls that result in a HTTP 400 or larger code, for example due
 to input error, will cause these functions to raise a HtcException.
+Transient errors like HTTP 429 and 503 are first retried with backoff, as
+configured by the retry policy of the HtcSession. Only GET, PUT and DELETE
+calls, and POST calls that are safe to repeat, are retried.
 """
 
 from __future__ import annotations
-from typing import Optional
+from typing import Iterator, Optional
 
 from . import HtcSession
-from .internals.rest_helpers import api_get, api_post, api_put, api_patch, api_delete
+from .internals.rest_helpers import (
+    api_get, api_iter_items, api_post, api_put, api_patch, api_delete, make_filters, make_list_params
+)
 from .exceptions import HtcException
 
 
@@ -464,6 +474,7 @@ def post_htc_projects_container_registry_repo(
         rescale,
         f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/container-registry/repo/{repo_name}",
         payload={},
+        retry_safe=True,
     )
 
 
@@ -491,7 +502,8 @@ def get_htc_projects_container_registry_token(
 
 
 def get_htc_projects_tasks(
-    rescale: HtcSession, project_id: str, task_id: str = None
+    rescale: HtcSession, project_id: str, task_id: str = None,
+    lifecycle_status: Optional[str] = None, task_name: Optional[str] = None, page_size: Optional[int] = None,
 ) -> dict:
     """
     Corresponds to API call:
@@ -502,10 +514,17 @@ def get_htc_projects_tasks(
 
     Get all Rescale projects within a project. A projectId must be provided.
     If providing a task_id, get the details for a single rescale task.
+
+    When listing tasks, ``lifecycle_status`` and ``task_name`` only return tasks
+    with that lifecycleStatus and taskName, and ``page_size`` sets the number of
+    tasks per page. See :func:`get_htc_projects_tasks_jobs` for how filters are applied.
     """
     if task_id == None:
+        filters = make_filters(lifecycleStatus=lifecycle_status, taskName=task_name)
         return api_get(
-            rescale, f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks"
+            rescale, f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks",
+            params=make_list_params(filters, page_size),
+            filters=filters,
         )
     else:
         return api_get(
@@ -514,6 +533,30 @@ def get_htc_projects_tasks(
         )
 
 
+def iter_htc_projects_tasks(
+    rescale: HtcSession, project_id: str, prefetch_pages: int = 0,
+    lifecycle_status: Optional[str] = None, task_name: Optional[str] = None, page_size: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Streaming variant of the API call:
+
+    GET /htc/projects/{projectId}/tasks
+
+    Yield all Rescale tasks within a project, one page at a time. Only a single
+    page of tasks is kept in memory, plus up to ``prefetch_pages`` pages that are
+    fetched ahead in the background. The filters and ``page_size`` work as in
+    :func:`get_htc_projects_tasks`.
+    """
+    filters = make_filters(lifecycleStatus=lifecycle_status, taskName=task_name)
+    return api_iter_items(
+        rescale,
+        f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks",
+        params=make_list_params(filters, page_size),
+        prefetch_pages=prefetch_pages,
+        filters=filters,
+    )
+
+
 def post_htc_projects_tasks(
     rescale: HtcSession, project_id: str, payload: dict
 ) -> dict:
@@ -695,7 +738,8 @@ def get_htc_projects_tasks_summary_statistics(
 
 
 def get_htc_projects_tasks_jobs(
-    rescale: HtcSession, project_id: str, task_id: str, job_id: str = None
+    rescale: HtcSession, project_id: str, task_id: str, job_id: str = None,
+    status: Optional[str] = None, group: Optional[str] = None, page_size: Optional[int] = None,
 ) -> dict:
     """
     Corresponds to API Call:
@@ -706,11 +750,20 @@ def get_htc_projects_tasks_jobs(
 
     Get all jobs under a task. If a jobId is specified, return information about this
     specific job only.
+
+    When listing jobs, ``status`` and ``group`` only return jobs with that status
+    and group, and ``page_size`` sets the number of jobs per page. Filters are sent
+    to the API as query parameters of the same name as the field, so that the API
+    can leave out jobs that don't match. They are also applied to the results as
+    they arrive, so the result is the same whether or not the API filters.
     """
     if job_id == None:
+        filters = make_filters(status=status, group=group)
         return api_get(
             rescale,
             f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks/{task_id}/jobs",
+            params=make_list_params(filters, page_size),
+            filters=filters,
         )
     else:
         return api_get(
@@ -719,6 +772,31 @@ def get_htc_projects_tasks_jobs(
         )
 
 
+def iter_htc_projects_tasks_jobs(
+    rescale: HtcSession, project_id: str, task_id: str, prefetch_pages: int = 0,
+    status: Optional[str] = None, group: Optional[str] = None, page_size: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Streaming variant of the API call:
+
+    GET /htc/projects/{projectId}/tasks/{taskId}/jobs
+
+    Yield all jobs under a task, one page at a time. Only a single page of jobs is
+    kept in memory, so this can be used for tasks with a very large number of jobs.
+    If ``prefetch_pages`` is larger than 0, up to that many pages are fetched ahead
+    in the background while the caller processes the current page. The filters and
+    ``page_size`` work as in :func:`get_htc_projects_tasks_jobs`.
+    """
+    filters = make_filters(status=status, group=group)
+    return api_iter_items(
+        rescale,
+        f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks/{task_id}/jobs",
+        params=make_list_params(filters, page_size),
+        prefetch_pages=prefetch_pages,
+        filters=filters,
+    )
+
+
 def post_htc_projects_tasks_jobs_batch(
     rescale: HtcSession, project_id: str, task_id: str, payload: dict
 ) -> dict:
@@ -753,11 +831,12 @@ def post_htc_projects_tasks_jobs_cancel(
         f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks/{task_id}/jobs/cancel",
         payload={},
         return_json=False,
+        retry_safe=True,
     )
 
 
 def get_htc_projects_tasks_jobs_logs(
-    rescale: HtcSession, project_id: str, task_id: str, job_id: str, max_items : Optional[int] = None, page_size: int = 5000,
+    rescale: HtcSession, project_id: str, task_id: str, job_id: str, max_items: Optional[int] = None, page_size: int = 5000,
 ) -> dict:
     """
     Corresponds to API Call:
@@ -770,7 +849,29 @@ def get_htc_projects_tasks_jobs_logs(
         rescale,
         f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks/{task_id}/jobs/{job_id}/logs",
         params={"pageSize": page_size},
-        max_items = max_items
+        max_items=max_items,
+    )
+
+
+def iter_htc_projects_tasks_jobs_logs(
+    rescale: HtcSession, project_id: str, task_id: str, job_id: str, max_items: Optional[int] = None, page_size: int = 5000,
+    prefetch_pages: int = 0,
+) -> Iterator[dict]:
+    """
+    Streaming variant of the API call:
+
+    GET /htc/projects/{projectId}/tasks/{taskId}/jobs/{jobId}/logs
+
+    Yield the stdout log lines for a particular rescale job, one page at a time.
+    Like the API, the most recent line comes first. If ``prefetch_pages`` is larger
+    than 0, up to that many pages are fetched ahead in the background.
+    """
+    return api_iter_items(
+        rescale,
+        f"{rescale.RESCALE_API_BASE_URL}/htc/projects/{project_id}/tasks/{task_id}/jobs/{job_id}/logs",
+        params={"pageSize": page_size},
+        max_items=max_items,
+        prefetch_pages=prefetch_pages,
     )
 
 
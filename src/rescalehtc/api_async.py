@@ -0,0 +1,47 @@
+"""
+This file contains asyncio versions of the low-level API calls in
+:mod:`rescalehtc.api`. Every function in that module has a counterpart
+here with the same name, arguments and documentation, but it must be
+awaited and called with an :class:`rescalehtc.htcsession.AsyncHtcSession`.
+The streaming iter\_ functions are the exception, use the get\_ functions
+instead.
+
+E.g. ``api.get_htc_projects_tasks_jobs(htcs, project_id, task_id)``
+
+Becomes: ``await api_async.get_htc_projects_tasks_jobs(async_htcs, project_id, task_id)``
+
+API calls that result in a HTTP 400 or larger code, for example due
+to input error, will cause these functions to raise a HtcException.
+"""
+
+from __future__ import annotations
+import functools
+import inspect
+
+from . import api
+from .htcsession import AsyncHtcSession
+from .exceptions import HtcException
+
+
+# The functions in api only pass their arguments on to the rest_helpers, which
+# return coroutines when given an AsyncHtcSession. Wrap each of them in a
+# coroutine function so they can be used as normal asyncio functions.
+def _make_async(api_function):
+    @functools.wraps(api_function)
+    async def async_api_function(rescale: AsyncHtcSession, *args, **kwargs):
+        if not isinstance(rescale, AsyncHtcSession):
+            raise HtcException(
+                f"{api_function.__name__} in api_async must be called with an "
+                "AsyncHtcSession, use the api module for HtcSession objects."
+            )
+        return await api_function(rescale, *args, **kwargs)
+
+    async_api_function.__module__ = __name__
+    return async_api_function
+
+
+# The streaming iter_ functions have no asyncio counterpart, use the get_
+# functions instead.
+for _name, _api_function in inspect.getmembers(api, inspect.isfunction):
+    if _api_function.__module__ == api.__name__ and not _name.startswith("iter_"):
+        globals()[_name] = _make_async(_api_function)
@@ -170,6 +170,11 @@ class HtcContainerRegistry:
         # Empty the stdout buffer as we've used subprocess commands
         sys.stdout.flush()
 
+        # An image pushed under an existing name is PENDING again
+        rescale.image_readiness.invalidate(
+            (rescale.auth_identity, self.project.json["projectId"]), remote_image_name
+        )
+
         return remote_image_name
 
     def get_image(self, rescale: HtcSession, image_name: str) -> dict:
@@ -200,6 +205,9 @@ class HtcContainerRegistry:
         """
         Deletes an image from the container registry.
         """
+        rescale.image_readiness.invalidate(
+            (rescale.auth_identity, self.project.json["projectId"]), image_name
+        )
         return api.delete_htc_projects_container_registry_images(
             rescale, self.project.json["projectId"], image_name
         )
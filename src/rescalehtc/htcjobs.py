@@ -4,19 +4,26 @@ are where actual compute is performed in Rescale.
 Jobs are returned as a HtcJob or HtcJobBatch objects.
 """
 from __future__ import annotations
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
 import tempfile
-import time
 import os
-from typing import Iterable, Optional
+import sys
+import time
+from typing import Iterable, Iterator, Optional
 
 from .internals.constants import (
-    FLOOD_PREVENTION_INTERVAL_SECONDS,
-    MAX_WAIT_FOR_IMAGE_TRANSITION_PENDING_READY_SECONDS,
+    MAX_JOB_BATCHES_PER_SUBMISSION,
+    PAGINATION_PREFETCH_PAGES,
+    REFRESH_JOBS_MAX_INDIVIDUAL_REQUESTS,
 )
 from .exceptions import HtcException
 from .htctasks import HtcTask
+from .internals.polling import FINISHED_JOB_STATUSES, PollingState
+from .journal import SubmissionJournal
+from .records import JobRecord, LogRecord
 from . import HtcSession, api
 
 logger = logging.getLogger("RESCALEHTC")
@@ -27,6 +34,17 @@ class HtcJob:
     Class for a single Rescale Job.
     """
 
+    # Batches may have hundreds of thousands of jobs, so keep each one small
+    __slots__ = (
+        "json",
+        "task",
+        "status_updated_at",
+        "log_lines_updated_at",
+        "log_lines_raw_inverted",
+        "status_polling",
+        "log_polling",
+    )
+
     def __init__(self, json: dict, task: HtcTask):
         now = datetime.now()
         self.json = json
@@ -107,6 +125,9 @@ class HtcJob:
         self.status_updated_at = now - timedelta(hours=1)
         self.log_lines_updated_at = now - timedelta(hours=1)
         self.log_lines_raw_inverted = None
+        # Created from the polling policy of the session on first use
+        self.status_polling: Optional[PollingState] = None
+        self.log_polling: Optional[PollingState] = None
 
     def __repr__(self):
         return "HtcJob(" + str(self.json) + ")"
@@ -119,48 +140,74 @@ class HtcJob:
 
         This function has basic flood prevention on the job status requests.
         The API never updates more than every 30 seconds anyway,
-        so calling this function more often than that has no effect.
+        so calling this function more often than that has no effect. The
+        interval between requests grows while the status doesn't change, and
+        shrinks when the job is expected to finish, see the polling_policy
+        argument of :class:`rescalehtc.htcsession.HtcSession`.
+
+        To update many jobs, use :func:`rescalehtc.htcjobs.refresh_jobs`,
+        which needs far fewer requests.
         """
+        if self.status_polling is None:
+            self.status_polling = rescale.polling_policy.new_state()
         now = datetime.now()
         time_since_last_update = now - self.status_updated_at
         if time_since_last_update > timedelta(
-            seconds=FLOOD_PREVENTION_INTERVAL_SECONDS
+            seconds=self.status_polling.interval
         ):
             logger.debug(f"Updated Rescale Job status, job id {self.json['jobUUID']}")
-            self.json = api.get_htc_projects_tasks_jobs(
+            self._set_json(
                 rescale,
-                project_id=self.json["projectId"],
-                task_id=self.json["taskId"],
-                job_id=self.json["jobUUID"],
+                api.get_htc_projects_tasks_jobs(
+                    rescale,
+                    project_id=self.json["projectId"],
+                    task_id=self.json["taskId"],
+                    job_id=self.json["jobUUID"],
+                ),
             )
-            self.status_updated_at = datetime.now()
-
-            # Perform sanity check on the status field. We rely heavily on the potential values
-            # not changing here, so we want to raise an exception if we encounter something
-            # unexpected
-            if self.json["status"] not in [
-                "FAILED",
-                "POD_FAILED",
-                "POD_SUCCEEDED",
-                "SUCCEEDED",
-                "SUBMITTED_TO_RESCALE",
-                "SUBMITTED_TO_PROVIDER",
-                "RUNNABLE",
-                "STARTING",
-                "RUNNING",
-            ]:
-                raise HtcException(
-                    "Updating a HtcJob status returned a status value that is not supported "
-                    f"by this library: {self.json['status']}. "
-                    "Please contact the library developers this is a critical bug in the library."
-                )
         else:
             logger.debug(
-                f"Skipped updating job status since last request was {time_since_last_update} ago, less than {FLOOD_PREVENTION_INTERVAL_SECONDS} seconds, jobId {self.json['jobUUID']}"
+                f"Skipped updating job status since last request was {time_since_last_update} ago, less than {self.status_polling.interval:.0f} seconds, jobId {self.json['jobUUID']}"
             )
 
         return self.json
 
+    def is_due_for_update(self, rescale: HtcSession) -> bool:
+        """
+        Returns true if the flood prevention of
+        :func:`rescalehtc.htcjobs.HtcJob.get_update` would send a request now.
+        """
+        if self.status_polling is None:
+            self.status_polling = rescale.polling_policy.new_state()
+        return datetime.now() - self.status_updated_at > timedelta(seconds=self.status_polling.interval)
+
+    # Store the latest status of the job, fetched by get_update or refresh_jobs
+    def _set_json(self, rescale: HtcSession, json: dict):
+        # Perform sanity check on the status field. We rely heavily on the potential values
+        # not changing here, so we want to raise an exception if we encounter something
+        # unexpected
+        if json["status"] not in [
+            "FAILED",
+            "POD_FAILED",
+            "POD_SUCCEEDED",
+            "SUCCEEDED",
+            "SUBMITTED_TO_RESCALE",
+            "SUBMITTED_TO_PROVIDER",
+            "RUNNABLE",
+            "STARTING",
+            "RUNNING",
+        ]:
+            raise HtcException(
+                "Updating a HtcJob status returned a status value that is not supported "
+                f"by this library: {json['status']}. "
+                "Please contact the library developers this is a critical bug in the library."
+            )
+        self.json = json
+        self.status_updated_at = datetime.now()
+        if self.status_polling is None:
+            self.status_polling = rescale.polling_policy.new_state()
+        rescale.polling_policy.observe_job(self.status_polling, self.json)
+
     def is_still_running(self, rescale: HtcSession) -> bool:
         """
         Update the status of the job, and return true if the job is still running or pending.
@@ -210,11 +257,13 @@ class HtcJob:
         The API never updates more than every 30 seconds anyway,
         so calling this function more often than that has no effect.
         """
+        if self.log_polling is None:
+            self.log_polling = rescale.polling_policy.new_state()
         now = datetime.now()
 
         time_since_last_update = now - self.log_lines_updated_at
         if self.log_lines_raw_inverted == None or time_since_last_update > timedelta(
-            seconds=FLOOD_PREVENTION_INTERVAL_SECONDS
+            seconds=self.log_polling.interval
         ):
             logger.debug(f"Updated Rescale Logs, job id {self.json['jobUUID']}")
             logs_messages = api.get_htc_projects_tasks_jobs_logs(
@@ -226,9 +275,14 @@ class HtcJob:
             )
             self.log_lines_updated_at = datetime.now()
             self.log_lines_raw_inverted = [line["message"] for line in logs_messages]
+            rescale.polling_policy.observe_logs(
+                self.log_polling,
+                len(self.log_lines_raw_inverted),
+                self.json.get("status") in FINISHED_JOB_STATUSES,
+            )
         else:
             logger.debug(
-                f"Skipped updating job logs since last request was {time_since_last_update} ago, less than {FLOOD_PREVENTION_INTERVAL_SECONDS} seconds, jobId {self.json['jobUUID']}"
+                f"Skipped updating job logs since last request was {time_since_last_update} ago, less than {self.log_polling.interval:.0f} seconds, jobId {self.json['jobUUID']}"
             )
 
         return reversed(self.log_lines_raw_inverted)
@@ -249,17 +303,19 @@ class HtcJob:
         more friendly oldest line first ordering, and written to the target file.
 
         More memory efficient than :func:`rescalehtc.htcjobs.HtcJob.get_logs`,
-        as the whole log is not kept in memory during fetching.
+        as the whole log is not kept in memory during fetching. Only a single
+        page of log lines is held in memory at a time.
         """
 
         # Open a temporary file to write the reversed log file to
         with tempfile.TemporaryFile("wb+") as temp_fp:
-            logs_messages = api.get_htc_projects_tasks_jobs_logs(
+            logs_messages = api.iter_htc_projects_tasks_jobs_logs(
                 rescale,
                 project_id=self.json["projectId"],
                 task_id=self.json["taskId"],
                 job_id=self.json["jobUUID"],
                 max_items=last_n_lines,
+                prefetch_pages=PAGINATION_PREFETCH_PAGES,
             )
             for line in logs_messages:
                 temp_fp.write((line["message"] + "\n").encode())
@@ -269,6 +325,78 @@ class HtcJob:
                 for line in reverse_readline(temp_fp):
                     target_fp.write(line + "\n")
 
+    def iter_log_records(
+        self, rescale: HtcSession, last_n_lines: Optional[int] = None
+    ) -> Iterator[LogRecord]:
+        """
+        Iterate over the log lines of this job as compact
+        :class:`rescalehtc.records.LogRecord` objects, which also hold the
+        timestamp of each line. Lines are yielded in the newest-line-first order
+        that the Rescale API returns them, as each page arrives.
+
+        :param last_n_lines: Optional: The number of lines from the tail of the log to fetch, or None to get the entire log.
+        """
+        for line in api.iter_htc_projects_tasks_jobs_logs(
+            rescale,
+            project_id=self.json["projectId"],
+            task_id=self.json["taskId"],
+            job_id=self.json["jobUUID"],
+            max_items=last_n_lines,
+            prefetch_pages=PAGINATION_PREFETCH_PAGES,
+        ):
+            yield LogRecord.from_json(line)
+
+
+class JobBatchView(Sequence):
+    """
+    The jobs of a :class:`HtcJobBatch`, returned by
+    :func:`rescalehtc.htcjobs.HtcJobBatch.to_jobs`. Behaves like a read-only
+    list of HtcJob objects, but only stores the batch and a range of array
+    indices. Each HtcJob is created when it is first accessed, and the same
+    object is returned every time after that, so a view of a huge batch costs
+    almost no memory until its jobs are used.
+
+    Slicing returns another view, which shares the jobs created so far.
+    """
+
+    def __init__(self, batch: HtcJobBatch, indices: Optional[range] = None, jobs: Optional[dict] = None):
+        self.batch = batch
+        self._indices = indices if indices is not None else range(batch.json["batchSize"])
+        # Jobs created so far, by array index
+        self._jobs = jobs if jobs is not None else {}
+
+    def __repr__(self):
+        return f"JobBatchView({self.batch.json['parentJobId']}, {self._indices.start}..{self._indices.stop})"
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return JobBatchView(self.batch, self._indices[key], self._jobs)
+        return self._get_job(self._indices[key])
+
+    def __iter__(self) -> Iterator[HtcJob]:
+        for index in self._indices:
+            yield self._get_job(index)
+
+    def _get_job(self, index: int) -> HtcJob:
+        job = self._jobs.get(index)
+        if job is None:
+            json = self.batch.json
+            job = HtcJob(
+                {
+                    "group": json["group"],
+                    "projectId": json["projectId"],
+                    "taskId": json["taskId"],
+                    "jobUUID": f'{json["parentJobId"]}:{index}',
+                },
+                self.batch.task,
+            )
+            # Another thread may have created the job first
+            job = self._jobs.setdefault(index, job)
+        return job
+
 
 class HtcJobBatch:
     """
@@ -367,9 +495,11 @@ class HtcJobBatch:
         """
         return self.task.is_still_running(rescale)
 
-    def to_jobs(self) -> list[HtcJob]:
+    def to_jobs(self) -> JobBatchView:
         """
-        Converts a HtcJobBatch to an iterator of HtcJob.
+        Converts a HtcJobBatch to a sequence of HtcJob, see
+        :class:`rescalehtc.htcjobs.JobBatchView`. The jobs are created as
+        they are accessed, so this is cheap even for huge batches.
         The details of each HtcJob is a bit sparse, as we have not
         queried the API for the status of each individual job.
 
@@ -379,20 +509,66 @@ class HtcJobBatch:
 
         If you want to monitor the status of a set of jobs, its more
         efficient to call :func:`~rescalehtc.htctasks.HtcTask.get_task_summary`
-        on the task instead of polling the individual HtcJobs.
+        on the task instead of polling the individual HtcJobs. To update the
+        statuses of the jobs, use :func:`rescalehtc.htcjobs.refresh_jobs`.
         """
-        return [
-            HtcJob(
-                {
-                    "group": self.json["group"],
-                    "projectId": self.json["projectId"],
-                    "taskId": self.json["taskId"],
-                    "jobUUID": f'{self.json["parentJobId"]}:{i}',
-                },
-                self.task,
-            )
-            for i in range(self.json["batchSize"])
-        ]
+        return JobBatchView(self)
+
+
+def iter_jobs(
+    rescale: HtcSession,
+    task: HtcTask,
+    job_status: str = "any",
+    prefetch_pages: int = PAGINATION_PREFETCH_PAGES,
+) -> Iterator[HtcJob]:
+    """
+    Iterate over all jobs within a task with a particular job status. By default
+    yields jobs with any status. Set job_status field e.g. to SUCCEEDED to filter
+    on specific job statuses.
+
+    Jobs are yielded as each page of results arrives from the API, so memory use
+    stays flat regardless of how many jobs the task has. Prefer this function
+    over :func:`get_jobs` for tasks with a large number of jobs.
+
+    :param prefetch_pages: Optional: Number of pages of jobs to fetch ahead in the background while the caller processes the current page. Set to 0 to fetch pages only when needed.
+    """
+    # Validated here rather than in a generator, so that errors are raised on the call
+    if not isinstance(task, HtcTask):
+        raise HtcException("Provided argument task is not a HtcTask object.")
+
+    any_job_status = True if job_status in ["any", "all", None] else False
+
+    # The API filters on status, so jobs with other statuses are never transferred.
+    # The listing is a generator as well, so no request is made until iterated.
+    job_jsons = api.iter_htc_projects_tasks_jobs(
+        rescale, task.json["projectId"], task.json["taskId"], prefetch_pages=prefetch_pages,
+        status=None if any_job_status else job_status,
+    )
+    return (HtcJob(job, task) for job in job_jsons)
+
+
+def iter_job_records(
+    rescale: HtcSession,
+    task: HtcTask,
+    job_status: str = "any",
+    prefetch_pages: int = PAGINATION_PREFETCH_PAGES,
+) -> Iterator[JobRecord]:
+    """
+    Like :func:`iter_jobs`, but yields compact :class:`rescalehtc.records.JobRecord`
+    objects instead of HtcJob objects. Only the most commonly used fields of each
+    job are kept, which uses a fraction of the memory when holding on to the
+    jobs of very large tasks.
+    """
+    if not isinstance(task, HtcTask):
+        raise HtcException("Provided argument task is not a HtcTask object.")
+
+    any_job_status = True if job_status in ["any", "all", None] else False
+
+    job_jsons = api.iter_htc_projects_tasks_jobs(
+        rescale, task.json["projectId"], task.json["taskId"], prefetch_pages=prefetch_pages,
+        status=None if any_job_status else job_status,
+    )
+    return (JobRecord.from_json(job) for job in job_jsons)
 
 
 def get_jobs(
@@ -402,23 +578,14 @@ def get_jobs(
     Get all jobs within a task with a particular job status. By default shows
     jobs with any status. Set job_status field e.g. to SUCCEEDED to filter on
     specific job statuses.
+
+    All jobs are kept in memory at once. For tasks with many jobs, consider
+    using :func:`iter_jobs` instead.
     """
-    if isinstance(task, HtcTask):
-        task_id = task.json["taskId"]
-    else:
+    if not isinstance(task, HtcTask):
         raise HtcException("Provided argument task is not a HtcTask object.")
 
-    any_job_status = True if job_status in ["any", "all", None] else False
-
-    project_id = task.json["projectId"]
-
-    all_jobs = api.get_htc_projects_tasks_jobs(rescale, project_id, task_id)
-    matching_jobs = [
-        HtcJob(job, task)
-        for job in all_jobs
-        if any_job_status or job["status"] == job_status
-    ]
-    return matching_jobs
+    return list(iter_jobs(rescale, task, job_status))
 
 
 def get_job_with_id(
@@ -443,6 +610,187 @@ def get_job_with_id(
     return HtcJob(job, task)
 
 
+def refresh_jobs(
+    rescale: HtcSession, jobs: Iterable[HtcJob], force: bool = False,
+) -> list[HtcJob]:
+    """
+    Update the status of many jobs at once, in place, like calling
+    :func:`rescalehtc.htcjobs.HtcJob.get_update` on each of them but with far
+    fewer requests. Returns the jobs that were updated.
+
+    The jobs are grouped by task. When only a few jobs of a task are due for an
+    update, they are requested one by one in parallel. Otherwise the jobs of the
+    task are listed page by page, until all of the jobs were found. Refreshing
+    the jobs of :func:`rescalehtc.htcjobs.HtcJobBatch.to_jobs` costs about as
+    many requests as there are pages of jobs in the task.
+
+    Jobs that are not found, e.g. because they were just submitted, are not
+    updated. Other API errors are raised, as by
+    :func:`rescalehtc.htcjobs.HtcJob.get_update`, after the jobs of the tasks
+    refreshed so far were updated.
+
+    :param jobs: The HtcJob objects to update. May belong to different tasks.
+    :param force: Optional: Also update jobs whose flood prevention interval hasn't passed yet.
+    """
+    # Jobs due for an update, per task and then per job id. The same job may be
+    # passed in several HtcJob objects.
+    tasks = {}
+    for job in jobs:
+        if not isinstance(job, HtcJob):
+            raise HtcException(f"Provided job is not a HtcJob object: {job}")
+        if force or job.is_due_for_update(rescale):
+            task_key = (job.json["projectId"], job.json["taskId"])
+            tasks.setdefault(task_key, {}).setdefault(job.json["jobUUID"], []).append(job)
+
+    updated = []
+    for (project_id, task_id), wanted in tasks.items():
+        if len(wanted) <= REFRESH_JOBS_MAX_INDIVIDUAL_REQUESTS:
+            def get_job(job_id):
+                try:
+                    return api.get_htc_projects_tasks_jobs(rescale, project_id, task_id, job_id)
+                except HtcException as e:
+                    # Same as a job missing from the listing
+                    if e.status_code == 404:
+                        return None
+                    raise
+            with ThreadPoolExecutor(
+                max_workers=len(wanted), thread_name_prefix="rescalehtc-refresh"
+            ) as executor:
+                found = [job for job in executor.map(get_job, list(wanted)) if job is not None]
+        else:
+            found = api.iter_htc_projects_tasks_jobs(
+                rescale, project_id, task_id, prefetch_pages=PAGINATION_PREFETCH_PAGES
+            )
+
+        for json in found:
+            for job in wanted.pop(json["jobUUID"], []):
+                job._set_json(rescale, json)
+                updated.append(job)
+            # Stop listing once every job was found
+            if not wanted:
+                break
+        logger.debug(f"Refreshed the status of jobs in task {task_id}, {len(wanted)} jobs not found")
+
+    return updated
+
+
+class JobStatusChange:
+    """
+    A job that changed status between two syncs of :func:`watch_jobs`.
+    """
+
+    __slots__ = ("job", "previous_status", "status")
+
+    def __init__(self, job: HtcJob, previous_status: Optional[str], status: str):
+        self.job = job
+        """The HtcJob, with the fields returned by the job listing."""
+        self.previous_status = previous_status
+        """The status at the previous sync, or None for jobs that are new since then."""
+        self.status = status
+        """The current status."""
+
+    def __repr__(self):
+        return f"JobStatusChange({self.job.json['jobUUID']}: {self.previous_status} -> {self.status})"
+
+
+# Sync the snapshot of job statuses with one streamed listing of the task,
+# and return the changes.
+#
+# Statuses only move forward, so once the snapshot counts as many jobs per
+# status as the task summary, no job that wasn't listed yet can have changed,
+# and the rest of the listing is skipped.
+def _sync_job_statuses(
+    rescale: HtcSession, task: HtcTask, snapshot: dict, snapshot_counts: dict, job_statuses: dict,
+) -> list[JobStatusChange]:
+    expected_counts = {status: count for status, count in job_statuses.items() if count > 0}
+
+    changes = []
+    for job in api.iter_htc_projects_tasks_jobs(
+        rescale, task.json["projectId"], task.json["taskId"], prefetch_pages=PAGINATION_PREFETCH_PAGES,
+    ):
+        if snapshot_counts == expected_counts:
+            break
+        previous_status = snapshot.get(job["jobUUID"])
+        if previous_status == job["status"]:
+            continue
+        status = sys.intern(job["status"])
+        snapshot[job["jobUUID"]] = status
+        if previous_status is not None:
+            snapshot_counts[previous_status] -= 1
+            if snapshot_counts[previous_status] == 0:
+                del snapshot_counts[previous_status]
+        snapshot_counts[status] = snapshot_counts.get(status, 0) + 1
+        if status in FINISHED_JOB_STATUSES:
+            rescale.polling_policy.record_job_duration((task.json["projectId"], task.json["taskId"]), job)
+        changes.append(JobStatusChange(HtcJob(job, task), previous_status, status))
+    return changes
+
+
+def watch_jobs(
+    rescale: HtcSession,
+    task: HtcTask,
+    include_existing: bool = False,
+    poll_interval_seconds: Optional[float] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[JobStatusChange]:
+    """
+    Watch the jobs of a task, and yield a :class:`JobStatusChange` whenever a
+    job changes status, e.g. from RUNNING to SUCCEEDED, until no job of the
+    task is still running.
+
+    Only the status of every job is kept between syncs. Each sync first checks
+    the task summary, and only lists the jobs of the task when the summary
+    changed. The listing is compared with the statuses of the previous sync,
+    and stops early once the statuses add up to the summary again. In the
+    worst case, a sync reads the whole listing once.
+
+    .. code-block:: python
+
+        for change in htcjobs.watch_jobs(htcs, task):
+            if change.status == "FAILED":
+                print(f"Job {change.job.json['jobUUID']} failed after {change.previous_status}")
+
+    :param include_existing: Optional: Also yield the jobs that exist when watching starts, with previous_status None. By default they are only recorded.
+    :param poll_interval_seconds: Optional: Fixed time between syncs. By default the adaptive interval of the task summary is used, see the polling_policy argument of :class:`rescalehtc.htcsession.HtcSession`.
+    :param timeout: Optional: Raise a HtcException if jobs are still running after this many seconds.
+    """
+    if not isinstance(task, HtcTask):
+        raise HtcException("Provided argument task is not a HtcTask object.")
+
+    return _watch_jobs(rescale, task, include_existing, poll_interval_seconds, timeout)
+
+
+# The generator of watch_jobs, which validates its arguments on the call
+def _watch_jobs(
+    rescale: HtcSession,
+    task: HtcTask,
+    include_existing: bool,
+    poll_interval_seconds: Optional[float],
+    timeout: Optional[float],
+) -> Iterator[JobStatusChange]:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    snapshot = {}
+    snapshot_counts = {}
+    previous_job_statuses = None
+    while True:
+        summary = task.refresh_task_summary(rescale)
+        job_statuses = dict(summary["jobStatuses"])
+        if job_statuses != previous_job_statuses:
+            changes = _sync_job_statuses(rescale, task, snapshot, snapshot_counts, job_statuses)
+            if previous_job_statuses is not None or include_existing:
+                yield from changes
+            previous_job_statuses = job_statuses
+        if not summary["still_running"]:
+            return
+
+        interval = poll_interval_seconds if poll_interval_seconds is not None else task.task_summary_polling.interval
+        if deadline is not None and time.monotonic() + interval > deadline:
+            raise HtcException(
+                f"Timed out after {timeout} seconds watching task {task.json['taskId']} with jobs still running."
+            )
+        time.sleep(interval)
+
+
 def create_single_job(
     rescale: HtcSession,
     task: HtcTask,
@@ -565,6 +913,85 @@ def create_job_batch(
     If you need more control over the job definition than this function allows,
     then use the :func:`create_job_batch_raw` function instead.
     """
+    payload = [
+        make_job_batch_definition(
+            task=task,
+            batch_size=batch_size,
+            priority=priority,
+            image_name=image_name,
+            exec_timeout_seconds=exec_timeout_seconds,
+            job_name=job_name,
+            max_vcpus=max_vcpus,
+            max_memory_mib=max_memory_mib,
+            max_swap_mib=max_swap_mib,
+            max_disk_gib=max_disk_gib,
+            job_tags=job_tags,
+            batch_tags=batch_tags,
+            commands=commands,
+            envs=envs,
+            claims=claims,
+            architecture=architecture,
+            region=region,
+        )
+    ]
+    return create_job_batch_raw(rescale, task, payload=payload)
+
+
+def make_job_batch_definition(
+    task: HtcTask,
+    batch_size: int,
+    priority: str,
+    image_name: str,
+    exec_timeout_seconds: int,
+    job_name: str = "rescalehtc_default_jobname",
+    max_vcpus: int = 1,
+    max_memory_mib: int = 4000,
+    max_swap_mib: int = 0,
+    max_disk_gib: int = 10,
+    job_tags: dict = {},
+    batch_tags: list = [],
+    commands: list = [],
+    envs: list = [],
+    claims: list = [],
+    architecture: str = "AARCH64",
+    region: str = None,
+) -> dict:
+    """
+    Build the definition of a batch of Rescale jobs, in the form expected by
+    :func:`create_job_batches_raw`, without submitting it. Inputs are split
+    into python arguments, with many arguments having default values, and are
+    validated like in :func:`create_job_batch`.
+
+    Use this to submit many different job definitions in a few requests:
+
+    .. code-block:: python
+
+        definitions = [
+            htcjobs.make_job_batch_definition(
+                task, batch_size=1, priority="ON_DEMAND_ECONOMY", image_name=image,
+                exec_timeout_seconds=600, commands=["python", "run.py", str(parameter)],
+            )
+            for parameter in parameters
+        ]
+        batches = htcjobs.create_job_batches_raw(htcs, task, definitions)
+
+    :param batch_size: The number of instances of this job to run
+    :param priority: Job priority, one of [ON_DEMAND_ECONOMY, ON_DEMAND_PRIORITY]
+    :param image_name: The container image name in the Rescale container registry to run
+    :param exec_timeout_seconds: Number of seconds this container can execute for until it is stopped by timeout
+    :param job_name: Optional: The name of the job batch
+    :param max_vcpus: Optional: Number of vCPUs allocated to this container
+    :param max_memory_mib: Optional: Maximum RAM usage for this container, in MiB
+    :param max_swap_mib: Optional: Maximum Swap usage for this container, in MiB
+    :param max_disk_gib: Optional: Maximum disk usage for this container, in GiB
+    :param job_tags: Optional: Tags given to each job in a batch
+    :param batch_tags: Optional: Tags given to the job batch
+    :param commands: Optional: The command to run in the container, in list form: ['bash', '-c', 'echo hello world']
+    :param envs: A list of environment variables to use in the run, as a list of dicts: [{"name": "MY_ENV_VAR", "value": "value_of_my_env_var"},..]
+    :param claims: Optional: Custom JWT Claims that will be attached to the Rescale JWT Bearer Token, as a list of dicts: [{"name": "my_claim_name", "value": "my_claim_value"},..] . Note that the name given here is prefixed by userDefined\_ in the actual JWT. Use :func:`rescalehtc.bearer_token.BearerToken.get_user_claims` to retrieve custom claims easily.
+    :param architecture: Optional: The architecture to run container on, one of [ AARCH64, A100, X86 ]
+    :param region: Optional: The compute region to run the container in. If the Rescale Project only has a single region this value can remain as None, and the available region will be picked.
+    """
     if region == None:
         if len(task.project.json["regions"]) != 1:
             raise HtcException(
@@ -632,30 +1059,27 @@ def create_job_batch(
             f"During job creation, architecture was set to unsupported value {architecture}. Valid values are {supported_architecture_types}"
         )
 
-    payload = [
-        {
-            "jobName": job_name,
-            "batchSize": batch_size,
-            "tags": batch_tags,
-            "region": selected_region,
-            "cloudProvider": cloud_provider,
-            "htcJobDefinition": {
-                "imageName": image_name,
-                "maxVCpus": max_vcpus,
-                "maxMemory": max_memory_mib,
-                "maxDiskGiB": max_disk_gib,
-                "maxSwap": max_swap_mib,
-                "tags": job_tags,
-                "commands": commands,
-                "envs": envs,
-                "claims": claims,
-                "execTimeoutSeconds": exec_timeout_seconds,
-                "architecture": architecture,
-                "priority": priority,
-            },
-        }
-    ]
-    return create_job_batch_raw(rescale, task, payload=payload)
+    return {
+        "jobName": job_name,
+        "batchSize": batch_size,
+        "tags": batch_tags,
+        "region": selected_region,
+        "cloudProvider": cloud_provider,
+        "htcJobDefinition": {
+            "imageName": image_name,
+            "maxVCpus": max_vcpus,
+            "maxMemory": max_memory_mib,
+            "maxDiskGiB": max_disk_gib,
+            "maxSwap": max_swap_mib,
+            "tags": job_tags,
+            "commands": commands,
+            "envs": envs,
+            "claims": claims,
+            "execTimeoutSeconds": exec_timeout_seconds,
+            "architecture": architecture,
+            "priority": priority,
+        },
+    }
 
 
 def create_job_batch_raw(
@@ -666,47 +1090,121 @@ def create_job_batch_raw(
 
     :param payload: The full JSON dict expected by the POST /htc/projects/{projectId}/tasks/{taskId}/jobs/batch endpoint
 
+    Only the first batch of the payload is returned. To submit several job
+    definitions at once, use :func:`create_job_batches_raw`, which returns all
+    of them.
+
     Most users should use :func:`create_job_batch` instead of this raw function. That function
     accepts separate arguments for the individual fields instead of the full JSON dict.
     """
+    return create_job_batches_raw(rescale, task, payload)[0]
+
+
+def create_job_batches_raw(
+    rescale: HtcSession,
+    task: HtcTask,
+    payload: list[dict],
+    max_batches_per_request: int = MAX_JOB_BATCHES_PER_SUBMISSION,
+    journal: Optional[SubmissionJournal] = None,
+    journal_offset: int = 0,
+) -> list[HtcJobBatch]:
+    """
+    This function creates many batches of Rescale jobs, which may each have a
+    different job definition, in as few requests as possible.
+
+    The payload is split into chunks of at most max_batches_per_request
+    definitions, which are submitted one after the other. The container images
+    of a chunk are checked for readiness before it is submitted, unless they
+    were ready recently.
+    Returns a HtcJobBatch for every job batch returned by the API, which is
+    one for every definition in the payload, in the same order. If the API
+    returns a different number of job batches, a warning is logged and they
+    are returned as they are, since the jobs have been created.
+
+    :param payload: A list of job batch definitions, as expected by the POST /htc/projects/{projectId}/tasks/{taskId}/jobs/batch endpoint. Use :func:`make_job_batch_definition` to build them.
+    :param max_batches_per_request: Optional: The maximum number of definitions sent in one request.
+    :param journal: Optional: A :class:`rescalehtc.journal.SubmissionJournal` recording every chunk before and after it is submitted. Chunks that the journal recorded as submitted are not submitted again, and their recorded job batches are returned instead. Use this to resume a submission that was interrupted.
+    :param journal_offset: Optional: The position of the first definition of the payload within the sweep recorded in the journal, when a sweep is submitted in several calls.
+
+    If submitting a chunk fails, the chunks before it have been submitted. The
+    exception is raised without submitting the remaining chunks.
+    """
     if isinstance(task, HtcTask):
         task_id = task.json["taskId"]
         project_id = task.json["projectId"]
     else:
         raise HtcException("Provided argument task is not a HtcTask object.")
 
-    # Wait for the image to transition to the ready stage
-    # Loop over each batch definition if there are multiple
-    for job_batch in payload:
-        waited_for = 0
-        wait_interval = 10
-        image_name = job_batch["htcJobDefinition"]["imageName"]
-        while True:
-            if waited_for > MAX_WAIT_FOR_IMAGE_TRANSITION_PENDING_READY_SECONDS:
-                raise HtcException(
-                    f"While waiting for {image_name} to transition from PENDING to READY, waited longer than timeout {MAX_WAIT_FOR_IMAGE_TRANSITION_PENDING_READY_SECONDS}."
-                )
-            image_status = api.get_htc_projects_container_registry_images(
-                rescale, task.project.json["projectId"], image_name
-            )
+    if len(payload) == 0:
+        raise HtcException("Provided payload contains no job batch definitions.")
+    if max_batches_per_request < 1:
+        raise HtcException(
+            f"max_batches_per_request must be at least 1, got {max_batches_per_request}"
+        )
 
-            # When the image is ready, continue
-            if image_status["status"] == "READY":
-                break
-            elif image_status["status"] == "PENDING":
-                waited_for += wait_interval
-                time.sleep(wait_interval)
-            else:
-                raise HtcException(
-                    f"Unexpected status of an image recieved, got {image_status} for {image_name}."
+    def wait_for_images(chunk):
+        # Wait for the images to transition to the ready stage. Images that
+        # were ready recently are not checked again.
+        for image_name in dict.fromkeys(
+            job_batch["htcJobDefinition"]["imageName"] for job_batch in chunk
+        ):
+            wait_for_image_ready(rescale, task, image_name)
+
+    def submit(chunk):
+        res = api.post_htc_projects_tasks_jobs_batch(
+            rescale, project_id, task_id, payload=chunk
+        )
+        # The API returns one batch per definition, in order. The jobs were
+        # created either way, so return what the API returned for the caller
+        # to reconcile, instead of losing it.
+        if len(res) != len(chunk):
+            logger.warning(
+                f"Submitted {len(chunk)} job batch definitions, but the API returned {len(res)} job batches: {res}"
+            )
+        return res
+
+    job_batches = []
+    for chunk_start in range(0, len(payload), max_batches_per_request):
+        chunk = payload[chunk_start : chunk_start + max_batches_per_request]
+        if journal is not None:
+            res = journal.get_submitted(task_id, journal_offset + chunk_start, chunk)
+            if res is None:
+                # Only the POST is journaled, so that a chunk whose images
+                # never became ready isn't recorded as interrupted
+                wait_for_images(chunk)
+                res = journal.submit_chunk(
+                    task_id, journal_offset + chunk_start, chunk, lambda: submit(chunk)
                 )
+        else:
+            wait_for_images(chunk)
+            res = submit(chunk)
+        job_batches.extend(HtcJobBatch(job_batch, task) for job_batch in res)
+        logger.debug(
+            f"Submitted {len(job_batches)} of {len(payload)} job batch definitions, task id {task_id}"
+        )
+    return job_batches
 
-    res = api.post_htc_projects_tasks_jobs_batch(
-        rescale, project_id, task_id, payload=payload
+
+def wait_for_image_ready(rescale: HtcSession, task: HtcTask, image_name: str):
+    """
+    Wait for a container image in the registry of the task's project to
+    transition from PENDING to READY. Raises a HtcException if the image has
+    another status, or is still PENDING after
+    MAX_WAIT_FOR_IMAGE_TRANSITION_PENDING_READY_SECONDS.
+
+    Images that were READY recently are not checked again, and threads waiting
+    for the same image share the polling, see the image_readiness argument of
+    :class:`rescalehtc.htcsession.HtcSession`.
+
+    This is done implicitly before jobs are submitted, so most users don't need
+    to call it.
+    """
+    project_id = task.project.json["projectId"]
+    rescale.image_readiness.wait_until_ready(
+        (rescale.auth_identity, project_id),
+        image_name,
+        lambda: api.get_htc_projects_container_registry_images(rescale, project_id, image_name),
     )
-    # We only support a single batch per API call here, so safe to
-    # index into the first one.
-    return HtcJobBatch(res[0], task)
 
 
 # A generator that returns the lines of a file in reverse order
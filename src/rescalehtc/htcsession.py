@@ -1,13 +1,23 @@
 from __future__ import annotations
 from typing import Optional
+import asyncio
+import hashlib
 
-import requests
 from .bearer_token import BearerToken
-from .internals import authenticate, constants
+from .internals import authenticate, constants, fork_safety
+from .internals.concurrency import ConcurrencyController
+from .internals.image_readiness import ImageReadinessCache
+from .internals.polling import AdaptivePollingPolicy
+from .internals.retry import RetryPolicy
+from .internals.response_cache import ResponseCache
+from .internals.token_registry import SharedCredentials, TokenRegistry, token_registry
 from . import bearer_token
 from .logger import logger
+from .exceptions import HtcException
 from datetime import datetime, timedelta
 import random
+import threading
+import time
 
 class HtcSession:
     """
@@ -35,13 +45,50 @@ class HtcSession:
     later operations.
 
     Alternatively, you can pass the API key directly to the HtcSession initializer.
+
+    Sessions can be pickled, e.g. to pass them to ``multiprocessing`` workers.
+    The pickle holds the settings of the session and where its credentials come
+    from, i.e. the workspace and configuration folder, or the API key if one was
+    passed to the initializer. It never holds the bearer token: the receiving
+    process authenticates on first use, unless a session with the same
+    credentials already has a token there. Treat pickles of sessions created
+    with an API key as secrets.
     """
 
-    def __init__(self, workspace: str = "default", config_folder_override: Optional[str] = None, api_key: Optional[str] = None):
+    is_async = False
+    """
+    True for sessions where the :mod:`rescalehtc.api` functions return awaitables,
+    see :class:`rescalehtc.htcsession.AsyncHtcSession`.
+    """
+
+    def __init__(
+        self,
+        workspace: str = "default",
+        config_folder_override: Optional[str] = None,
+        api_key: Optional[str] = None,
+        concurrency: Optional[ConcurrencyController] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        response_cache: Optional[ResponseCache] = None,
+        background_refresh: bool = False,
+        share_credentials: bool = True,
+        lazy: bool = False,
+        thread_local_sessions: bool = False,
+        image_readiness: Optional[ImageReadinessCache] = None,
+        polling_policy: Optional[AdaptivePollingPolicy] = None,
+    ):
         """
         :param workspace: Optional: If you are working with multiple workspaces (which each has their own API key), then specify the workspace name here. This is required if you have more than 1 API key in ~/.config/rescalehtc/.
         :param config_folder_override: Optional: Override the default configuration folder, which by default is ~/.config/.rescalehtc/.
         :param api_key: Optional; str: If you want to authenticate with an API key directly, you can provide it here. If specified, the workspace and config_folder_override arguments will be ignored.
+        :param concurrency: Optional: A ``rescalehtc.internals.concurrency.ConcurrencyController`` limiting the number of concurrent API connections of this session. By default each session gets its own, with adaptive limits for reads, submissions and logs.
+        :param retry_policy: Optional: A ``rescalehtc.internals.retry.RetryPolicy`` deciding how API requests that fail with transient errors like HTTP 429 or 503 are retried. By default, idempotent requests are retried up to 5 times with exponential backoff. Pass ``RetryPolicy(max_attempts=1)`` to disable retries.
+        :param response_cache: Optional: A ``rescalehtc.internals.response_cache.ResponseCache`` for the responses of metadata endpoints like projects, regions and limits. Repeated reads are then answered from memory or revalidated with a conditional GET. Disabled by default.
+        :param background_refresh: Optional: Renew the bearer token ahead of its expiry in a background thread, instead of within the API call that happens to find it close to expiry. See :func:`rescalehtc.htcsession.HtcSession.start_background_refresh`.
+        :param share_credentials: Optional: Share the bearer token and HTTP connections with the other sessions in this process that use the same credentials, so that creating a session is nearly free after the first one. Set to False to give this session its own.
+        :param lazy: Optional: Don't authenticate until the first API call or use of the bearer token. Useful for short-lived scripts that may not need the API at all.
+        :param thread_local_sessions: Optional: Give each thread that uses this session its own ``requests.Session``, instead of sharing one between all threads. The connection pools are sized to the concurrency limits either way, see :func:`rescalehtc.htcsession.HtcSession.get_connection_stats`.
+        :param image_readiness: Optional: A ``rescalehtc.internals.image_readiness.ImageReadinessCache`` remembering which container images are READY, so that jobs using them are submitted without checking the image first. By default each session gets its own, which remembers READY images for 10 minutes.
+        :param polling_policy: Optional: A ``rescalehtc.internals.polling.AdaptivePollingPolicy`` deciding how long task summaries, job statuses and logs are reused before they are refreshed. By default the interval is 15 seconds after a change, and grows up to 2 minutes while nothing changes, unless a task or job is expected to finish sooner.
         """
 
         self.workspace = workspace
@@ -50,35 +97,288 @@ class HtcSession:
         self.RESCALE_API_BASE_URL = HtcSession.get_rescale_api_base_url()
         self.CONFIG_FOLDER = HtcSession.get_config_folder(config_folder_override)
 
-        # Use a shared requests session
-        self.requests_session = requests.Session()
+        # Sessions with the same credentials share the bearer token and the
+        # requests sessions with their connection pools
+        self._credentials_key = TokenRegistry.make_key(
+            self.RESCALE_API_BASE_URL, self.CONFIG_FOLDER, workspace, api_key
+        )
+        self._share_credentials = share_credentials
+        self._thread_local_sessions = thread_local_sessions
+
+        # Limits on concurrent connections, which adapt to what the API can sustain
+        self.concurrency = concurrency if concurrency is not None else ConcurrencyController()
+
+        self._attach_credentials()
+        self._fork_generation = fork_safety.generation
+
+        # Retry transient API errors with backoff, instead of failing on the first one
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+        # Optional cache for metadata responses
+        self.response_cache = response_cache
+
+        # Container images known to be READY for job submission
+        self.image_readiness = image_readiness if image_readiness is not None else ImageReadinessCache()
+
+        # Intervals between refreshes of tasks and jobs
+        self.polling_policy = polling_policy if polling_policy is not None else AdaptivePollingPolicy()
+
+        # Identifies the credentials of this session without containing them, used
+        # to make sure cached responses are never shared between different users
+        self.auth_identity = hashlib.sha256(repr(self._credentials_key).encode()).hexdigest()
         self.api_key = api_key
-        self.do_authenticate()
 
-    # Perform authentication and set member variables
+        self._refresher_thread = None
+        self._refresher_stop = None
+        # Only authenticate if no other session has a token for us yet
+        if not lazy:
+            self.reauthenticate_if_needed()
+
+        if background_refresh:
+            self.start_background_refresh()
+
+    # Use the credentials for this session from the registry, or private ones,
+    # keeping the token of previous credentials if there is no token there yet
+    def _attach_credentials(self, previous: Optional[SharedCredentials] = None):
+        if self._share_credentials:
+            self._credentials = token_registry.get(self._credentials_key)
+        else:
+            self._credentials = SharedCredentials()
+        if previous is not None and previous.auth is not None:
+            with self._credentials.lock:
+                if self._credentials.auth is None:
+                    self._credentials.bearer_json = previous.bearer_json
+                    self._credentials.bearer_expiry = previous.bearer_expiry
+                    self._credentials.auth = previous.auth
+        # Keep a connection open for every request the session may have in flight
+        self._credentials.transport.ensure_pool_size(self.concurrency.get_max_connections())
+
+    @property
+    def requests_session(self):
+        """
+        The ``requests.Session`` used for API requests from the calling thread.
+        """
+        return self._credentials.transport.get_session(self._thread_local_sessions)
+
+    def get_connection_stats(self) -> dict:
+        """
+        Return statistics about the HTTP connections of this session, which are
+        shared with the other sessions that use the same credentials, as a dict
+        with the keys:
+
+        - ``sessions``: The number of ``requests.Session`` objects in use.
+        - ``requests``: The number of HTTP requests sent.
+        - ``connections_created``: The number of connections opened.
+        - ``connections_reused``: The number of requests sent over a connection
+          that was already open.
+        """
+        return self._credentials.transport.get_stats()
+
+    # Sessions are pickled as a lightweight description: the settings and the
+    # source of the credentials, but never the bearer token. The receiving
+    # process takes the token from its token registry, or authenticates on first
+    # use. Connections, locks and threads are recreated.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_credentials"]
+        state["_background_refresh"] = self._refresher_thread is not None
+        state["_refresher_thread"] = None
+        state["_refresher_stop"] = None
+        return state
+
+    def __setstate__(self, state):
+        background_refresh = state.pop("_background_refresh")
+        self.__dict__.update(state)
+        self._attach_credentials()
+        self._fork_generation = fork_safety.generation
+        if background_refresh:
+            self.start_background_refresh()
+
+    def check_fork(self):
+        """
+        Rebuild the connection pool, locks and background threads of this
+        session if it is used in a forked child of the process that created it.
+        This is called before every API request, so there is no need to call it
+        yourself.
+        """
+        if self._fork_generation != fork_safety.generation:
+            self._reinit_after_fork()
+
+    def _reinit_after_fork(self):
+        logger.debug("HtcSession used in a forked process, rebuilding its connections.")
+        # The token is still valid, but the connections belong to the parent
+        self._attach_credentials(self._credentials)
+
+        # Copies start with fresh locks and no requests in flight, keeping the
+        # adapted limits and retry budget. Sessions that shared these objects,
+        # like those of a MultiWorkspaceSession, share the copies.
+        self.concurrency = fork_safety.copy_after_fork(self.concurrency)
+        self.retry_policy = fork_safety.copy_after_fork(self.retry_policy)
+        if self.response_cache is not None:
+            self.response_cache = fork_safety.copy_after_fork(self.response_cache)
+        self.image_readiness = fork_safety.copy_after_fork(self.image_readiness)
+        self.polling_policy = fork_safety.copy_after_fork(self.polling_policy)
+
+        # Threads don't survive a fork
+        background_refresh = self._refresher_thread is not None
+        self._refresher_thread = None
+        self._refresher_stop = None
+        self._fork_generation = fork_safety.generation
+        if background_refresh:
+            self.start_background_refresh()
+
+    # Return the token state, authenticating first if this is a lazy session
+    # that hasn't done so yet
+    def _get_auth(self) -> tuple:
+        auth = self._credentials.auth
+        if auth is None:
+            self.renew_token_if_needed()
+            auth = self._credentials.auth
+        return auth
+
+    @property
+    def RESCALE_HTC_BEARER_TOKEN(self) -> str:
+        return self._get_auth()[0]
+
+    @RESCALE_HTC_BEARER_TOKEN.setter
+    def RESCALE_HTC_BEARER_TOKEN(self, token: str):
+        self._credentials.auth = (token, f"Bearer {token}", self._get_auth()[2])
+
+    @property
+    def auth_header(self) -> str:
+        """The Authorization header value for the current bearer token."""
+        return self._get_auth()[1]
+
+    @property
+    def bearer_json(self) -> dict:
+        self._get_auth()
+        return self._credentials.bearer_json
+
+    # Setting the bearer JSON switches all sessions sharing the credentials to its token
+    @bearer_json.setter
+    def bearer_json(self, bearer_json: dict):
+        with self._credentials.lock:
+            self._set_bearer_json(bearer_json)
+
+    @property
+    def bearer_expiry(self) -> datetime:
+        self._get_auth()
+        return self._credentials.bearer_expiry
+
+    # Setting the expiry keeps the token, and moves its renewal time along
+    @bearer_expiry.setter
+    def bearer_expiry(self, bearer_expiry: datetime):
+        token = self._get_auth()[0]
+        with self._credentials.lock:
+            self._credentials.bearer_expiry = bearer_expiry
+            self._credentials.auth = (token, f"Bearer {token}", self._get_renew_at(bearer_expiry))
+
+    # Perform authentication and set the shared token state
     def do_authenticate(self):
         if self.api_key is not None:
-            self.bearer_json = authenticate.request_new_bearer_token(
+            bearer_json = authenticate.request_new_bearer_token(
                 self.requests_session, self.api_key, self.RESCALE_API_BASE_URL
             )
         else:
-            self.bearer_json = authenticate.get_bearer_json(
+            bearer_json = authenticate.get_bearer_json(
                 self.requests_session, self.workspace, self.CONFIG_FOLDER, self.RESCALE_API_BASE_URL
             )
-        self.bearer_expiry = datetime.fromisoformat(self.bearer_json["expiresAt"])
-        self.RESCALE_HTC_BEARER_TOKEN = self.bearer_json["tokenValue"]
+        self._set_bearer_json(bearer_json)
+
+    # Minimum time remaining is random between 2h and 2h20m, this reduces the odds
+    # of write collisions for the bearer token. The renewal time is computed once
+    # per token, so that checking it before each request is a single comparison.
+    @staticmethod
+    def _get_renew_at(bearer_expiry: datetime) -> float:
+        renew_at = bearer_expiry - timedelta(
+            seconds=constants.BEARER_TOKEN_RENEW_MARGIN_SECONDS
+            + random.uniform(0, constants.BEARER_TOKEN_RENEW_JITTER_SECONDS)
+        )
+        return renew_at.timestamp()
+
+    # Set the shared token state from a bearer JSON, with the credentials lock held
+    def _set_bearer_json(self, bearer_json: dict):
+        bearer_expiry = datetime.fromisoformat(bearer_json["expiresAt"])
+        token = bearer_json["tokenValue"]
+
+        # Swap the token, header and renewal time in a single assignment, so that
+        # other threads never see a mix of the old and new token
+        self._credentials.bearer_json = bearer_json
+        self._credentials.bearer_expiry = bearer_expiry
+        self._credentials.auth = (token, f"Bearer {token}", self._get_renew_at(bearer_expiry))
+
+    # Check if the bearer token has too little time left and should be renewed
+    def needs_reauthentication(self) -> bool:
+        auth = self._credentials.auth
+        return auth is None or time.time() > auth[2]
+
+    # Check if an API call should renew the token before it is sent. With a
+    # background refresher, this is only the case if the token is about to expire
+    # anyway, e.g. because the refresher keeps failing.
+    def needs_reauthentication_on_request(self) -> bool:
+        if not self.needs_reauthentication():
+            return False
+        return (
+            self._refresher_thread is None
+            or self._credentials.auth is None
+            or time.time() > self._credentials.bearer_expiry.timestamp() - 60
+        )
+
+    # Renew the token unless another thread already did so while we waited for the lock
+    def renew_token_if_needed(self):
+        with self._credentials.lock:
+            if self.needs_reauthentication():
+                logger.debug("Reauthenticating check determined that bearer token should be renewed.")
+                self.do_authenticate()
 
     # Check if the bearer token has sufficient time left, and if not renew it
     def reauthenticate_if_needed(self):
-        now = datetime.now()
+        if self.needs_reauthentication_on_request():
+            self.renew_token_if_needed()
+
+    def start_background_refresh(self):
+        """
+        Start a daemon thread that renews the bearer token ahead of its expiry.
+        API calls then only read the current token, and never wait for a renewal.
+        If a renewal fails, it is retried every minute, and API calls fall back to
+        renewing the token themselves shortly before it expires.
+
+        Does nothing if the background refresher is already running.
+        """
+        if self._refresher_thread is not None:
+            return
+        self._refresher_stop = threading.Event()
+        self._refresher_thread = threading.Thread(
+            target=self._background_refresh_loop,
+            args=(self._refresher_stop,),
+            name="rescalehtc-token-refresher",
+            daemon=True,
+        )
+        self._refresher_thread.start()
 
-        # Minimum time remaining is random between 2h and 2h20m, this reduces the odds
-        # of write collisions for the bearer token.
-        minimum_remaining_time = timedelta(hours=2, seconds=random.uniform(0, 20 * 60))
+    def stop_background_refresh(self):
+        """
+        Stop the background refresher started by
+        :func:`rescalehtc.htcsession.HtcSession.start_background_refresh`.
+        """
+        if self._refresher_thread is None:
+            return
+        self._refresher_stop.set()
+        self._refresher_thread.join()
+        self._refresher_thread = None
+        self._refresher_stop = None
 
-        if now + minimum_remaining_time > self.bearer_expiry:
-            logger.debug("Reauthenticating check determined that bearer token should be renewed.")
-            self.do_authenticate()
+    def _background_refresh_loop(self, stop):
+        while True:
+            auth = self._credentials.auth
+            if stop.wait(max(0.0, auth[2] - time.time()) if auth is not None else 0.0):
+                return
+            try:
+                self.renew_token_if_needed()
+            except Exception as e:
+                logger.warning(f"Background renewal of bearer token failed, retrying: {repr(e)}")
+                if stop.wait(constants.BEARER_TOKEN_REFRESH_RETRY_SECONDS):
+                    return
 
     def get_bearer_token(self) -> BearerToken:
         """
@@ -100,3 +400,125 @@ class HtcSession:
             return config_folder_override
         else:
             return constants._CONFIG_FOLDER
+
+
+class AsyncHtcSession(HtcSession):
+    """
+    Variant of :class:`rescalehtc.htcsession.HtcSession` for use with asyncio.
+    Pass this session to the functions in :mod:`rescalehtc.api_async`, which
+    mirror the functions in :mod:`rescalehtc.api` but must be awaited:
+
+    .. code-block:: python
+
+        import asyncio
+        from rescalehtc import AsyncHtcSession, api_async
+
+        async def main():
+            async with AsyncHtcSession() as htcs:
+                jobs = await asyncio.gather(*[
+                    api_async.get_htc_projects_tasks_jobs(htcs, project_id, task_id, job_id)
+                    for job_id in job_ids
+                ])
+
+        asyncio.run(main())
+
+    All requests are sent from a single event loop. The number of requests in
+    flight adapts to the API as for HtcSession, using the same per-endpoint-class
+    limits, and never exceeds ``max_concurrent_connections``. This requires the
+    ``aiohttp`` package, install it with ``pip install rescalehtc[async]``.
+
+    Authentication works as for HtcSession. Bearer token renewal is rare, and is
+    run in a worker thread so that it does not block the event loop.
+
+    Call :func:`rescalehtc.htcsession.AsyncHtcSession.close` when done with the
+    session, or use it as an async context manager.
+    """
+
+    is_async = True
+
+    def __init__(
+        self,
+        workspace: str = "default",
+        config_folder_override: Optional[str] = None,
+        api_key: Optional[str] = None,
+        max_concurrent_connections: int = constants.MAX_CONCURRENT_ASYNC_API_CONNECTIONS,
+        retry_policy: Optional[RetryPolicy] = None,
+        **kwargs,
+    ):
+        """
+        :param workspace: Optional: See :class:`rescalehtc.htcsession.HtcSession`.
+        :param config_folder_override: Optional: See :class:`rescalehtc.htcsession.HtcSession`.
+        :param api_key: Optional: See :class:`rescalehtc.htcsession.HtcSession`.
+        :param max_concurrent_connections: Optional: Hard cap on the number of connections open at the same time, on top of the adaptive limits of the session.
+        :param retry_policy: Optional: See :class:`rescalehtc.htcsession.HtcSession`.
+        :param kwargs: Optional: The other options of :class:`rescalehtc.htcsession.HtcSession`, e.g. ``concurrency``, ``response_cache`` or ``lazy``. ``thread_local_sessions`` has no effect on the requests of :mod:`rescalehtc.api_async`, which are sent with aiohttp.
+        """
+        super().__init__(workspace, config_folder_override, api_key, retry_policy=retry_policy, **kwargs)
+        self.max_concurrent_connections = max_concurrent_connections
+
+        # The aiohttp session and lock are bound to the event loop, so they are
+        # created on first use from within the running loop.
+        self._client_session = None
+        self._reauthenticate_lock = None
+
+    # The aiohttp session and asyncio primitives are bound to the event loop of
+    # this process, so they are recreated on first use
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_client_session"] = None
+        state["_reauthenticate_lock"] = None
+        return state
+
+    def _reinit_after_fork(self):
+        super()._reinit_after_fork()
+        self._client_session = None
+        self._reauthenticate_lock = None
+
+    async def __aenter__(self) -> AsyncHtcSession:
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def get_client_session(self):
+        """
+        Get the aiohttp ClientSession used by this session, creating it if needed.
+        """
+        if self._client_session is None or self._client_session.closed:
+            try:
+                import aiohttp
+            except ImportError:
+                raise HtcException(
+                    "AsyncHtcSession requires the aiohttp package. "
+                    "Install it with 'pip install rescalehtc[async]'."
+                )
+            connect_timeout, read_timeout = constants.REQUESTS_TIMEOUTS
+            self._client_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrent_connections),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect_timeout, sock_read=read_timeout
+                ),
+            )
+        return self._client_session
+
+    async def reauthenticate_if_needed_async(self):
+        """
+        Asyncio equivalent of reauthenticate_if_needed. Renewal of the bearer
+        token performs blocking IO, so it is run in the default executor.
+        """
+        if not self.needs_reauthentication_on_request():
+            return
+        if self._reauthenticate_lock is None:
+            self._reauthenticate_lock = asyncio.Lock()
+        async with self._reauthenticate_lock:
+            # Another coroutine may have renewed the token while we waited
+            if self.needs_reauthentication():
+                await asyncio.get_running_loop().run_in_executor(None, self.renew_token_if_needed)
+
+    async def close(self):
+        """
+        Close the underlying HTTP connections of this session.
+        """
+        if self._client_session is not None:
+            await self._client_session.close()
+            self._client_session = None
@@ -5,9 +5,12 @@ be used for later library calls.
 """
 from __future__ import annotations
 from datetime import timedelta, datetime
-from .internals.constants import FLOOD_PREVENTION_INTERVAL_SECONDS
+from typing import Iterator, Optional
+from .internals.constants import PAGINATION_PREFETCH_PAGES
+from .internals.polling import PollingState
 from .exceptions import HtcException
 from .htcprojects import HtcProject
+from .records import TaskRecord
 from . import HtcSession, api
 from .logger import logger
 
@@ -48,6 +51,10 @@ class HtcTask:
         now = datetime.now()
         self.task_summary_updated_at = now - timedelta(hours=1)
         self.task_summary = None
+        self.task_summary_polling: Optional[PollingState] = None
+        """The interval between updates of the task summary, which adapts to
+        how often the summary changes. Created from the polling policy of the
+        session on the first update."""
 
     def __repr__(self):
         return "HtcTask(" + str(self.json) + ")"
@@ -80,33 +87,51 @@ class HtcTask:
 
         This function has basic flood prevention on the job status requests.
         The API never updates more than every 30 seconds anyway, so calling
-        this function more often than that has no effect.
+        this function more often than that has no effect. The interval between
+        requests grows while the summary doesn't change, see the polling_policy
+        argument of :class:`rescalehtc.htcsession.HtcSession`.
         """
+        if self.task_summary_polling is None:
+            self.task_summary_polling = rescale.polling_policy.new_state()
         now = datetime.now()
 
         time_since_last_update = now - self.task_summary_updated_at
         if time_since_last_update > timedelta(
-            seconds=FLOOD_PREVENTION_INTERVAL_SECONDS
+            seconds=self.task_summary_polling.interval
         ):
-            self.task_summary = api.get_htc_projects_tasks_summary_statistics(
-                rescale, self.json["projectId"], self.json["taskId"]
-            )
-            logger.debug(f"Updated task summary, task id {self.json['taskId']}")
-            self.task_summary["still_running"] = (
-                self.task_summary["jobStatuses"]["SUBMITTED_TO_RESCALE"] > 0
-                or self.task_summary["jobStatuses"]["SUBMITTED_TO_PROVIDER"] > 0
-                or self.task_summary["jobStatuses"]["RUNNABLE"] > 0
-                or self.task_summary["jobStatuses"]["STARTING"] > 0
-                or self.task_summary["jobStatuses"]["RUNNING"] > 0
-            )
-            self.task_summary_updated_at = datetime.now()
+            self.refresh_task_summary(rescale)
         else:
             logger.debug(
-                f"Skipped updating task summarys since last request was {time_since_last_update} ago, less than {FLOOD_PREVENTION_INTERVAL_SECONDS} seconds, taskId {self.json['taskId']}"
+                f"Skipped updating task summarys since last request was {time_since_last_update} ago, less than {self.task_summary_polling.interval:.0f} seconds, taskId {self.json['taskId']}"
             )
 
         return self.task_summary
 
+    def refresh_task_summary(self, rescale: HtcSession) -> dict:
+        """
+        Fetch the task summary from the API, bypassing the flood prevention of
+        :func:`rescalehtc.htctasks.HtcTask.get_task_summary`, and return it.
+        Later calls of get_task_summary return this summary until it is due for
+        an update.
+        """
+        task_summary = api.get_htc_projects_tasks_summary_statistics(
+            rescale, self.json["projectId"], self.json["taskId"]
+        )
+        logger.debug(f"Updated task summary, task id {self.json['taskId']}")
+        task_summary["still_running"] = (
+            task_summary["jobStatuses"]["SUBMITTED_TO_RESCALE"] > 0
+            or task_summary["jobStatuses"]["SUBMITTED_TO_PROVIDER"] > 0
+            or task_summary["jobStatuses"]["RUNNABLE"] > 0
+            or task_summary["jobStatuses"]["STARTING"] > 0
+            or task_summary["jobStatuses"]["RUNNING"] > 0
+        )
+        if self.task_summary_polling is None:
+            self.task_summary_polling = rescale.polling_policy.new_state()
+        rescale.polling_policy.observe_task_summary(self.task_summary_polling, task_summary)
+        self.task_summary = task_summary
+        self.task_summary_updated_at = datetime.now()
+        return task_summary
+
     def is_still_running(self, rescale: HtcSession) -> bool:
         """
         Returns false if all jobs within this task are in the SUCCEEDED or FAILED states,
@@ -123,6 +148,9 @@ class HtcTask:
             print("Completed all jobs in task")
             print(task.get_task_summary())
 
+        To wait for many tasks, use :class:`rescalehtc.monitor.TaskMonitor`,
+        which polls all of them from one scheduler.
+
         This function has basic flood prevention on the job status requests.
         The API never updates more than every 30 seconds anyway, so calling
         this function more often than that has no effect.
@@ -156,23 +184,12 @@ def get_tasks_with_name(
     a given lifecycle_status. To find tasks in any lifecycle_status task, set lifecycle_status to
     ``any``. Returns a list of HtcTask objects.
     """
-    if isinstance(project, HtcProject):
-        project_id = project.json["projectId"]
-    else:
+    if not isinstance(project, HtcProject):
         raise HtcException(
             "Provided project argument is not a HtcProject object."
         )
 
-    any_lifecycle_status = True if lifecycle_status in ["any", "all", None] else False
-
-    all_tasks = api.get_htc_projects_tasks(rescale, project_id)
-    name_matching_tasks = [
-        HtcTask(task_json, project)
-        for task_json in all_tasks
-        if task_json["taskName"] == task_name
-        and (any_lifecycle_status or task_json["lifecycleStatus"] == lifecycle_status)
-    ]
-    return name_matching_tasks
+    return list(iter_tasks(rescale, project, lifecycle_status, task_name=task_name))
 
 
 def get_task_with_id(
@@ -199,6 +216,39 @@ def get_task_with_id(
     return HtcTask(task, project)
 
 
+def iter_tasks(
+    rescale: HtcSession,
+    project: HtcProject,
+    lifecycle_status: str = "ACTIVE",
+    prefetch_pages: int = PAGINATION_PREFETCH_PAGES,
+    task_name: Optional[str] = None,
+) -> Iterator[HtcTask]:
+    """
+    Iterate over all tasks within a given project that matches a given lifecycle_status.
+    To find tasks in any lifecycle_status task, set lifecycle_status to
+    ``any``. Yields HtcTask objects as each page of results arrives from the API.
+
+    :param prefetch_pages: Optional: Number of pages of tasks to fetch ahead in the background while the caller processes the current page. Set to 0 to fetch pages only when needed.
+    :param task_name: Optional: Only yield tasks with this exact name.
+    """
+    # Validated here rather than in a generator, so that errors are raised on the call
+    if not isinstance(project, HtcProject):
+        raise HtcException(
+            "Provided project argument is not a HtcProject object."
+        )
+
+    any_lifecycle_status = True if lifecycle_status in ["any", "all", None] else False
+
+    # The API filters on lifecycleStatus, so other tasks are never transferred.
+    # The listing is a generator as well, so no request is made until iterated.
+    task_jsons = api.iter_htc_projects_tasks(
+        rescale, project.json["projectId"], prefetch_pages=prefetch_pages,
+        lifecycle_status=None if any_lifecycle_status else lifecycle_status,
+        task_name=task_name,
+    )
+    return (HtcTask(task_json, project) for task_json in task_jsons)
+
+
 def get_tasks(
     rescale: HtcSession, project: HtcProject, lifecycle_status: str = "ACTIVE"
 ) -> list[HtcTask]:
@@ -207,22 +257,12 @@ def get_tasks(
     To find tasks in any lifecycle_status task, set lifecycle_status to
     ``any``. Returns a list of HtcTask objects.
     """
-    if isinstance(project, HtcProject):
-        project_id = project.json["projectId"]
-    else:
+    if not isinstance(project, HtcProject):
         raise HtcException(
             "Provided project argument is not a HtcProject object."
         )
 
-    any_lifecycle_status = True if lifecycle_status in ["any", "all", None] else False
-
-    all_tasks = api.get_htc_projects_tasks(rescale, project_id)
-    name_matching_tasks = [
-        HtcTask(task_json, project)
-        for task_json in all_tasks
-        if (any_lifecycle_status or task_json["lifecycleStatus"] == lifecycle_status)
-    ]
-    return name_matching_tasks
+    return list(iter_tasks(rescale, project, lifecycle_status))
 
 
 def create_task_with_name(
@@ -307,3 +347,27 @@ def delete_task_with_id(
             return None
         else:
             raise
+
+
+def iter_task_records(
+    rescale: HtcSession,
+    project: HtcProject,
+    lifecycle_status: str = "ACTIVE",
+    prefetch_pages: int = PAGINATION_PREFETCH_PAGES,
+) -> Iterator[TaskRecord]:
+    """
+    Like :func:`iter_tasks`, but yields compact :class:`rescalehtc.records.TaskRecord`
+    objects instead of HtcTask objects.
+    """
+    if not isinstance(project, HtcProject):
+        raise HtcException(
+            "Provided project argument is not a HtcProject object."
+        )
+
+    any_lifecycle_status = True if lifecycle_status in ["any", "all", None] else False
+
+    task_jsons = api.iter_htc_projects_tasks(
+        rescale, project.json["projectId"], prefetch_pages=prefetch_pages,
+        lifecycle_status=None if any_lifecycle_status else lifecycle_status,
+    )
+    return (TaskRecord.from_json(task_json) for task_json in task_jsons)
@@ -0,0 +1,146 @@
+# Define asyncio based helper functions for dealing with REST APIs. These mirror
+# the functions in rest_helpers, and are used when the session passed in is an
+# AsyncHtcSession. They return coroutines that must be awaited.
+
+from __future__ import annotations
+import asyncio
+from ..exceptions import HtcException
+from ..logger import logger
+from . import codec, rest_helpers
+
+
+# Handle API results, return either json or text and raise on HTTP errors
+async def format_api_result(res, return_json, endpoint):
+    if res.status >= 400:
+        raise HtcException(
+            f"{res.method} {endpoint} | Response: HTTP {res.status}: {await res.text()}",
+            res.status,
+        )
+    if return_json:
+        return codec.loads(await res.read())
+    return await res.text()
+
+
+# Perform a single authenticated request, gated by the concurrency limit of the session.
+# Transient failures are retried according to the retry policy of the session, as
+# in rest_helpers.api_request.
+async def api_request(
+    rescale, method, endpoint, payload=None, params={}, custom_auth_header=None, return_json=True,
+    retry_safe=False,
+):
+    rescale.check_fork()
+    client_session = await rescale.get_client_session()
+    # Safe to import, get_client_session raises a HtcException if aiohttp is missing
+    import aiohttp
+
+    retry_policy = rescale.retry_policy
+    retry_policy.record_request()
+    retryable_method = retry_policy.is_retryable_method(method, retry_safe)
+    attempt = 0
+    while True:
+        attempt += 1
+        await rescale.reauthenticate_if_needed_async()
+        try:
+            async with rescale.concurrency.request_slot_async(method, endpoint) as slot:
+                async with client_session.request(
+                    method,
+                    endpoint,
+                    headers={
+                        "Authorization":
+                            custom_auth_header if custom_auth_header
+                            else rescale.auth_header
+                    },
+                    json=payload,
+                    params=params,
+                ) as res:
+                    slot.record_status(res.status)
+                    if not (
+                        retryable_method
+                        and retry_policy.is_retryable_status(res.status)
+                        and retry_policy.should_retry(attempt)
+                    ):
+                        # Modifying a resource makes cached responses about it outdated
+                        if method != "GET" and rescale.response_cache is not None:
+                            rescale.response_cache.invalidate(endpoint)
+                        return await format_api_result(res, return_json, endpoint)
+                    delay = retry_policy.get_delay(attempt, res.headers.get("Retry-After"))
+                    logger.debug(f"{method} {endpoint} returned HTTP {res.status}, retrying in {delay:.1f} seconds")
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if not retryable_method or not retry_policy.should_retry(attempt):
+                raise
+            delay = retry_policy.get_delay(attempt)
+            logger.debug(f"{method} {endpoint} failed with {repr(e)}, retrying in {delay:.1f} seconds")
+        await asyncio.sleep(delay)
+
+
+# Wrapper for authenticated GET operation, with pagination support
+async def api_get(
+    rescale, endpoint, params={}, max_items=None, custom_auth_header=None, return_json=True, filters=None
+):
+    params = dict(params)
+    combined_item_res = []
+    remaining_max_items = max_items
+    # Support multiple paginated GET operations if the "next" field in the response is set
+    while endpoint:
+        # If we have a max item count, then adjust the page size accordingly for
+        # the last page.
+        if "pageSize" in params and remaining_max_items is not None:
+            params["pageSize"] = min(params["pageSize"], remaining_max_items)
+
+        last_res_json = await api_request(
+            rescale, "GET", endpoint, params=params,
+            custom_auth_header=custom_auth_header, return_json=return_json,
+        )
+        if not return_json:
+            return last_res_json
+
+        # If there is no "items" key, then just return it immediately. This
+        # happens for some API endpoints like auth/token/whoami
+        if not isinstance(last_res_json, dict) or "items" not in last_res_json:
+            return last_res_json
+
+        items = rest_helpers.filter_items(last_res_json["items"], filters)
+        if remaining_max_items is not None:
+            items = items[:remaining_max_items]
+            remaining_max_items -= len(items)
+        combined_item_res += items
+
+        if remaining_max_items is not None and remaining_max_items <= 0:
+            break
+        endpoint = rest_helpers.get_next_page_endpoint(endpoint, last_res_json)
+
+    return combined_item_res
+
+
+# Wrapper for authenticated POST operation
+async def api_post(
+    rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True, retry_safe=False
+):
+    return await api_request(
+        rescale, "POST", endpoint, payload, params, custom_auth_header, return_json, retry_safe
+    )
+
+
+# Wrapper for authenticated PUT operation
+async def api_put(
+    rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True
+):
+    return await api_request(
+        rescale, "PUT", endpoint, payload, params, custom_auth_header, return_json
+    )
+
+
+# Wrapper for authenticated PATCH operation
+async def api_patch(
+    rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True, retry_safe=False
+):
+    return await api_request(
+        rescale, "PATCH", endpoint, payload, params, custom_auth_header, return_json, retry_safe
+    )
+
+
+# Wrapper for authenticated DELETE operation
+async def api_delete(rescale, endpoint, params={}, custom_auth_header=None, return_json=True):
+    return await api_request(
+        rescale, "DELETE", endpoint, None, params, custom_auth_header, return_json
+    )
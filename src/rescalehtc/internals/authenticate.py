@@ -5,9 +5,9 @@ import datetime
 from typing import Optional
 import requests
 import random
-import threading
 
 from ..internals.constants import REQUESTS_TIMEOUTS
+from .file_lock import file_lock, write_file_atomically
 from ..exceptions import HtcException
 from ..logger import logger
 
@@ -16,8 +16,6 @@ from ..logger import logger
 # lifetime remaining, with either the API key or a refresh token.
 # Writes new token to file afterwards.
 
-semaphore = threading.Semaphore(1)
-
 
 def get_bearer_json(
     requests_session: requests.Session,
@@ -53,45 +51,55 @@ def get_bearer_json(
     # Check for a bearer token with at least ~2 more hours of life left, otherwise request a new one
     bearer_token_file = f"{workspace_config_folder}/rescale_bearer_token.json"
 
-    request_new_token = False
-    if not os.path.isfile(bearer_token_file):
-        logger.debug(f"No existing bearer token in {bearer_token_file}")
-        request_new_token = True
-    else:
-        with open(bearer_token_file) as fp:
-            bearer_json = json.load(fp)
+    bearer_json = read_bearer_json(bearer_token_file)
+    if bearer_json is None:
+        # Many processes may find the token outdated at the same time. Only one of
+        # them renews it, while the others wait for the lock and reuse the result.
+        with file_lock(f"{bearer_token_file}.lock"):
+            bearer_json = read_bearer_json(bearer_token_file)
+            if bearer_json is None:
+                bearer_json = request_new_bearer_token(
+                    requests_session, RESCALE_API_TOKEN, rescale_api_base_url
+                )
+                logger.debug(f"Writing new bearer token to file {bearer_token_file}")
+                write_file_atomically(bearer_token_file, json.dumps(bearer_json))
+            else:
+                logger.debug(f"Reused bearer token renewed by another process from {bearer_token_file}")
 
-            expiry_time = datetime.datetime.fromisoformat(bearer_json["expiresAt"])
+    logger.debug("Authenticated OK.")
 
-            # Minimum time remaining is random between 2h and 2h20m, this reduces the odds
-            # of write collisions for the bearer token.
-            minimum_remaining_time = datetime.timedelta(
-                hours=2, seconds=random.uniform(0, 20 * 60)
-            )
+    return bearer_json
 
-            if datetime.datetime.now() + minimum_remaining_time > expiry_time:
-                logger.debug(
-                    f"Existing bearer token in {bearer_token_file} has expired (needed to be valid for at least {minimum_remaining_time} longer)"
-                )
-                request_new_token = True
-            else:
-                logger.debug(f"Reused existing bearer token from {bearer_token_file}")
 
-    if request_new_token:
+# Read a bearer token from file, returning None if the file is missing, unreadable
+# or the token has too little lifetime left
+def read_bearer_json(bearer_token_file):
+    if not os.path.isfile(bearer_token_file):
+        logger.debug(f"No existing bearer token in {bearer_token_file}")
+        return None
 
-        bearer_json = request_new_bearer_token(
-            requests_session, RESCALE_API_TOKEN, rescale_api_base_url
-        )
-        # Aquire a semaphore to make this thread safe
-        semaphore.acquire()
-        logger.debug(f"Writing new bearer token to file {bearer_token_file}")
-        with open(bearer_token_file, "w") as fp:
-            fp.write(json.dumps(bearer_json))
-        os.chmod(bearer_token_file, 0o600)
-        semaphore.release()
+    try:
+        with open(bearer_token_file) as fp:
+            bearer_json = json.load(fp)
+        expiry_time = datetime.datetime.fromisoformat(bearer_json["expiresAt"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        # E.g. a file truncated by an older version of this library
+        logger.debug(f"Ignoring unreadable bearer token in {bearer_token_file}: {repr(e)}")
+        return None
+
+    # Minimum time remaining is random between 2h and 2h20m, this reduces the odds
+    # of write collisions for the bearer token.
+    minimum_remaining_time = datetime.timedelta(
+        hours=2, seconds=random.uniform(0, 20 * 60)
+    )
 
-    logger.debug("Authenticated OK.")
+    if datetime.datetime.now() + minimum_remaining_time > expiry_time:
+        logger.debug(
+            f"Existing bearer token in {bearer_token_file} has expired (needed to be valid for at least {minimum_remaining_time} longer)"
+        )
+        return None
 
+    logger.debug(f"Reused existing bearer token from {bearer_token_file}")
     return bearer_json
 
 
@@ -0,0 +1,77 @@
+# JSON decoding of API responses.
+#
+# Job and log listings can run into hundreds of thousands of records, where
+# parsing dominates the CPU time of the client. If orjson or msgspec is
+# installed, it is used instead of the json module from the standard library.
+# All backends return the same plain dicts and lists.
+
+from __future__ import annotations
+import json
+
+from ..exceptions import HtcException
+
+
+def _make_orjson_loads():
+    import orjson
+
+    return orjson.loads
+
+
+def _make_msgspec_loads():
+    import msgspec
+
+    return msgspec.json.Decoder().decode
+
+
+def _make_json_loads():
+    return json.loads
+
+
+# Backends in order of preference
+BACKENDS = {
+    "orjson": _make_orjson_loads,
+    "msgspec": _make_msgspec_loads,
+    "json": _make_json_loads,
+}
+
+_backend = None
+_loads = None
+
+
+def set_backend(name: str = None):
+    """
+    Select the JSON backend by name, one of orjson, msgspec or json. If no name
+    is given, use the fastest backend that is installed.
+    """
+    global _backend, _loads
+    if name is None:
+        for candidate in BACKENDS:
+            try:
+                set_backend(candidate)
+                return
+            except HtcException:
+                pass
+    if name not in BACKENDS:
+        raise HtcException(f"Unknown JSON backend {name}, expected one of {list(BACKENDS)}")
+    try:
+        _loads = BACKENDS[name]()
+    except ImportError:
+        raise HtcException(f"JSON backend {name} is not installed")
+    _backend = name
+
+
+def get_backend() -> str:
+    """
+    Return the name of the JSON backend in use.
+    """
+    return _backend
+
+
+def loads(data):
+    """
+    Decode a JSON document from bytes or str.
+    """
+    return _loads(data)
+
+
+set_backend()
@@ -0,0 +1,243 @@
+# Adaptive limits on the number of concurrent API connections.
+#
+# Each HtcSession owns a ConcurrencyController, which holds a separate
+# AdaptiveLimiter for each class of endpoint, so that e.g. slow log downloads
+# don't starve fast status checks. The limiters follow an AIMD scheme (additive
+# increase, multiplicative decrease), similar to TCP congestion control: the
+# limit grows slowly while requests succeed with normal latency, and is cut
+# when the API signals overload with HTTP 429/503 or connection errors.
+#
+# The limiters don't act on latency. Each endpoint class mixes requests of very
+# different sizes, like status checks and pages of a thousand jobs, so a slow
+# request is usually just a large one.
+#
+# The same limiters gate the requests of HtcSession threads and of
+# AsyncHtcSession coroutines.
+
+from __future__ import annotations
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+import math
+import re
+import threading
+import time
+
+from .constants import (
+    INITIAL_CONCURRENT_API_CONNECTIONS,
+    MAX_ADAPTIVE_API_CONNECTIONS,
+)
+
+# HTTP status codes that indicate the API is overloaded
+OVERLOAD_STATUS_CODES = (429, 503)
+
+logs_endpoint_re = re.compile(r"/jobs/[^/]+/(logs|events)(\?|$)")
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent requests, adapting the limit to what the
+    API can sustain.
+
+    :param initial_limit: The limit to start at.
+    :param max_limit: The limit never grows beyond this value.
+    :param min_limit: The limit never shrinks below this value.
+    :param backoff_ratio: Factor the limit is multiplied with on overload.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        max_limit: int,
+        min_limit: int = 1,
+        backoff_ratio: float = 0.5,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+
+        self._condition = threading.Condition()
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        # Futures of coroutines waiting in acquire_async
+        self._async_waiters = []
+        self._baseline_latency = None
+        self._last_decrease = 0.0
+
+    # Locks can't be copied or pickled, so leave out the lock, the requests in
+    # flight and their waiters. The adapted limit and latency baseline are kept.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_condition"]
+        state["_in_flight"] = 0
+        state["_async_waiters"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The current number of requests allowed in flight at once."""
+        return max(self.min_limit, math.floor(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        """The number of requests currently in flight."""
+        return self._in_flight
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    async def acquire_async(self):
+        """
+        Asyncio equivalent of acquire, which waits without blocking the event loop.
+        """
+        while True:
+            with self._condition:
+                if self._in_flight < self.limit:
+                    self._in_flight += 1
+                    return
+                waiter = asyncio.get_running_loop().create_future()
+                self._async_waiters.append(waiter)
+            await waiter
+
+    def release(self, latency: float, overloaded: bool):
+        with self._condition:
+            # Was the limit the bottleneck for this request?
+            saturated = self._in_flight >= self.limit
+            self._in_flight -= 1
+
+            # Track the lowest typical latency, which is the time of a round-trip.
+            # Let it drift slowly upwards, so that a permanent shift in latency
+            # becomes the new normal.
+            if not overloaded:
+                if self._baseline_latency is None:
+                    self._baseline_latency = latency
+                else:
+                    self._baseline_latency = min(latency, self._baseline_latency * 1.01)
+
+            now = time.monotonic()
+            if overloaded:
+                # Only decrease once per round-trip, as all requests in flight
+                # at the time of an overload tend to report it.
+                if now - self._last_decrease > (self._baseline_latency or latency):
+                    self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+                    self._last_decrease = now
+            elif saturated:
+                # Grow by roughly one request per full window of successful requests
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+            self._condition.notify_all()
+            # Waiting coroutines may belong to other event loops
+            for waiter in self._async_waiters:
+                waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+            self._async_waiters.clear()
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RequestSlot:
+    """
+    Handed out by :func:`ConcurrencyController.request_slot`, used to report
+    the outcome of the request.
+    """
+
+    def __init__(self):
+        self.overloaded = False
+
+    def record_status(self, status_code: int):
+        self.overloaded = status_code in OVERLOAD_STATUS_CODES
+
+
+class ConcurrencyController:
+    """
+    Per-session limits on concurrent API connections, with a separate
+    adaptive budget for each class of endpoint:
+
+    * ``reads``: GET requests, e.g. listings and status checks.
+    * ``submissions``: POST, PUT, PATCH and DELETE requests, e.g. job submission.
+    * ``logs``: GET requests for job logs and events, which can be slow and large.
+
+    :param initial_limits: Optional: dict with the starting limit for each endpoint class.
+    :param max_limits: Optional: dict with the maximum limit for each endpoint class.
+    """
+
+    ENDPOINT_CLASSES = ("reads", "submissions", "logs")
+
+    def __init__(self, initial_limits: dict = None, max_limits: dict = None):
+        initial_limits = {**INITIAL_CONCURRENT_API_CONNECTIONS, **(initial_limits or {})}
+        max_limits = {**MAX_ADAPTIVE_API_CONNECTIONS, **(max_limits or {})}
+        self.limiters = {
+            endpoint_class: AdaptiveLimiter(initial_limits[endpoint_class], max_limits[endpoint_class])
+            for endpoint_class in self.ENDPOINT_CLASSES
+        }
+
+    @staticmethod
+    def classify(method: str, endpoint: str) -> str:
+        """
+        Return the endpoint class of a request.
+        """
+        if method != "GET":
+            return "submissions"
+        if logs_endpoint_re.search(endpoint):
+            return "logs"
+        return "reads"
+
+    @contextmanager
+    def request_slot(self, method: str, endpoint: str):
+        """
+        Context manager that waits for a free connection in the budget of this
+        endpoint. Report the HTTP status through the yielded RequestSlot. A
+        request that raises an exception, e.g. a timeout, counts as an overload.
+        """
+        limiter = self.limiters[self.classify(method, endpoint)]
+        slot = RequestSlot()
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            yield slot
+        except BaseException:
+            slot.overloaded = True
+            raise
+        finally:
+            limiter.release(time.monotonic() - start, slot.overloaded)
+
+    @asynccontextmanager
+    async def request_slot_async(self, method: str, endpoint: str):
+        """
+        Asyncio equivalent of request_slot.
+        """
+        limiter = self.limiters[self.classify(method, endpoint)]
+        slot = RequestSlot()
+        await limiter.acquire_async()
+        start = time.monotonic()
+        try:
+            yield slot
+        except BaseException:
+            slot.overloaded = True
+            raise
+        finally:
+            limiter.release(time.monotonic() - start, slot.overloaded)
+
+    def get_max_connections(self) -> int:
+        """
+        Return the largest number of requests this controller can have in
+        flight at once, over all endpoint classes.
+        """
+        return sum(limiter.max_limit for limiter in self.limiters.values())
+
+    def get_limits(self) -> dict:
+        """
+        Return the current limit of each endpoint class.
+        """
+        return {
+            endpoint_class: limiter.limit
+            for endpoint_class, limiter in self.limiters.items()
+        }
@@ -21,13 +21,95 @@ VALID_JOB_STATUSES = [
 # be called
 FLOOD_PREVENTION_INTERVAL_SECONDS = 15
 
+# The flood prevention interval is the shortest interval between refreshes.
+# Refreshes that observe no change multiply the interval by the backoff factor,
+# up to the maximum. Durations of this many finished jobs per task are kept to
+# estimate when running jobs finish, for this many of the most recently used
+# tasks.
+ADAPTIVE_POLLING_MAX_INTERVAL_SECONDS = 120
+ADAPTIVE_POLLING_BACKOFF_FACTOR = 1.5
+ADAPTIVE_POLLING_DURATION_SAMPLES = 100
+ADAPTIVE_POLLING_MAX_TASKS = 1000
+
 # Maximum number of connections at the same time
 MAX_CONCURRENT_API_CONNECTIONS = 10
 
+# Each HtcSession limits the number of concurrent connections separately for
+# reads, submissions and logs. The limits start at these values, and adapt
+# between 1 and the maximum values below based on HTTP 429/503 responses and
+# connection errors.
+INITIAL_CONCURRENT_API_CONNECTIONS = {
+    "reads": MAX_CONCURRENT_API_CONNECTIONS,
+    "submissions": 4,
+    "logs": 4,
+}
+MAX_ADAPTIVE_API_CONNECTIONS = {
+    "reads": 64,
+    "submissions": 16,
+    "logs": 16,
+}
+
+# Maximum number of connections at the same time for an AsyncHtcSession. A single
+# event loop handles many more connections than a pool of threads.
+MAX_CONCURRENT_ASYNC_API_CONNECTIONS = 100
+
+# Connections kept open per host by a session, enough for every adaptive limit
+# to reach its maximum without connections being discarded
+CONNECTION_POOL_SIZE = sum(MAX_ADAPTIVE_API_CONNECTIONS.values())
+
+# Number of pages to read ahead in the background when streaming large listings
+# of jobs, tasks and logs, overlapping network round-trips with processing
+PAGINATION_PREFETCH_PAGES = 2
+
+# Default retry policy for transient API errors, like HTTP 429 and 503. Requests
+# are attempted at most this many times, with exponential backoff between the
+# attempts, starting at the base value and capped at the max value.
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BACKOFF_BASE_SECONDS = 1
+RETRY_BACKOFF_MAX_SECONDS = 60
+
+# Bearer tokens are renewed when they have less than this time left, plus a
+# random jitter that reduces the odds of write collisions for the bearer token
+BEARER_TOKEN_RENEW_MARGIN_SECONDS = 2 * 60 * 60
+BEARER_TOKEN_RENEW_JITTER_SECONDS = 20 * 60
+
+# Time between attempts of the background token refresher after a failure
+BEARER_TOKEN_REFRESH_RETRY_SECONDS = 60
+
+# Maximum number of responses kept in a ResponseCache
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+# Number of threads a MultiWorkspaceSession runs operations in. The API
+# connections of all its workspaces are limited by one ConcurrencyController.
+MULTI_WORKSPACE_MAX_WORKERS = 16
+
 # We implicitly wait for an image to be in READY state when submitting
 # jobs. If this for some reason never happens, error out after this interval
 MAX_WAIT_FOR_IMAGE_TRANSITION_PENDING_READY_SECONDS = 5 * 60
 
+# Images that were READY are not checked again for this long. PENDING images
+# are polled with exponential backoff between these intervals.
+IMAGE_READY_TTL_SECONDS = 10 * 60
+IMAGE_POLL_INITIAL_SECONDS = 1
+IMAGE_POLL_MAX_SECONDS = 15
+
+# Maximum number of job batch definitions sent in a single request to the
+# jobs/batch endpoint. Larger submissions are split into several requests.
+MAX_JOB_BATCHES_PER_SUBMISSION = 100
+
+# A SubmissionPipeline submits this many chunks of job batch definitions at the
+# same time. By default it waits while the unfinished jobs of the task use this
+# many times the vCPU limit of the project.
+SUBMISSION_MAX_PARALLEL_CHUNKS = 4
+SUBMISSION_QUEUED_VCPUS_PER_VCPU_LIMIT = 2
+
+# Maximum number of task summary requests a TaskMonitor has in flight at once
+TASK_MONITOR_MAX_CONCURRENT_POLLS = 8
+
+# htcjobs.refresh_jobs requests the jobs of a task one by one, in parallel, when
+# at most this many of them are due for a refresh. Otherwise it lists the task.
+REFRESH_JOBS_MAX_INDIVIDUAL_REQUESTS = 8
+
 # Timeout settings. We set 20 secont timeout delay for connection, and 5 minutes
 # for each download.
 REQUESTS_TIMEOUTS = (20, 300)
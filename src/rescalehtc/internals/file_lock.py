@@ -0,0 +1,99 @@
+# Cross-process file locking and atomic file writes.
+#
+# Many processes on a node may share the same config folder, e.g. worker
+# processes started together. The lock lets one of them refresh a shared file
+# while the others wait, and atomic writes make sure that readers never see a
+# partially written file.
+
+from __future__ import annotations
+from contextlib import contextmanager
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from . import fork_safety
+
+# Not all platforms lock between threads of the same process, so also hold an
+# in-process lock per lock file
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _thread_locks, _thread_locks_lock
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+
+def _get_thread_lock(lock_path: str) -> threading.Lock:
+    key = os.path.realpath(lock_path)
+    with _thread_locks_lock:
+        lock = _thread_locks.get(key)
+        if lock is None:
+            lock = _thread_locks[key] = threading.Lock()
+        return lock
+
+
+fork_safety.register_after_fork(_reset_after_fork)
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """
+    Context manager holding an exclusive lock on lock_path, waiting for other
+    processes and threads to release it first. The lock file is created if
+    needed, and left in place afterwards.
+    """
+    with _get_thread_lock(lock_path):
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                # Blocks for up to 10 seconds per attempt, so retry until locked
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+
+def write_file_atomically(path: str, content: str, mode: int = 0o600):
+    """
+    Write content to path by writing a temporary file in the same folder and
+    renaming it over path, so that readers see either the old or the new file.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=folder, prefix="." + os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,57 @@
+# Detection of forked child processes.
+#
+# A forked child inherits the sockets of the connection pools in its parent,
+# and locks that threads of the parent may have held at the time of the fork.
+# Neither may be used in the child. Modules register a callback to reset their
+# process-wide state in the child, and HtcSession objects compare the fork
+# generation to notice that they must rebuild their own state.
+
+from __future__ import annotations
+import copy
+import os
+import threading
+
+generation = 0
+"""Incremented in the child process after every fork."""
+
+_callbacks = []
+
+# Copies made by copy_after_fork in this process, by id of the original. The
+# originals are kept too, so that their ids can't be reused.
+_copies = {}
+_copies_lock = threading.Lock()
+
+
+def register_after_fork(callback):
+    """
+    Call callback in the child process after every fork.
+    """
+    _callbacks.append(callback)
+
+
+def copy_after_fork(obj):
+    """
+    Return a deep copy of an object inherited from the parent process, e.g. to
+    get fresh locks. Objects shared by several sessions in the parent are
+    copied only once per process, so that the copies are shared as well.
+    """
+    with _copies_lock:
+        entry = _copies.get(id(obj))
+        if entry is None:
+            entry = (obj, copy.deepcopy(obj))
+            _copies[id(obj)] = entry
+        return entry[1]
+
+
+def _after_fork_in_child():
+    global generation, _copies_lock
+    generation += 1
+    _copies.clear()
+    _copies_lock = threading.Lock()
+    for callback in _callbacks:
+        callback()
+
+
+# Not available on Windows, which has no fork
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
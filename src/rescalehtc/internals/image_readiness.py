@@ -0,0 +1,125 @@
+# Cache of container images that are known to be READY.
+#
+# Jobs are only submitted after their image is READY in the container
+# registry of the project. Checking that costs a request before every
+# submission, and images that were just pushed are PENDING for a while. The
+# cache remembers READY images for a time to live, so repeated submissions skip
+# the check. Threads that wait for the same PENDING image share one poller,
+# which polls with exponential backoff instead of fixed intervals.
+
+from __future__ import annotations
+import threading
+import time
+from typing import Callable
+
+from .constants import (
+    IMAGE_READY_TTL_SECONDS,
+    IMAGE_POLL_INITIAL_SECONDS,
+    IMAGE_POLL_MAX_SECONDS,
+    MAX_WAIT_FOR_IMAGE_TRANSITION_PENDING_READY_SECONDS,
+)
+from .single_flight import SingleFlight
+from ..exceptions import HtcException
+
+
+class ImageReadinessCache:
+    """
+    Remembers which container images are READY, and waits for PENDING images
+    to become READY. Every HtcSession has one, see
+    :class:`rescalehtc.htcsession.HtcSession`.
+
+    :param ready_ttl_seconds: How long a READY image is remembered. Set to 0 to check the image before every submission.
+    :param initial_poll_seconds: The first wait between polls of a PENDING image. Doubles after every poll.
+    :param max_poll_seconds: Upper bound on the wait between polls.
+    :param timeout_seconds: Raise a HtcException if an image is still PENDING after this long.
+    """
+
+    def __init__(
+        self,
+        ready_ttl_seconds: float = IMAGE_READY_TTL_SECONDS,
+        initial_poll_seconds: float = IMAGE_POLL_INITIAL_SECONDS,
+        max_poll_seconds: float = IMAGE_POLL_MAX_SECONDS,
+        timeout_seconds: float = MAX_WAIT_FOR_IMAGE_TRANSITION_PENDING_READY_SECONDS,
+    ):
+        self.ready_ttl_seconds = ready_ttl_seconds
+        self.initial_poll_seconds = initial_poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.timeout_seconds = timeout_seconds
+
+        self._lock = threading.Lock()
+        self._ready_until = {}
+        self._single_flight = SingleFlight()
+        self.hits = 0
+        """Number of checks answered from the cache without any request."""
+        self.polls = 0
+        """Number of image status requests sent."""
+
+    # Locks can't be copied or pickled, and polls in flight belong to the
+    # threads of this process. The known READY images are kept.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        del state["_single_flight"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+
+    def wait_until_ready(
+        self, scope: tuple, image_name: str, get_image_status: Callable[[], dict]
+    ):
+        """
+        Return once the image is READY, polling its status with
+        get_image_status() unless it is known to be READY. The scope, e.g. the
+        credentials and project, separates images with the same name.
+        """
+        key = (scope, image_name)
+        with self._lock:
+            if self._ready_until.get(key, 0) > time.monotonic():
+                self.hits += 1
+                return
+
+        self._single_flight.do(key, lambda: self._poll(key, image_name, get_image_status))
+
+    def _poll(self, key: tuple, image_name: str, get_image_status: Callable[[], dict]):
+        started = time.monotonic()
+        wait_interval = self.initial_poll_seconds
+        while True:
+            image_status = get_image_status()
+            with self._lock:
+                self.polls += 1
+
+            # When the image is ready, remember it
+            if image_status["status"] == "READY":
+                with self._lock:
+                    self._ready_until[key] = time.monotonic() + self.ready_ttl_seconds
+                return
+            elif image_status["status"] == "PENDING":
+                waited_for = time.monotonic() - started
+                if waited_for + wait_interval > self.timeout_seconds:
+                    raise HtcException(
+                        f"While waiting for {image_name} to transition from PENDING to READY, waited longer than timeout {self.timeout_seconds}."
+                    )
+                time.sleep(wait_interval)
+                wait_interval = min(wait_interval * 2, self.max_poll_seconds)
+            else:
+                raise HtcException(
+                    f"Unexpected status of an image recieved, got {image_status} for {image_name}."
+                )
+
+    def invalidate(self, scope: tuple, image_name: str):
+        """
+        Forget that an image is READY, e.g. because a new image was pushed
+        with the same name.
+        """
+        with self._lock:
+            self._ready_until.pop((scope, image_name), None)
+
+    def clear(self):
+        """
+        Forget all READY images.
+        """
+        with self._lock:
+            self._ready_until.clear()
@@ -0,0 +1,242 @@
+# Adaptive intervals for refreshing task summaries, job statuses and logs.
+#
+# HtcTask and HtcJob don't send a request if the previous one was less than a
+# poll interval ago. A fixed interval wastes requests on tasks whose jobs wait
+# in the queue for hours, so the interval of each object adapts to what it
+# observes: it grows while nothing changes, drops back to the minimum when
+# something does, and is cut short when the task or job is expected to finish
+# sooner. Expected finishes come from the rate at which jobs of a task complete,
+# and from the durations of jobs of the same task that already finished.
+
+from __future__ import annotations
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+import statistics
+import threading
+import time
+from typing import Optional
+
+from .constants import (
+    ADAPTIVE_POLLING_BACKOFF_FACTOR,
+    ADAPTIVE_POLLING_DURATION_SAMPLES,
+    ADAPTIVE_POLLING_MAX_INTERVAL_SECONDS,
+    ADAPTIVE_POLLING_MAX_TASKS,
+    FLOOD_PREVENTION_INTERVAL_SECONDS,
+)
+
+UNFINISHED_JOB_STATUSES = (
+    "SUBMITTED_TO_RESCALE",
+    "SUBMITTED_TO_PROVIDER",
+    "RUNNABLE",
+    "STARTING",
+    "RUNNING",
+)
+
+FINISHED_JOB_STATUSES = ("FAILED", "POD_FAILED", "POD_SUCCEEDED", "SUCCEEDED")
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse a timestamp of the API, like 2023-10-19T08:05:53.730Z. Returns None
+    for missing or malformed timestamps.
+    """
+    if not value:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+class PollingState:
+    """
+    What a HtcTask or HtcJob observed in its previous refresh, and how long to
+    wait before the next one.
+    """
+
+    __slots__ = ("interval", "previous", "observed_at", "completion_rate")
+
+    def __init__(self, interval: float = FLOOD_PREVENTION_INTERVAL_SECONDS):
+        self.interval = interval
+        """Seconds to wait after the previous refresh before the next one."""
+        self.previous = None
+        self.observed_at = None
+        self.completion_rate = None
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class AdaptivePollingPolicy:
+    """
+    Decides how long HtcTask and HtcJob objects wait between refreshes of
+    their summaries, statuses and logs. Every HtcSession has one, see
+    :class:`rescalehtc.htcsession.HtcSession`.
+
+    The interval starts at min_interval_seconds. It is multiplied by
+    backoff_factor after every refresh that observed no change, up to
+    max_interval_seconds, and drops back to min_interval_seconds when something
+    changed. It is shortened again when a task is expected to complete, or a
+    running job is expected to finish, before the interval would pass.
+
+    Pass ``AdaptivePollingPolicy(max_interval_seconds=FLOOD_PREVENTION_INTERVAL_SECONDS)``
+    to refresh at the fixed minimum interval.
+
+    :param min_interval_seconds: The shortest interval, used after changes.
+    :param max_interval_seconds: The longest interval, used for objects that haven't changed in a while.
+    :param backoff_factor: Factor the interval grows by after each refresh without changes.
+    """
+
+    def __init__(
+        self,
+        min_interval_seconds: float = FLOOD_PREVENTION_INTERVAL_SECONDS,
+        max_interval_seconds: float = ADAPTIVE_POLLING_MAX_INTERVAL_SECONDS,
+        backoff_factor: float = ADAPTIVE_POLLING_BACKOFF_FACTOR,
+    ):
+        self.min_interval_seconds = min_interval_seconds
+        self.max_interval_seconds = max(max_interval_seconds, min_interval_seconds)
+        self.backoff_factor = backoff_factor
+
+        self._lock = threading.Lock()
+        # Durations of finished jobs, per task, for the tasks used most recently
+        self._job_durations = OrderedDict()
+
+    # Locks can't be copied or pickled, so recreate it. The durations are kept.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def new_state(self) -> PollingState:
+        """
+        Return the polling state for an object that hasn't been refreshed yet.
+        """
+        return PollingState(self.min_interval_seconds)
+
+    def _next_interval(self, state: PollingState, changed: bool) -> float:
+        if state.previous is None or changed:
+            return self.min_interval_seconds
+        return min(state.interval * self.backoff_factor, self.max_interval_seconds)
+
+    # Shorten the interval to the expected time until something changes
+    def _limit_interval(self, interval: float, expected_seconds: Optional[float]) -> float:
+        if expected_seconds is None:
+            return interval
+        return min(interval, max(self.min_interval_seconds, expected_seconds))
+
+    def observe_task_summary(self, state: PollingState, summary: dict):
+        """
+        Update the polling state of a task with a summary that was just
+        fetched.
+        """
+        now = time.monotonic()
+        statuses = dict(summary["jobStatuses"])
+        unfinished = sum(statuses.get(status, 0) for status in UNFINISHED_JOB_STATUSES)
+        finished = sum(statuses.values()) - unfinished
+        changed = state.previous is not None and statuses != state.previous[0]
+
+        # Track the rate at which jobs finish, smoothed over several refreshes
+        if changed and now > state.observed_at:
+            rate = max(0, finished - state.previous[1]) / (now - state.observed_at)
+            if state.completion_rate is None:
+                state.completion_rate = rate
+            else:
+                state.completion_rate = 0.5 * state.completion_rate + 0.5 * rate
+
+        interval = self._next_interval(state, changed)
+        if unfinished > 0 and state.completion_rate:
+            interval = self._limit_interval(interval, unfinished / state.completion_rate)
+        state.interval = interval
+        state.previous = (statuses, finished)
+        state.observed_at = now
+
+    def observe_job(self, state: PollingState, job: dict):
+        """
+        Update the polling state of a job with its status that was just
+        fetched, and learn from the duration of finished jobs.
+        """
+        status = job.get("status")
+        changed = state.previous is not None and status != state.previous
+        task_key = (job.get("projectId"), job.get("taskId"))
+
+        if status in FINISHED_JOB_STATUSES:
+            # A finished job doesn't change anymore
+            interval = self.max_interval_seconds
+            if state.previous != status:
+                self.record_job_duration(task_key, job)
+        else:
+            interval = self._next_interval(state, changed)
+            if status == "RUNNING":
+                interval = self._limit_interval(interval, self.estimate_remaining_seconds(task_key, job))
+        state.interval = interval
+        state.previous = status
+        state.observed_at = time.monotonic()
+
+    def observe_logs(self, state: PollingState, log_lines: int, job_finished: bool):
+        """
+        Update the polling state of the logs of a job, given the number of log
+        lines that were just fetched.
+        """
+        changed = state.previous is not None and log_lines != state.previous
+        if job_finished and state.previous is not None and not changed:
+            interval = self.max_interval_seconds
+        else:
+            interval = self._next_interval(state, changed)
+        state.interval = interval
+        state.previous = log_lines
+        state.observed_at = time.monotonic()
+
+    def record_job_duration(self, task_key: tuple, job: dict):
+        """
+        Remember how long a finished job ran, to estimate when running jobs of
+        the same task finish.
+        """
+        started_at = parse_timestamp(job.get("startedAt"))
+        completed_at = parse_timestamp(job.get("completedAt"))
+        if started_at is None or completed_at is None or completed_at < started_at:
+            return
+        with self._lock:
+            durations = self._job_durations.get(task_key)
+            if durations is None:
+                durations = deque(maxlen=ADAPTIVE_POLLING_DURATION_SAMPLES)
+                self._job_durations[task_key] = durations
+                if len(self._job_durations) > ADAPTIVE_POLLING_MAX_TASKS:
+                    self._job_durations.popitem(last=False)
+            else:
+                self._job_durations.move_to_end(task_key)
+            durations.append((completed_at - started_at).total_seconds())
+
+    def get_typical_job_duration(self, task_key: tuple) -> Optional[float]:
+        """
+        Return the median duration of the finished jobs of a task that were
+        observed, or None if there are none.
+        """
+        with self._lock:
+            durations = self._job_durations.get(task_key)
+            if not durations:
+                return None
+            self._job_durations.move_to_end(task_key)
+            return statistics.median(durations)
+
+    def estimate_remaining_seconds(self, task_key: tuple, job: dict) -> Optional[float]:
+        """
+        Return the expected number of seconds until a running job finishes,
+        or None if it can't be estimated.
+        """
+        typical_duration = self.get_typical_job_duration(task_key)
+        started_at = parse_timestamp(job.get("startedAt"))
+        if typical_duration is None or started_at is None:
+            return None
+        elapsed = (datetime.now(timezone.utc) - started_at).total_seconds()
+        return typical_duration - elapsed
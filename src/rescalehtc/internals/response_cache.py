@@ -0,0 +1,147 @@
+# Cache for responses of GET requests to metadata endpoints.
+#
+# Metadata like projects, regions and limits rarely changes, but is read often,
+# e.g. HtcContainerRegistry.get_repos reads the whole project. The cache keeps
+# responses for a per-endpoint time to live (TTL). After that, the response is
+# revalidated with If-None-Match/If-Modified-Since if the API sent an ETag or
+# Last-Modified header, so that an unchanged resource costs a HTTP 304 instead
+# of the full response. The library invalidates entries itself when it
+# modifies a resource through a POST, PUT, PATCH or DELETE request.
+
+from __future__ import annotations
+from collections import OrderedDict
+import re
+import threading
+import time
+from typing import Optional
+
+from .constants import RESPONSE_CACHE_MAX_ENTRIES
+
+# Endpoints that are cached by default, with their time to live in seconds.
+# Endpoints that don't match any of these are never cached.
+DEFAULT_RESPONSE_CACHE_TTLS = [
+    (r"/htc/projects$", 60),
+    (r"/htc/projects/[^/]+$", 60),
+    (r"/htc/projects/[^/]+/limits(/[^/]+)?$", 60),
+    (r"/htc/projects/[^/]+/dimensions$", 300),
+    (r"/htc/projects/[^/]+/container-registry/images$", 30),
+    (r"/htc/regions(/[^/]+)?$", 300),
+    (r"/htc/workspaces/[^/]+/(dimensions|limits)$", 60),
+]
+
+
+class CacheEntry:
+    def __init__(self, endpoint, value, expires_at, etag, last_modified):
+        self.endpoint = endpoint
+        self.value = value
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    # Headers for a conditional GET that revalidates this entry
+    def get_validator_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache for the responses of GET requests to metadata endpoints.
+    Pass an instance to :class:`rescalehtc.htcsession.HtcSession` to enable it:
+
+    .. code-block:: python
+
+        htcs = HtcSession(response_cache=ResponseCache())
+
+    Values returned from the cache are copies, so callers may modify them.
+
+    :param ttls: Optional: List of (regex, seconds) pairs. The first regex that matches the end of an endpoint URL decides its time to live. Endpoints that match none are not cached. Defaults to projects, limits, dimensions, container images and regions.
+    :param max_entries: Optional: The maximum number of responses to keep. The least recently used response is evicted first.
+    """
+
+    def __init__(self, ttls: Optional[list] = None, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        if ttls is None:
+            ttls = DEFAULT_RESPONSE_CACHE_TTLS
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.max_entries = max_entries
+        self.hits = 0
+        """Number of lookups answered from the cache without any request."""
+        self.revalidations = 0
+        """Number of lookups answered by a HTTP 304 from the API."""
+        self.misses = 0
+        """Number of lookups that needed a full response from the API."""
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    # Locks can't be copied or pickled, so recreate it
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get_ttl(self, endpoint: str) -> Optional[float]:
+        """
+        Return the time to live of responses from this endpoint, or None if the
+        endpoint should not be cached.
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(endpoint):
+                return ttl
+        return None
+
+    @staticmethod
+    def make_key(identity, endpoint, params, max_items) -> tuple:
+        return (identity, endpoint, tuple(sorted(params.items())), max_items)
+
+    def lookup(self, key) -> Optional[CacheEntry]:
+        """
+        Return the entry for a key, fresh or stale, or None if there is none.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key, endpoint, value, ttl, etag=None, last_modified=None):
+        """
+        Store a response value, evicting the least recently used entries if full.
+        """
+        entry = CacheEntry(endpoint, value, time.monotonic() + ttl, etag, last_modified)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, endpoint: Optional[str] = None):
+        """
+        Remove cached responses affected by a change to the given endpoint: the
+        endpoint itself, resources below it and the resources above it, which
+        may embed it. Removes everything if no endpoint is given.
+        """
+        with self._lock:
+            if endpoint is None:
+                self._entries.clear()
+                return
+            endpoint = endpoint.rstrip("/")
+            for key in [
+                key
+                for key, entry in self._entries.items()
+                if entry.endpoint == endpoint
+                or entry.endpoint.startswith(endpoint + "/")
+                or endpoint.startswith(entry.endpoint + "/")
+            ]:
+                del self._entries[key]
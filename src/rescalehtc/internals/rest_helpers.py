@@ -1,13 +1,19 @@
 # Define some helper functions for dealing with REST APIs
 
 from __future__ import annotations
+import copy
+import queue
 import threading
+import time
 import re
-from ..internals.constants import MAX_CONCURRENT_API_CONNECTIONS, REQUESTS_TIMEOUTS
+import requests
+from ..internals.constants import REQUESTS_TIMEOUTS
 from ..exceptions import HtcException
 from ..logger import logger
+from . import async_rest_helpers, codec, fork_safety
+from .single_flight import SingleFlight
 
-connections_semaphore = threading.Semaphore(value=MAX_CONCURRENT_API_CONNECTIONS)
+base_url_re = re.compile(r"https?:\/\/[^ \/]+")
 
 
 # Handle API results, return either json or text and raise on HTTP errors
@@ -19,175 +25,394 @@ def format_api_result(res, return_json, endpoint):
             res.status_code,
         )
     if return_json:
-        return res.json()
+        return codec.loads(res.content)
     return res.text
 
 
-# Wrapper for authenticated GET operation, with pagination support
-def api_get(rescale, endpoint, params={}, max_items=None, custom_auth_header=None, return_json=True):
-    rescale.reauthenticate_if_needed()
-    combined_item_res = []
-    base_url_re = re.compile(r"https?:\/\/[^ \/]+")
+# Find the endpoint of the next page in a paginated result, or None if this was
+# the last page. Shared between the synchronous and asyncio based helpers.
+def get_next_page_endpoint(endpoint, res_json):
+    if "next" not in res_json or not res_json["next"]:
+        return None
+
+    # Refuse to be forwarded into pagination on a different base URL
+    r = base_url_re.match(endpoint)
+    if r:
+        current_base_url = r.group(0)
+    else:
+        raise HtcException(f"Base of URL {endpoint} doesn't look like an URL")
+    r = base_url_re.match(res_json["next"])
+    if r:
+        next_base_url = r.group(0)
+    else:
+        raise HtcException(
+            f"Base of URL {res_json['next']} doesn't look like an URL"
+        )
+    if current_base_url != next_base_url:
+        logger.debug(
+            "next field in paginated results point to different domain, stopping pagination"
+        )
+        return None
+
+    return res_json["next"]
+
+
+# Keep only the items whose fields equal the values in filters. Used to filter
+# listings while streaming, as the API may not support filtering on every field.
+# Shared between the synchronous and asyncio based helpers.
+def filter_items(items, filters):
+    if not filters:
+        return items
+    return [
+        item
+        for item in items
+        if all(item.get(field) == value for field, value in filters.items())
+    ]
+
+
+# Build the filters of a listing from keyword arguments, leaving out fields that
+# are None
+def make_filters(**fields):
+    return {field: value for field, value in fields.items() if value is not None}
+
+
+# Build the query parameters of a listing. Filters are passed on to the API, so
+# that it can leave out items that don't match.
+def make_list_params(filters, page_size=None):
+    params = dict(filters)
+    if page_size is not None:
+        params["pageSize"] = page_size
+    return params
+
+
+# Perform a single authenticated request, gated by the adaptive concurrency
+# limits of the session. Returns the requests Response object.
+#
+# Transient failures are retried according to the retry policy of the session.
+# Only idempotent requests are retried, unless retry_safe is set.
+def api_request(
+    rescale, method, endpoint, payload=None, params={}, custom_auth_header=None, retry_safe=False, headers={}
+):
+    rescale.check_fork()
+    retry_policy = rescale.retry_policy
+    retry_policy.record_request()
+    retryable_method = retry_policy.is_retryable_method(method, retry_safe)
+    attempt = 0
+    while True:
+        attempt += 1
+        rescale.reauthenticate_if_needed()
+        try:
+            with rescale.concurrency.request_slot(method, endpoint) as slot:
+                res = rescale.requests_session.request(
+                    method,
+                    endpoint,
+                    headers={
+                        **headers,
+                        "Authorization":
+                            custom_auth_header if custom_auth_header
+                            else rescale.auth_header
+                    },
+                    json=payload,
+                    params=params,
+                    timeout=REQUESTS_TIMEOUTS,
+                )
+                slot.record_status(res.status_code)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if not retryable_method or not retry_policy.should_retry(attempt):
+                raise
+            delay = retry_policy.get_delay(attempt)
+            logger.debug(f"{method} {endpoint} failed with {repr(e)}, retrying in {delay:.1f} seconds")
+            time.sleep(delay)
+            continue
+
+        if (
+            retryable_method
+            and retry_policy.is_retryable_status(res.status_code)
+            and retry_policy.should_retry(attempt)
+        ):
+            delay = retry_policy.get_delay(attempt, res.headers.get("Retry-After"))
+            logger.debug(f"{method} {endpoint} returned HTTP {res.status_code}, retrying in {delay:.1f} seconds")
+            time.sleep(delay)
+            continue
+
+        # Modifying a resource makes cached responses about it outdated
+        if method != "GET" and rescale.response_cache is not None:
+            rescale.response_cache.invalidate(endpoint)
+
+        return res
+
+
+# Generator for authenticated, paginated GET operations. Yields the json of each
+# page as it arrives, following the "next" field of the response. Pages are
+# fetched lazily, so only one page is held in memory at a time.
+#
+# If filters is set, only items whose fields equal the values in filters are
+# kept. If max_items is set, the "items" of the pages are truncated so that no
+# more than max_items items are yielded in total.
+#
+# If prefetch_pages is larger than 0, pages are fetched by a background thread
+# which reads up to prefetch_pages pages ahead of the caller. This overlaps the
+# round-trip for the next page with the processing of the current one.
+def api_iter_pages(
+    rescale, endpoint, params={}, max_items=None, custom_auth_header=None, prefetch_pages=0, filters=None
+):
+    if rescale.is_async:
+        raise HtcException(
+            "Paginated iteration is not supported with an AsyncHtcSession, use api_get instead."
+        )
+    pages = _iter_pages_serial(rescale, endpoint, params, max_items, custom_auth_header, filters)
+    if prefetch_pages > 0:
+        return prefetch_iterator(pages, prefetch_pages)
+    return pages
+
+
+def _iter_pages_serial(rescale, endpoint, params, max_items, custom_auth_header, filters=None):
+    params = dict(params)
     remaining_max_items = max_items
-    # Support multiple paginated GET operations if the "next" field in the response is set
     while endpoint:
         # If we have a max item count, then adjust the page size accordingly for
         # the last page.
-        if "pageSize" in params and max_items:
-            if remaining_max_items < params["pageSize"]:
-                params["pageSize"] = remaining_max_items
-                remaining_max_items -= params["pageSize"]
+        if "pageSize" in params and remaining_max_items is not None:
+            params["pageSize"] = min(params["pageSize"], remaining_max_items)
+
+        res = api_request(
+            rescale, "GET", endpoint, params=params, custom_auth_header=custom_auth_header
+        )
+        res_json = format_api_result(res, True, endpoint)
+
+        # If there is no "items" key, then this is not a paginated result. This
+        # happens for some API endpoints like auth/token/whoami
+        if not isinstance(res_json, dict) or "items" not in res_json:
+            yield res_json
+            return
+
+        # Apply the filters before truncating, so that max_items counts matching items
+        res_json["items"] = filter_items(res_json["items"], filters)
+        if remaining_max_items is not None:
+            res_json["items"] = res_json["items"][:remaining_max_items]
+            remaining_max_items -= len(res_json["items"])
 
-        connections_semaphore.acquire()
+        yield res_json
+
+        if remaining_max_items is not None and remaining_max_items <= 0:
+            return
+        endpoint = get_next_page_endpoint(endpoint, res_json)
+
+
+# Consume an iterator in a background thread, buffering up to depth values ahead
+# of the caller. Exceptions raised by the iterator are re-raised in the caller.
+# If the caller stops iterating early, the background thread stops as well.
+def prefetch_iterator(iterator, depth):
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    end_marker = object()
+
+    # Put a value in the buffer, giving up if the consumer has stopped
+    def put(value):
+        while not stopped.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
         try:
-            last_res = rescale.requests_session.get(
-                endpoint,
-                headers={
-                    "Authorization":
-                        custom_auth_header if custom_auth_header
-                        else f"Bearer {rescale.RESCALE_HTC_BEARER_TOKEN}"
-                },
-                params=params,
-                timeout=REQUESTS_TIMEOUTS,
-            )
-        finally:
-            connections_semaphore.release()
-
-        # Handle errors
-        if last_res.status_code >= 400:
-            raise HtcException(
-                f"{last_res.request.method} {endpoint} | Req body: {last_res.request.body} | Response: HTTP {last_res.status_code}: {last_res.text}",
-                last_res.status_code,
+            for value in iterator:
+                if not put((value, None)):
+                    return
+            put((end_marker, None))
+        except BaseException as e:
+            put((end_marker, e))
+
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            value, exception = buffer.get()
+            if exception is not None:
+                raise exception
+            if value is end_marker:
+                return
+            yield value
+    finally:
+        stopped.set()
+
+
+# Generator for authenticated, paginated GET operations, yielding the individual
+# items of every page without the "items" layer.
+def api_iter_items(
+    rescale, endpoint, params={}, max_items=None, custom_auth_header=None, prefetch_pages=0, filters=None
+):
+    for page in api_iter_pages(
+        rescale, endpoint, params, max_items, custom_auth_header, prefetch_pages, filters
+    ):
+        if not isinstance(page, dict) or "items" not in page:
+            raise HtcException(f"GET {endpoint} did not return a paginated list of items")
+        yield from page["items"]
+
+
+# Identical GETs that run concurrently, e.g. from many threads checking the same
+# task, share a single request. Keyed by the credentials too, so that results are
+# never shared between users.
+single_flight = SingleFlight()
+
+
+# Requests in flight in the parent never finish in a forked child
+def _reset_single_flight_after_fork():
+    global single_flight
+    single_flight = SingleFlight()
+
+
+fork_safety.register_after_fork(_reset_single_flight_after_fork)
+
+
+# Wrapper for authenticated GET operation, with pagination support
+def api_get(
+    rescale, endpoint, params={}, max_items=None, custom_auth_header=None, return_json=True, filters=None
+):
+    if rescale.is_async:
+        return async_rest_helpers.api_get(
+            rescale, endpoint, params, max_items, custom_auth_header, return_json, filters
+        )
+
+    key = (
+        custom_auth_header or rescale.auth_identity,
+        endpoint,
+        repr(sorted(params.items())),
+        max_items,
+        return_json,
+        repr(sorted(filters.items())) if filters else None,
+    )
+    return single_flight.do(
+        key,
+        lambda: _api_get(rescale, endpoint, params, max_items, custom_auth_header, return_json, filters),
+    )
+
+
+def _api_get(rescale, endpoint, params, max_items, custom_auth_header, return_json, filters):
+    # Only if this is a json response can we look for a "next" field to loop over
+    if not return_json:
+        res = api_request(
+            rescale, "GET", endpoint, params=params, custom_auth_header=custom_auth_header
+        )
+        return format_api_result(res, return_json, endpoint)
+
+    # Serve cacheable metadata endpoints from the response cache, if enabled
+    if rescale.response_cache is not None and not filters:
+        ttl = rescale.response_cache.get_ttl(endpoint)
+        if ttl is not None:
+            return _api_get_cached(
+                rescale, endpoint, params, max_items, custom_auth_header, ttl
             )
 
-        # Only if this is a json response can we look for a "next" field to loop over
-        if return_json:
-            last_res_json = last_res.json()
-            # If there is no "items" key, then just return it immediately. This
-            # happens for some API endpoints like auth/token/whoami
-            if "items" not in last_res_json:
-                return last_res_json
-            # If there is an "items" key, then only track that list and return it without
-            # the "items" layer. This enables us to more invisibly replace the response here
-            # with an async iterator in the future.
-
-            # Combine this result with the buffer so far
-            combined_item_res += last_res_json["items"]
-            if "next" in last_res_json and (remaining_max_items is None or remaining_max_items > 0):
-                # Refuse to be forwarded into pagination on a different base URL
-                r = base_url_re.match(endpoint)
-                if r:
-                    current_base_url = r.group(0)
-                else:
-                    raise HtcException(
-                        f"Base of URL {endpoint} doesn't look like an URL"
-                    )
-                r = base_url_re.match(endpoint)
-                if r:
-                    next_base_url = base_url_re.search(last_res_json["next"]).group(0)
-                else:
-                    raise HtcException(
-                        f"Base of URL {endpoint} doesn't look like an URL"
-                    )
-                if current_base_url != next_base_url:
-                    logger.debug(
-                        "next field in paginated results point to different domain, stopping pagination"
-                    )
-                    return combined_item_res
+    return _combine_pages(
+        api_iter_pages(rescale, endpoint, params, max_items, custom_auth_header, filters=filters)
+    )
 
-                # Continue to the next page in the result
-                endpoint = last_res_json["next"]
-            else:
-                # Stop GET'ing new pages when there no longer is a "next" field
-                break
-        else:
-            return format_api_result(last_res, return_json, endpoint)
+
+# Combine paginated results into a single list. Use api_iter_pages or api_iter_items
+# instead to process the pages as they arrive.
+def _combine_pages(pages):
+    combined_item_res = []
+    for page in pages:
+        # If there is no "items" key, then just return it immediately.
+        if not isinstance(page, dict) or "items" not in page:
+            return page
+        combined_item_res += page["items"]
 
     return combined_item_res
 
 
-# Wrapper for authenticated POST operation
+# GET through the response cache of the session. Fresh responses are returned
+# without a request. Stale responses are revalidated with a conditional GET if
+# the API gave us a validator for them, otherwise fetched again.
+def _api_get_cached(rescale, endpoint, params, max_items, custom_auth_header, ttl):
+    cache = rescale.response_cache
+    key = cache.make_key(
+        custom_auth_header or rescale.auth_identity, endpoint, params, max_items
+    )
+    entry = cache.lookup(key)
+    if entry is not None and entry.is_fresh():
+        cache.hits += 1
+        return copy.deepcopy(entry.value)
+
+    res = api_request(
+        rescale, "GET", endpoint, params=params, custom_auth_header=custom_auth_header,
+        headers=entry.get_validator_headers() if entry is not None else {},
+    )
+    if res.status_code == 304 and entry is not None:
+        cache.revalidations += 1
+        cache.store(key, endpoint, entry.value, ttl, entry.etag, entry.last_modified)
+        return copy.deepcopy(entry.value)
+    cache.misses += 1
+
+    first_page = format_api_result(res, True, endpoint)
+    value = first_page
+    etag = res.headers.get("ETag")
+    last_modified = res.headers.get("Last-Modified")
+    if isinstance(first_page, dict) and "items" in first_page:
+        value = first_page["items"][:max_items] if max_items is not None else first_page["items"]
+        remaining_max_items = max_items - len(value) if max_items is not None else None
+        if remaining_max_items is None or remaining_max_items > 0:
+            next_endpoint = get_next_page_endpoint(endpoint, first_page)
+            if next_endpoint:
+                # A validator for the first page says nothing about later pages,
+                # so multi-page responses are only cached for their TTL
+                etag = last_modified = None
+                value = value + _combine_pages(
+                    api_iter_pages(
+                        rescale, next_endpoint, params, remaining_max_items, custom_auth_header
+                    )
+                )
+
+    cache.store(key, endpoint, value, ttl, etag, last_modified)
+    return copy.deepcopy(value)
+
+
+# POST is not idempotent, so it is only retried on transient errors if the caller
+# sets retry_safe.
 def api_post(
-    rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True
+    rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True, retry_safe=False
 ):
-    rescale.reauthenticate_if_needed()
-    connections_semaphore.acquire()
-    try:
-        res = rescale.requests_session.post(
-            endpoint,
-            headers={
-                "Authorization":
-                    custom_auth_header if custom_auth_header
-                    else f"Bearer {rescale.RESCALE_HTC_BEARER_TOKEN}"
-            },
-            json=payload,
-            params=params,
-            timeout=REQUESTS_TIMEOUTS,
+    if rescale.is_async:
+        return async_rest_helpers.api_post(
+            rescale, endpoint, payload, params, custom_auth_header, return_json, retry_safe
         )
-    finally:
-        connections_semaphore.release()
+    res = api_request(rescale, "POST", endpoint, payload, params, custom_auth_header, retry_safe)
     return format_api_result(res, return_json, endpoint)
 
+
 # Wrapper for authenticated PUT operation
 def api_put(
     rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True
 ):
-    rescale.reauthenticate_if_needed()
-    connections_semaphore.acquire()
-    try:
-        res = rescale.requests_session.put(
-            endpoint,
-            headers={
-                "Authorization":
-                    custom_auth_header if custom_auth_header
-                    else f"Bearer {rescale.RESCALE_HTC_BEARER_TOKEN}"
-            },
-            json=payload,
-            params=params,
-            timeout=REQUESTS_TIMEOUTS,
+    if rescale.is_async:
+        return async_rest_helpers.api_put(
+            rescale, endpoint, payload, params, custom_auth_header, return_json
         )
-    finally:
-        connections_semaphore.release()
+    res = api_request(rescale, "PUT", endpoint, payload, params, custom_auth_header)
     return format_api_result(res, return_json, endpoint)
 
-# Wrapper for authenticated PATCH operation
+
+# Wrapper for authenticated PATCH operation. Like POST, only retried if the
+# caller sets retry_safe.
 def api_patch(
-    rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True
+    rescale, endpoint, payload, params={}, custom_auth_header=None, return_json=True, retry_safe=False
 ):
-    rescale.reauthenticate_if_needed()
-    connections_semaphore.acquire()
-    try:
-        res = rescale.requests_session.patch(
-            endpoint,
-            headers={
-                "Authorization":
-                    custom_auth_header if custom_auth_header
-                    else f"Bearer {rescale.RESCALE_HTC_BEARER_TOKEN}"
-            },
-            json=payload,
-            params=params,
-            timeout=REQUESTS_TIMEOUTS,
+    if rescale.is_async:
+        return async_rest_helpers.api_patch(
+            rescale, endpoint, payload, params, custom_auth_header, return_json, retry_safe
         )
-    finally:
-        connections_semaphore.release()
+    res = api_request(rescale, "PATCH", endpoint, payload, params, custom_auth_header, retry_safe)
     return format_api_result(res, return_json, endpoint)
 
 
 # Wrapper for authenticated DELETE operation
 def api_delete(rescale, endpoint, params={}, custom_auth_header=None, return_json=True):
-    rescale.reauthenticate_if_needed()
-    connections_semaphore.acquire()
-    try:
-        res = rescale.requests_session.delete(
-            endpoint,
-            headers={
-                "Authorization":
-                    custom_auth_header if custom_auth_header
-                    else f"Bearer {rescale.RESCALE_HTC_BEARER_TOKEN}"
-            },
-            params=params,
-            timeout=REQUESTS_TIMEOUTS,
+    if rescale.is_async:
+        return async_rest_helpers.api_delete(
+            rescale, endpoint, params, custom_auth_header, return_json
         )
-    finally:
-        connections_semaphore.release()
+    res = api_request(rescale, "DELETE", endpoint, None, params, custom_auth_header)
     return format_api_result(res, return_json, endpoint)
@@ -0,0 +1,137 @@
+# Retry policy for API requests that fail with transient errors.
+#
+# Failed requests are retried with exponential backoff and full jitter, so that
+# many clients that failed at the same time don't retry in lockstep. A
+# Retry-After header from the API takes precedence over the computed backoff.
+# A retry budget limits the share of retries compared to normal requests, so
+# that retries can't multiply the load on an API that is already overloaded.
+
+from __future__ import annotations
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import random
+import threading
+
+from .constants import (
+    RETRY_MAX_ATTEMPTS,
+    RETRY_BACKOFF_BASE_SECONDS,
+    RETRY_BACKOFF_MAX_SECONDS,
+)
+
+# HTTP methods that are safe to send more than once
+IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+
+
+class RetryPolicy:
+    """
+    Decides which failed API requests are retried, and how long to wait
+    before each retry.
+
+    Only idempotent requests (GET, PUT and DELETE) are retried, unless the
+    request is explicitly marked as safe to retry. POST and PATCH requests are
+    not retried by default, as a POST that timed out may still have been
+    processed by the API, e.g. submitting the same jobs twice.
+
+    :param max_attempts: The maximum number of attempts for a request, including the first one. Set to 1 to disable retries.
+    :param backoff_base_seconds: The backoff before the first retry. Doubles for each later retry.
+    :param backoff_max_seconds: Upper bound on the backoff, also caps any Retry-After from the API.
+    :param retry_status_codes: HTTP status codes that are considered transient.
+    :param budget_ratio: Each request adds this many retries to the retry budget, e.g. 0.2 allows one retry for every 5 requests in the long run.
+    :param budget_max: The maximum retries that can be saved up in the budget, which is also the starting budget.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        backoff_base_seconds: float = RETRY_BACKOFF_BASE_SECONDS,
+        backoff_max_seconds: float = RETRY_BACKOFF_MAX_SECONDS,
+        retry_status_codes: tuple = (429, 500, 502, 503, 504),
+        budget_ratio: float = 0.2,
+        budget_max: float = 20,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.retry_status_codes = retry_status_codes
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+
+        self._budget_lock = threading.Lock()
+        self._budget = float(budget_max)
+
+    # Locks can't be copied or pickled, so recreate it
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_budget_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._budget_lock = threading.Lock()
+
+    def is_retryable_method(self, method: str, retry_safe: bool = False) -> bool:
+        """
+        Return true if a request with this HTTP method may be retried.
+        """
+        return retry_safe or method in IDEMPOTENT_METHODS
+
+    def is_retryable_status(self, status_code: int) -> bool:
+        """
+        Return true if a response with this HTTP status is a transient error.
+        """
+        return status_code in self.retry_status_codes
+
+    def record_request(self):
+        """
+        Record a new request, adding to the retry budget.
+        """
+        with self._budget_lock:
+            self._budget = min(self.budget_max, self._budget + self.budget_ratio)
+
+    def should_retry(self, attempt: int) -> bool:
+        """
+        Return true if a retry is allowed after the given number of attempts,
+        and if so withdraw the retry from the budget.
+        """
+        if attempt >= self.max_attempts:
+            return False
+        with self._budget_lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            return True
+
+    def get_delay(self, attempt: int, retry_after: str = None) -> float:
+        """
+        Return the number of seconds to wait before the retry following the given
+        number of attempts. Uses the Retry-After header value if the API sent one.
+        """
+        retry_after_seconds = parse_retry_after(retry_after)
+        if retry_after_seconds is not None:
+            # Add a little jitter, so that clients told to come back at the same
+            # time don't all arrive at once
+            return min(self.backoff_max_seconds, retry_after_seconds) + random.uniform(
+                0, self.backoff_base_seconds
+            )
+        # Exponential backoff with full jitter
+        return random.uniform(
+            0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1))
+        )
+
+
+# Parse a Retry-After header, which is either a number of seconds or a HTTP date.
+# Returns the number of seconds to wait, or None if there was no valid header.
+def parse_retry_after(retry_after):
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,64 @@
+# Coalescing of identical concurrent requests.
+#
+# When many threads ask for the same resource at the same time, e.g. many
+# HtcJob objects of one task calling get_update, only the first caller performs
+# the request. The others wait for it to finish and get a copy of its result,
+# or the same exception.
+
+from __future__ import annotations
+import copy
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.value = None
+        self.exception = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time, sharing its result with all
+    callers that ask for the same key while it is in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """
+        Return the result of function(), or of the call already in flight for
+        this key. Every caller gets its own copy of the result, so callers may
+        modify it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return copy.deepcopy(call.value)
+
+        try:
+            call.value = function()
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                followers = call.followers
+            call.done.set()
+
+        # Followers copy the value concurrently, so it must stay untouched
+        return copy.deepcopy(call.value) if followers else call.value
@@ -0,0 +1,96 @@
+# Process-wide registry of bearer tokens and connection pools.
+#
+# HtcSession objects that authenticate with the same credentials against the
+# same API share one SharedCredentials entry, so that creating another session
+# neither reads the token files again nor opens new connections. Renewing the
+# token in one session renews it for all of them.
+
+from __future__ import annotations
+import hashlib
+import os
+import threading
+from typing import Optional
+
+from . import fork_safety
+from .transport import Transport
+
+
+class SharedCredentials:
+    """
+    Bearer token state and HTTP transport, shared by all HtcSession objects
+    with the same credentials.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        """Serializes renewals of the bearer token."""
+        self.transport = Transport()
+        self.auth = None
+        """Tuple of the bearer token, its Authorization header value and the time
+        to renew it at, swapped in a single assignment on renewal."""
+        self.bearer_json = None
+        self.bearer_expiry = None
+
+    # Locks can't be copied or pickled, so recreate it
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+class TokenRegistry:
+    """
+    Maps credentials to the SharedCredentials for them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def make_key(
+        base_url: str, config_folder: str, workspace: str, api_key: Optional[str]
+    ) -> tuple:
+        """
+        Return the registry key for a set of credentials. Secrets are hashed,
+        so that the key can be logged or used to tell users apart.
+        """
+        if api_key is not None:
+            return (base_url, "api_key", hashlib.sha256(api_key.encode()).hexdigest())
+        # A refresh token in the environment takes precedence over the token files
+        refresh_token = os.environ.get("RESCALE_HTC_REFRESH_TOKEN")
+        if refresh_token is not None:
+            return (base_url, "refresh_token", hashlib.sha256(refresh_token.encode()).hexdigest())
+        return (base_url, os.path.abspath(config_folder), workspace)
+
+    def get(self, key: tuple) -> SharedCredentials:
+        """
+        Return the SharedCredentials for a key, creating them if needed.
+        """
+        with self._lock:
+            credentials = self._entries.get(key)
+            if credentials is None:
+                credentials = SharedCredentials()
+                self._entries[key] = credentials
+            return credentials
+
+    def clear(self):
+        """
+        Forget all credentials. Sessions created afterwards authenticate again.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    # The connection pools of the parent can't be used after a fork, and the lock
+    # may have been held by another thread. Sessions repopulate the registry.
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+
+token_registry = TokenRegistry()
+fork_safety.register_after_fork(token_registry._reset_after_fork)
@@ -0,0 +1,103 @@
+# HTTP transport shared by the HtcSession objects with the same credentials.
+#
+# The default HTTPAdapter of requests keeps at most 10 connections per host.
+# With more threads than that, connections are discarded after each request
+# and new ones are opened, so the pools are sized to the concurrency budget of
+# a session instead. Sessions can also use a separate requests.Session per
+# thread, which avoids sharing the cookie jar and adapters between threads.
+
+from __future__ import annotations
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .constants import CONNECTION_POOL_SIZE
+
+
+class Transport:
+    """
+    Hands out requests.Session objects with connection pools sized to the
+    concurrency budget, and collects statistics about connection reuse.
+
+    :param pool_size: The maximum number of connections kept open per host.
+    """
+
+    def __init__(self, pool_size: int = CONNECTION_POOL_SIZE):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        # Sessions of threads that have finished are dropped
+        self._sessions = weakref.WeakSet()
+        self._thread_local = threading.local()
+        self.shared_session = self._make_session()
+
+    # Connections and locks can't be copied or pickled, so start over
+    def __getstate__(self):
+        return {"pool_size": self.pool_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["pool_size"])
+
+    def _mount_adapter(self, session: requests.Session):
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    def _make_session(self) -> requests.Session:
+        session = requests.Session()
+        with self._lock:
+            self._mount_adapter(session)
+            self._sessions.add(session)
+        return session
+
+    def ensure_pool_size(self, pool_size: int):
+        """
+        Grow the connection pools to at least pool_size connections per host,
+        e.g. for a session with higher concurrency limits. Pools never shrink,
+        since the transport may be shared with sessions that need them.
+        """
+        with self._lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            # Open connections of the replaced adapters are closed once unused
+            for session in list(self._sessions):
+                self._mount_adapter(session)
+
+    def get_session(self, thread_local: bool = False) -> requests.Session:
+        """
+        Return the shared session, or with thread_local a session that is only
+        used by the calling thread.
+        """
+        if not thread_local:
+            return self.shared_session
+        session = getattr(self._thread_local, "session", None)
+        if session is None:
+            session = self._make_session()
+            self._thread_local.session = session
+        return session
+
+    def get_stats(self) -> dict:
+        """
+        Return the number of requests sent, connections opened and requests
+        that reused an open connection, over the live sessions of this transport.
+        """
+        requests_sent = 0
+        connections_created = 0
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                for pool_key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    requests_sent += pool.num_requests
+                    connections_created += pool.num_connections
+        return {
+            "sessions": len(sessions),
+            "requests": requests_sent,
+            "connections_created": connections_created,
+            "connections_reused": requests_sent - connections_created,
+        }
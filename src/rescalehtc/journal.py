@@ -0,0 +1,230 @@
+"""
+This module holds a write-ahead journal for job submissions, which makes
+large sweeps safe to restart.
+
+Submitting jobs is not idempotent: if a submitter crashes halfway through a
+sweep, submitting the whole sweep again runs the first half twice. With a
+SubmissionJournal, every chunk of job batch definitions is recorded before it
+is submitted, and the job batches returned by the API are recorded after. A
+restarted run with the same journal skips the chunks that were submitted, and
+continues with the first one that wasn't.
+
+.. code-block:: python
+
+    from rescalehtc.journal import SubmissionJournal
+
+    journal = SubmissionJournal("sweep.journal", sweep="my-sweep")
+    batches = htcjobs.create_job_batches_raw(htcs, task, definitions, journal=journal)
+
+The journal is a SQLite database, so it survives crashes of the process and
+may be shared by the threads of a process.
+
+A chunk whose submission was interrupted, e.g. by a crash or a timeout, may or
+may not have been received by the API. Such chunks are never submitted again
+automatically. Submitting them raises a HtcException until you check the task
+and call :func:`rescalehtc.journal.SubmissionJournal.forget` or
+:func:`rescalehtc.journal.SubmissionJournal.record` for them.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from .internals import fork_safety
+from .exceptions import HtcException
+
+SUBMITTING = "SUBMITTING"
+SUBMITTED = "SUBMITTED"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    sweep TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    chunk_offset INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    state TEXT NOT NULL,
+    job_batches TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sweep, task_id, chunk_offset)
+)
+"""
+
+
+def get_chunk_digest(chunk: list[dict]) -> str:
+    """
+    Return a digest of a chunk of job batch definitions, which is recorded to
+    detect that a sweep changed between runs.
+    """
+    encoded = json.dumps(chunk, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class SubmissionJournal:
+    """
+    Records the submission of chunks of job batch definitions in a SQLite
+    database, so that an interrupted sweep can be resumed without submitting
+    any chunk twice. Chunks are identified by the task, and by the position of
+    their first definition within the sweep.
+
+    Pass the journal to :func:`rescalehtc.htcjobs.create_job_batches_raw` or
+    :class:`rescalehtc.submission.SubmissionPipeline`.
+
+    :param path: The file of the journal. Created if it doesn't exist.
+    :param sweep: Optional: Name of the sweep, separating several sweeps recorded in the same file. Submitting the same definitions again under the same sweep name returns the recorded job batches instead.
+    """
+
+    def __init__(self, path: str, sweep: str = "default"):
+        self.path = path
+        self.sweep = sweep
+        self._lock = threading.Lock()
+        self._connection = None
+        self._fork_generation = fork_safety.generation
+
+    # Connections and locks can't be copied or pickled, so reopen the file
+    def __getstate__(self):
+        return {"path": self.path, "sweep": self.sweep}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["sweep"])
+
+    def __repr__(self):
+        return f"SubmissionJournal({self.path!r}, sweep={self.sweep!r})"
+
+    # Return the connection, opening it on first use. Call with the lock held.
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # The intent must be on disk before a chunk is submitted
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.execute(_SCHEMA)
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def close(self):
+        """
+        Close the database. It is opened again if the journal is used afterwards.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _execute(self, query: str, parameters: tuple = ()) -> list:
+        # The connection and lock of the parent can't be used after a fork
+        if self._fork_generation != fork_safety.generation:
+            self._lock = threading.Lock()
+            self._connection = None
+            self._fork_generation = fork_safety.generation
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                return connection.execute(query, parameters).fetchall()
+
+    def _get_row(self, task_id: str, offset: int) -> Optional[tuple]:
+        rows = self._execute(
+            "SELECT digest, state, job_batches FROM chunks WHERE sweep = ? AND task_id = ? AND chunk_offset = ?",
+            (self.sweep, task_id, offset),
+        )
+        return rows[0] if rows else None
+
+    def get_submitted(self, task_id: str, offset: int, chunk: list[dict]) -> Optional[list[dict]]:
+        """
+        Return the job batches the API returned for a chunk, or None if the
+        chunk has not been submitted. Raises a HtcException if the chunk's
+        submission was interrupted, or if the journal recorded different
+        definitions at this position.
+        """
+        row = self._get_row(task_id, offset)
+        if row is None:
+            return None
+        digest, state, job_batches = row
+        if digest != get_chunk_digest(chunk):
+            raise HtcException(
+                f"The journal {self.path} recorded different job batch definitions at position {offset} "
+                f"of sweep {self.sweep} in task {task_id}. Did the sweep change since the last run?"
+            )
+        if state == SUBMITTING:
+            raise HtcException(
+                f"The submission of the chunk at position {offset} of sweep {self.sweep} in task {task_id} "
+                "was interrupted, so the jobs may or may not have been created. Check the task, then call "
+                "forget() to submit the chunk again, or record() to keep the jobs that were created."
+            )
+        return json.loads(job_batches)
+
+    def submit_chunk(
+        self, task_id: str, offset: int, chunk: list[dict], submit: Callable[[], list[dict]]
+    ) -> list[dict]:
+        """
+        Return the recorded job batches of a chunk, or else record the intent to
+        submit it, call submit() and record the job batches it returns.
+
+        If submit() raises a HtcException for a HTTP status below 500, the API
+        rejected the chunk, so the intent is removed again. For other errors
+        the chunk stays recorded as interrupted.
+        """
+        job_batches = self.get_submitted(task_id, offset, chunk)
+        if job_batches is not None:
+            return job_batches
+
+        try:
+            self._execute(
+                "INSERT INTO chunks (sweep, task_id, chunk_offset, digest, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.sweep, task_id, offset, get_chunk_digest(chunk), SUBMITTING, time.time()),
+            )
+        except sqlite3.IntegrityError:
+            raise HtcException(
+                f"The chunk at position {offset} of sweep {self.sweep} in task {task_id} is already being submitted."
+            )
+        try:
+            job_batches = submit()
+        except HtcException as e:
+            if e.status_code is not None and e.status_code < 500:
+                self.forget(task_id, offset)
+            raise
+        self.record(task_id, offset, chunk, job_batches)
+        return job_batches
+
+    def record(self, task_id: str, offset: int, chunk: list[dict], job_batches: list[dict]):
+        """
+        Record the job batches of a submitted chunk, e.g. after finding the jobs
+        of an interrupted submission in the task.
+        """
+        self._execute(
+            "INSERT OR REPLACE INTO chunks (sweep, task_id, chunk_offset, digest, state, job_batches, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.sweep, task_id, offset, get_chunk_digest(chunk), SUBMITTED, json.dumps(job_batches), time.time()),
+        )
+
+    def forget(self, task_id: str, offset: int):
+        """
+        Remove a chunk from the journal, so that it is submitted again.
+        """
+        self._execute(
+            "DELETE FROM chunks WHERE sweep = ? AND task_id = ? AND chunk_offset = ?",
+            (self.sweep, task_id, offset),
+        )
+
+    def get_interrupted(self) -> list[tuple[str, int]]:
+        """
+        Return the (task_id, offset) of the chunks of this sweep whose
+        submission was interrupted.
+        """
+        return [
+            tuple(row) for row in self._execute(
+                "SELECT task_id, chunk_offset FROM chunks WHERE sweep = ? AND state = ? ORDER BY task_id, chunk_offset",
+                (self.sweep, SUBMITTING),
+            )
+        ]
+
+    def count_submitted(self) -> int:
+        """
+        Return the number of chunks of this sweep that were submitted.
+        """
+        return self._execute(
+            "SELECT COUNT(*) FROM chunks WHERE sweep = ? AND state = ?", (self.sweep, SUBMITTED)
+        )[0][0]
@@ -0,0 +1,263 @@
+"""
+This module watches many tasks at once until their jobs have finished. A
+TaskMonitor polls the summaries of all registered tasks from one scheduler
+thread, instead of a sleep loop per task.
+
+.. code-block:: python
+
+    from rescalehtc.monitor import TaskMonitor
+
+    with TaskMonitor(htcs) as monitor:
+        monitor.add_all(tasks)
+        for task in monitor.as_completed():
+            print(f"{task.json['taskName']} finished: {task.task_summary['jobStatuses']}")
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+from .internals.constants import TASK_MONITOR_MAX_CONCURRENT_POLLS
+from .exceptions import HtcException
+from .htctasks import HtcTask
+from .logger import logger
+from . import HtcSession
+
+
+def _task_key(task: HtcTask) -> tuple:
+    return (task.json["projectId"], task.json["taskId"])
+
+
+class TaskMonitor:
+    """
+    Polls the summaries of many tasks until none of their jobs are still
+    running, see :func:`rescalehtc.htctasks.HtcTask.is_still_running`.
+
+    Each task is polled once per poll interval. By default, the interval of
+    each task adapts to how often its summary changes, as decided by the
+    polling policy of the session. The first polls of the tasks are spread
+    evenly over the minimum interval, and later polls are jittered, so that the
+    requests don't arrive at the API in bursts. At most max_concurrent_polls
+    requests are in flight at the same time.
+
+    The summaries are stored in the HtcTask objects, so
+    :func:`rescalehtc.htctasks.HtcTask.get_task_summary` returns the latest
+    summary without another request.
+
+    Callbacks are called from the polling threads, so they should return
+    quickly. Exceptions raised by callbacks are logged and otherwise ignored.
+
+    :param rescale: The HtcSession to poll with.
+    :param poll_interval_seconds: Optional: Fixed time between polls of each task, instead of the adaptive interval.
+    :param max_concurrent_polls: Optional: The maximum number of polls in flight at once.
+    :param on_update: Optional: Called as on_update(task, summary) after every successful poll.
+    :param on_complete: Optional: Called as on_complete(task, summary) when a task has no jobs running anymore.
+    """
+
+    def __init__(
+        self,
+        rescale: HtcSession,
+        poll_interval_seconds: Optional[float] = None,
+        max_concurrent_polls: int = TASK_MONITOR_MAX_CONCURRENT_POLLS,
+        on_update: Optional[Callable[[HtcTask, dict], None]] = None,
+        on_complete: Optional[Callable[[HtcTask, dict], None]] = None,
+    ):
+        self.rescale = rescale
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_concurrent_polls = max_concurrent_polls
+        self.on_update = on_update
+        self.on_complete = on_complete
+
+        self._condition = threading.Condition()
+        # Tasks that are still running, and their scheduled polls as a heap of
+        # (poll time, sequence number, key)
+        self._pending = {}
+        self._schedule = []
+        self._sequence = itertools.count()
+        # Completed tasks in the order they completed
+        self._completed = []
+        self._in_flight = 0
+        self._closed = False
+        self.polls = 0
+        """Number of summary requests sent."""
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_polls, thread_name_prefix="rescalehtc-monitor"
+        )
+        self._scheduler = threading.Thread(
+            target=self._run_scheduler, name="rescalehtc-monitor-scheduler", daemon=True
+        )
+        self._scheduler.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop polling. Tasks that are still running are no longer watched.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._scheduler.join()
+        self._executor.shutdown(wait=True)
+
+    def add(self, task: HtcTask):
+        """
+        Start watching a task. Adding a task that is already watched has no
+        effect.
+        """
+        self.add_all([task])
+
+    def add_all(self, tasks: Iterable[HtcTask]):
+        """
+        Start watching several tasks. Their first polls are spread over one
+        poll interval.
+        """
+        tasks = list(tasks)
+        for task in tasks:
+            if not isinstance(task, HtcTask):
+                raise HtcException(f"Provided task is not a HtcTask object: {task}")
+        now = time.monotonic()
+        with self._condition:
+            if self._closed:
+                raise HtcException("TaskMonitor is closed.")
+            new_tasks = [task for task in tasks if _task_key(task) not in self._pending]
+            for i, task in enumerate(new_tasks):
+                key = _task_key(task)
+                self._pending[key] = task
+                delay = self._get_interval(task) * i / len(new_tasks)
+                heapq.heappush(self._schedule, (now + delay, next(self._sequence), key))
+            self._condition.notify_all()
+
+    def remove(self, task: HtcTask):
+        """
+        Stop watching a task.
+        """
+        with self._condition:
+            self._pending.pop(_task_key(task), None)
+            self._condition.notify_all()
+
+    @property
+    def pending(self) -> list[HtcTask]:
+        """The watched tasks that are still running."""
+        with self._condition:
+            return list(self._pending.values())
+
+    @property
+    def completed(self) -> list[HtcTask]:
+        """The tasks that completed, in the order they completed."""
+        with self._condition:
+            return list(self._completed)
+
+    def _get_interval(self, task: HtcTask) -> float:
+        if self.poll_interval_seconds is not None:
+            return self.poll_interval_seconds
+        if task.task_summary_polling is None:
+            return self.rescale.polling_policy.min_interval_seconds
+        return task.task_summary_polling.interval
+
+    def _run_scheduler(self):
+        with self._condition:
+            while not self._closed:
+                if not self._schedule or self._in_flight >= self.max_concurrent_polls:
+                    self._condition.wait()
+                    continue
+                poll_at, _, key = self._schedule[0]
+                delay = poll_at - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._schedule)
+                task = self._pending.get(key)
+                # Removed or completed since the poll was scheduled
+                if task is None:
+                    continue
+                self._in_flight += 1
+                self._executor.submit(self._poll, key, task)
+
+    def _poll(self, key: tuple, task: HtcTask):
+        summary = None
+        try:
+            summary = task.refresh_task_summary(self.rescale)
+        except Exception as e:
+            logger.warning(f"Polling the summary of task {task.json['taskId']} failed: {repr(e)}")
+
+        completed = False
+        with self._condition:
+            self.polls += 1
+            self._in_flight -= 1
+            if key in self._pending:
+                if summary is not None and not summary["still_running"]:
+                    del self._pending[key]
+                    self._completed.append(task)
+                    completed = True
+                else:
+                    jitter = random.uniform(0.9, 1.1)
+                    heapq.heappush(
+                        self._schedule,
+                        (time.monotonic() + self._get_interval(task) * jitter, next(self._sequence), key),
+                    )
+            self._condition.notify_all()
+
+        if summary is not None:
+            self._call(self.on_update, task, summary)
+        if completed:
+            self._call(self.on_complete, task, summary)
+
+    def _call(self, callback, task: HtcTask, summary: dict):
+        if callback is None:
+            return
+        try:
+            callback(task, summary)
+        except Exception as e:
+            logger.warning(f"TaskMonitor callback {callback} failed for task {task.json['taskId']}: {repr(e)}")
+
+    def wait_all(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all watched tasks have completed. Returns True if they did,
+        or False if the timeout passed first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending, timeout)
+
+    def wait_any(self, timeout: Optional[float] = None) -> Optional[HtcTask]:
+        """
+        Wait until any watched task has completed, and return the first task
+        that completed. Returns None if the timeout passed first.
+        """
+        with self._condition:
+            if self._condition.wait_for(lambda: self._completed, timeout):
+                return self._completed[0]
+            return None
+
+    def as_completed(self, timeout: Optional[float] = None) -> Iterator[HtcTask]:
+        """
+        Yield the watched tasks as they complete, starting with the ones that
+        already completed, until no watched task is still running. Raises a
+        HtcException if the timeout, counted from the first call, passes before
+        all tasks completed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        yielded = 0
+        while True:
+            with self._condition:
+                def ready():
+                    return len(self._completed) > yielded or not self._pending
+                remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                if not self._condition.wait_for(ready, remaining):
+                    raise HtcException(
+                        f"Timed out after {timeout} seconds with {len(self._pending)} tasks still running."
+                    )
+                if len(self._completed) == yielded:
+                    return
+                task = self._completed[yielded]
+            yielded += 1
+            yield task
@@ -0,0 +1,217 @@
+"""
+This module lets you work with several Rescale workspaces at once. A
+MultiWorkspaceSession holds one authenticated HtcSession per workspace, and
+runs operations in all of them concurrently.
+
+.. code-block:: python
+
+    from rescalehtc.multi_workspace import MultiWorkspaceSession
+
+    with MultiWorkspaceSession(["team-a", "team-b"]) as workspaces:
+        tasks = workspaces.get_tasks()
+        for workspace, task, summary in workspaces.get_task_summaries(tasks):
+            print(workspace, task.json["taskName"], summary["jobStatuses"])
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+from .internals.concurrency import ConcurrencyController
+from .internals.constants import MULTI_WORKSPACE_MAX_WORKERS
+from .exceptions import HtcException
+from .htcprojects import HtcProject
+from .htctasks import HtcTask
+from . import HtcSession, htcprojects, htctasks
+
+
+class MultiWorkspaceSession:
+    """
+    Holds a HtcSession for each of several workspaces, and runs operations in
+    all of them concurrently. Results are tagged with the name of the
+    workspace they came from.
+
+    All sessions share one ConcurrencyController, so the number of concurrent
+    API connections is limited for the workspaces together, not per workspace.
+
+    :param workspaces: The names of the workspaces, as configured with ``rauthenticate``.
+    :param config_folder_override: Optional: Override the default configuration folder, see :class:`rescalehtc.htcsession.HtcSession`.
+    :param api_keys: Optional: API keys for some or all of the workspaces, by workspace name. Workspaces with an API key are authenticated with it instead of the configuration folder.
+    :param concurrency: Optional: A ``rescalehtc.internals.concurrency.ConcurrencyController`` shared by all the sessions. By default a new one is created.
+    :param max_workers: Optional: The number of threads operations run in.
+    :param lazy: Optional: Don't authenticate the sessions until they are first used.
+    """
+
+    def __init__(
+        self,
+        workspaces: list[str],
+        config_folder_override: Optional[str] = None,
+        api_keys: Optional[dict[str, str]] = None,
+        concurrency: Optional[ConcurrencyController] = None,
+        max_workers: int = MULTI_WORKSPACE_MAX_WORKERS,
+        lazy: bool = False,
+    ):
+        if len(workspaces) == 0:
+            raise HtcException("MultiWorkspaceSession needs at least one workspace.")
+        if len(set(workspaces)) != len(workspaces):
+            raise HtcException(f"Duplicate workspaces given: {workspaces}")
+
+        self.concurrency = concurrency if concurrency is not None else ConcurrencyController()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="rescalehtc-workspaces"
+        )
+
+        api_keys = api_keys if api_keys is not None else {}
+
+        def make_session(workspace):
+            return HtcSession(
+                workspace=workspace,
+                config_folder_override=config_folder_override,
+                api_key=api_keys.get(workspace),
+                concurrency=self.concurrency,
+                lazy=lazy,
+            )
+
+        # Authenticate all workspaces at once
+        self.sessions: dict[str, HtcSession] = {}
+        """The HtcSession for each workspace, by workspace name."""
+        try:
+            for workspace, session in zip(workspaces, self._executor.map(make_session, workspaces)):
+                self.sessions[workspace] = session
+        except BaseException:
+            self.close()
+            raise
+
+    def __repr__(self):
+        return "MultiWorkspaceSession(" + str(list(self.sessions)) + ")"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker threads. The sessions in
+        :attr:`rescalehtc.multi_workspace.MultiWorkspaceSession.sessions` can
+        still be used afterwards.
+        """
+        self._executor.shutdown(wait=True)
+
+    # Run the calls, wait for all of them and return their results in order
+    def _run_all(self, calls: list, return_exceptions: bool) -> list:
+        futures = [self._executor.submit(function, *args) for function, args in calls]
+        wait(futures)
+        results = []
+        for future in futures:
+            exception = future.exception()
+            if exception is None:
+                results.append(future.result())
+            elif return_exceptions:
+                results.append(exception)
+            else:
+                raise exception
+        return results
+
+    def map(
+        self, function: Callable, *args, return_exceptions: bool = False, **kwargs
+    ) -> dict[str, Any]:
+        """
+        Call ``function(session, *args, **kwargs)`` for the session of every
+        workspace concurrently, and return the results by workspace name.
+
+        All calls run to completion, even if some of them fail. The first
+        exception is then raised, or with return_exceptions the exceptions are
+        returned in place of the results of the failed calls.
+
+        .. code-block:: python
+
+            whoami = workspaces.map(api.get_auth_token_whoami)
+        """
+        def call(session):
+            return function(session, *args, **kwargs)
+
+        results = self._run_all(
+            [(call, (session,)) for session in self.sessions.values()], return_exceptions
+        )
+        return dict(zip(self.sessions, results))
+
+    def map_items(
+        self,
+        function: Callable,
+        items: list[tuple[str, Any]],
+        return_exceptions: bool = False,
+    ) -> list[tuple[str, Any, Any]]:
+        """
+        Call ``function(session, item)`` for a list of ``(workspace, item)``
+        tuples, like the ones returned by
+        :func:`rescalehtc.multi_workspace.MultiWorkspaceSession.get_tasks`,
+        with the session of the workspace of each item. The calls run
+        concurrently, and the results are returned as ``(workspace, item,
+        result)`` tuples in the order of the items.
+
+        Failed calls are handled as in
+        :func:`rescalehtc.multi_workspace.MultiWorkspaceSession.map`.
+        """
+        for workspace, _ in items:
+            if workspace not in self.sessions:
+                raise HtcException(f"Unknown workspace {workspace}, expected one of {list(self.sessions)}")
+
+        results = self._run_all(
+            [(function, (self.sessions[workspace], item)) for workspace, item in items],
+            return_exceptions,
+        )
+        return [(workspace, item, result) for (workspace, item), result in zip(items, results)]
+
+    def get_projects(self) -> list[tuple[str, HtcProject]]:
+        """
+        Get all projects in all workspaces, as a list of ``(workspace,
+        HtcProject)`` tuples.
+        """
+        projects = self.map(htcprojects.get_projects)
+        return [
+            (workspace, project)
+            for workspace, workspace_projects in projects.items()
+            # get_projects returns None for workspaces without projects
+            for project in workspace_projects or []
+        ]
+
+    def get_tasks(self, lifecycle_status: str = "ACTIVE") -> list[tuple[str, HtcTask]]:
+        """
+        Get the tasks with the given lifecycle_status in all projects of all
+        workspaces, as a list of ``(workspace, HtcTask)`` tuples. The projects
+        are listed concurrently. See :func:`rescalehtc.htctasks.get_tasks`.
+        """
+        tasks = self.map_items(
+            lambda rescale, project: htctasks.get_tasks(rescale, project, lifecycle_status),
+            self.get_projects(),
+        )
+        return [
+            (workspace, task)
+            for workspace, _, project_tasks in tasks
+            for task in project_tasks
+        ]
+
+    def get_task_summaries(
+        self, tasks: list[tuple[str, HtcTask]], return_exceptions: bool = False
+    ) -> list[tuple[str, HtcTask, dict]]:
+        """
+        Get the summaries of a list of ``(workspace, HtcTask)`` tuples
+        concurrently, as ``(workspace, HtcTask, summary)`` tuples. See
+        :func:`rescalehtc.htctasks.HtcTask.get_task_summary`.
+        """
+        return self.map_items(
+            lambda rescale, task: task.get_task_summary(rescale), tasks, return_exceptions
+        )
+
+    def cancel_jobs_in_tasks(
+        self, tasks: list[tuple[str, HtcTask]], return_exceptions: bool = False
+    ) -> list[tuple[str, HtcTask, Any]]:
+        """
+        Cancel the jobs of a list of ``(workspace, HtcTask)`` tuples
+        concurrently. Every task is attempted, even if cancelling some of them
+        fails. See :func:`rescalehtc.htctasks.HtcTask.cancel_jobs_in_task`.
+        """
+        return self.map_items(
+            lambda rescale, task: task.cancel_jobs_in_task(rescale), tasks, return_exceptions
+        )
@@ -0,0 +1,175 @@
+"""
+This module contains compact, read-only records of jobs, tasks and log lines.
+They are an alternative to the :class:`rescalehtc.htcjobs.HtcJob` and
+:class:`rescalehtc.htctasks.HtcTask` objects for scanning very large listings,
+e.g. counting the statuses of hundreds of thousands of jobs.
+
+Records keep only the most commonly used fields, stored in ``__slots__``
+instead of the full dictionary returned by the API, which makes them several
+times smaller. Repeated strings like the status are interned, so that all
+records share a single copy of them.
+
+Records are returned by :func:`rescalehtc.htcjobs.iter_job_records`,
+:func:`rescalehtc.htctasks.iter_task_records` and
+:func:`rescalehtc.htcjobs.HtcJob.iter_log_records`.
+"""
+from __future__ import annotations
+import sys
+from typing import Optional
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _Record:
+    __slots__ = ()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+
+class JobRecord(_Record):
+    """
+    Compact record of a single job, following the HTCJob schema of the Rescale
+    HTC API. Fields missing from the API response are None.
+    """
+
+    __slots__ = (
+        "job_uuid",
+        "project_id",
+        "task_id",
+        "status",
+        "status_reason",
+        "failure_code",
+        "exit_code",
+        "group",
+        "region",
+        "created_at",
+        "started_at",
+        "completed_at",
+        "updated_at",
+    )
+
+    def __init__(
+        self,
+        job_uuid: str,
+        project_id: str,
+        task_id: str,
+        status: str,
+        status_reason: Optional[str] = None,
+        failure_code: Optional[str] = None,
+        exit_code: Optional[int] = None,
+        group: Optional[str] = None,
+        region: Optional[str] = None,
+        created_at: Optional[str] = None,
+        started_at: Optional[str] = None,
+        completed_at: Optional[str] = None,
+        updated_at: Optional[str] = None,
+    ):
+        self.job_uuid = job_uuid
+        self.project_id = _intern(project_id)
+        self.task_id = _intern(task_id)
+        self.status = _intern(status)
+        self.status_reason = _intern(status_reason)
+        self.failure_code = _intern(failure_code)
+        self.exit_code = exit_code
+        self.group = _intern(group)
+        self.region = _intern(region)
+        self.created_at = created_at
+        self.started_at = started_at
+        self.completed_at = completed_at
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_json(cls, json: dict) -> JobRecord:
+        """
+        Create a record from a job dictionary returned by the API.
+        """
+        container = json.get("container") or {}
+        return cls(
+            json["jobUUID"],
+            json.get("projectId"),
+            json.get("taskId"),
+            json.get("status"),
+            json.get("statusReason"),
+            json.get("failureCode"),
+            container.get("exitCode"),
+            json.get("group"),
+            json.get("region"),
+            json.get("createdAt"),
+            json.get("startedAt"),
+            json.get("completedAt"),
+            json.get("updatedAt"),
+        )
+
+
+class TaskRecord(_Record):
+    """
+    Compact record of a single task, following the HTCTask schema of the Rescale
+    HTC API. Fields missing from the API response are None.
+    """
+
+    __slots__ = (
+        "task_id",
+        "project_id",
+        "task_name",
+        "task_description",
+        "lifecycle_status",
+        "created_at",
+    )
+
+    def __init__(
+        self,
+        task_id: str,
+        project_id: str,
+        task_name: str,
+        task_description: Optional[str] = None,
+        lifecycle_status: Optional[str] = None,
+        created_at: Optional[str] = None,
+    ):
+        self.task_id = task_id
+        self.project_id = _intern(project_id)
+        self.task_name = task_name
+        self.task_description = task_description
+        self.lifecycle_status = _intern(lifecycle_status)
+        self.created_at = created_at
+
+    @classmethod
+    def from_json(cls, json: dict) -> TaskRecord:
+        """
+        Create a record from a task dictionary returned by the API.
+        """
+        return cls(
+            json["taskId"],
+            json.get("projectId"),
+            json.get("taskName"),
+            json.get("taskDescription"),
+            json.get("lifecycleStatus"),
+            json.get("createdAt"),
+        )
+
+
+class LogRecord(_Record):
+    """
+    A single line of the log of a job.
+    """
+
+    __slots__ = ("timestamp", "message")
+
+    def __init__(self, timestamp: Optional[str], message: str):
+        self.timestamp = timestamp
+        self.message = message
+
+    @classmethod
+    def from_json(cls, json: dict) -> LogRecord:
+        """
+        Create a record from a log line dictionary returned by the API.
+        """
+        return cls(json.get("timestamp"), json["message"])
@@ -0,0 +1,281 @@
+"""
+This module submits very large numbers of jobs, like parameter sweeps, to a
+task. A SubmissionPipeline reads job batch definitions from any iterable,
+submits them in chunks with bounded parallelism, and slows down while the
+task already has enough jobs queued to keep the project's vCPU limit busy.
+
+.. code-block:: python
+
+    from rescalehtc import htcjobs
+    from rescalehtc.submission import SubmissionPipeline
+
+    definitions = (
+        htcjobs.make_job_batch_definition(
+            task, batch_size=1, priority="ON_DEMAND_ECONOMY", image_name=image,
+            exec_timeout_seconds=600, commands=["python", "run.py", str(parameter)],
+        )
+        for parameter in range(100000)
+    )
+    pipeline = SubmissionPipeline(htcs, task)
+    for result in pipeline.submit(definitions):
+        if result.exception is not None:
+            print(f"Chunk {result.index} failed: {result.exception}")
+"""
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+import time
+from typing import Iterable, Iterator, Optional
+
+from .internals.constants import (
+    FLOOD_PREVENTION_INTERVAL_SECONDS,
+    MAX_JOB_BATCHES_PER_SUBMISSION,
+    SUBMISSION_MAX_PARALLEL_CHUNKS,
+    SUBMISSION_QUEUED_VCPUS_PER_VCPU_LIMIT,
+)
+from .internals.polling import UNFINISHED_JOB_STATUSES
+from .exceptions import HtcException
+from .htcjobs import HtcJobBatch, create_job_batches_raw
+from .htctasks import HtcTask
+from .journal import SubmissionJournal
+from .logger import logger
+from . import HtcSession
+
+
+class ChunkResult:
+    """
+    The outcome of submitting one chunk of job batch definitions.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        offset: int,
+        definitions: list[dict],
+        job_batches: Optional[list[HtcJobBatch]] = None,
+        exception: Optional[BaseException] = None,
+    ):
+        self.index = index
+        """The number of this chunk, counting from 0."""
+        self.offset = offset
+        """The position of the first definition of this chunk in all definitions."""
+        self.definitions = definitions
+        """The job batch definitions of this chunk."""
+        self.job_batches = job_batches
+        """The HtcJobBatch for every definition, or None if the chunk failed."""
+        self.exception = exception
+        """The exception that made the chunk fail, or None."""
+
+    def __repr__(self):
+        status = "failed: " + repr(self.exception) if self.exception is not None else "submitted"
+        return f"ChunkResult(index={self.index}, offset={self.offset}, definitions={len(self.definitions)}, {status})"
+
+
+def validate_definition(definition: dict):
+    """
+    Raise a HtcException if a job batch definition lacks the fields the API
+    requires. Definitions built by
+    :func:`rescalehtc.htcjobs.make_job_batch_definition` are always valid.
+    """
+    if not isinstance(definition, dict):
+        raise HtcException(f"Job batch definition is not a dict: {definition}")
+    batch_size = definition.get("batchSize")
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise HtcException(
+            f"Job batch definition has an invalid batchSize {batch_size}, expected a positive integer."
+        )
+    job_definition = definition.get("htcJobDefinition")
+    if not isinstance(job_definition, dict) or not job_definition.get("imageName"):
+        raise HtcException(
+            f"Job batch definition has no htcJobDefinition with an imageName: {definition}"
+        )
+
+
+class SubmissionPipeline:
+    """
+    Submits job batch definitions to a task in chunks, several chunks at a
+    time, while holding back when the task has enough unfinished jobs.
+
+    Definitions are read from the iterable only as chunks are submitted, so a
+    sweep of any size is submitted in constant memory.
+
+    Before each chunk is submitted, the number of unfinished jobs in the task is
+    compared to the limits below, using the summary of the task. The pipeline
+    waits while either limit is reached, so that jobs aren't queued far ahead
+    of what the project may run.
+
+    :param rescale: The HtcSession to submit with.
+    :param task: The HtcTask to submit the jobs to.
+    :param chunk_size: Optional: The number of definitions submitted in one request.
+    :param max_parallel_chunks: Optional: The number of chunks submitted at the same time.
+    :param max_queued_jobs: Optional: Wait while the task has this many unfinished jobs. Not limited by default.
+    :param max_queued_vcpus: Optional: Wait while the unfinished jobs of the task use this many vCPUs. By default twice the vCPU limit of the project, so that there are always jobs queued to start when running jobs finish. Set to 0 to disable.
+    :param poll_interval_seconds: Optional: Time between checks of the task while waiting.
+    :param stop_on_error: Optional: Stop submitting new chunks once a chunk fails. Chunks that were already being submitted still complete.
+    :param journal: Optional: A :class:`rescalehtc.journal.SubmissionJournal` recording every chunk before and after it is submitted. When the same definitions are submitted again with the same journal, e.g. after a crash, the chunks that were submitted yield their recorded job batches without being submitted again.
+    """
+
+    def __init__(
+        self,
+        rescale: HtcSession,
+        task: HtcTask,
+        chunk_size: int = MAX_JOB_BATCHES_PER_SUBMISSION,
+        max_parallel_chunks: int = SUBMISSION_MAX_PARALLEL_CHUNKS,
+        max_queued_jobs: Optional[int] = None,
+        max_queued_vcpus: Optional[int] = None,
+        poll_interval_seconds: float = FLOOD_PREVENTION_INTERVAL_SECONDS,
+        stop_on_error: bool = True,
+        journal: Optional[SubmissionJournal] = None,
+    ):
+        if not isinstance(task, HtcTask):
+            raise HtcException("Provided argument task is not a HtcTask object.")
+        if chunk_size < 1 or max_parallel_chunks < 1:
+            raise HtcException(
+                f"chunk_size and max_parallel_chunks must be at least 1, got {chunk_size} and {max_parallel_chunks}"
+            )
+        self.rescale = rescale
+        self.task = task
+        self.chunk_size = chunk_size
+        self.max_parallel_chunks = max_parallel_chunks
+        self.max_queued_jobs = max_queued_jobs
+        self.max_queued_vcpus = max_queued_vcpus
+        self.poll_interval_seconds = poll_interval_seconds
+        self.stop_on_error = stop_on_error
+        self.journal = journal
+
+        # Jobs and vCPUs submitted so far, used to estimate the vCPUs per job
+        self.submitted_jobs = 0
+        self.submitted_vcpus = 0
+        # Jobs submitted after the task summary was last updated, which it
+        # doesn't count yet
+        self._jobs_since_summary = 0
+        self._summary_updated_at = None
+
+    def get_max_queued_vcpus(self) -> int:
+        """
+        Return the max_queued_vcpus given to the pipeline, or else twice the
+        lowest vCPU limit of the project. Returns 0 if the project has no limit.
+        """
+        if self.max_queued_vcpus is None:
+            limits = self.task.project.get_limits(self.rescale)
+            vcpu_limits = [limit["vCPUs"] for limit in limits if limit.get("vCPUs")]
+            self.max_queued_vcpus = (
+                int(min(vcpu_limits) * SUBMISSION_QUEUED_VCPUS_PER_VCPU_LIMIT) if vcpu_limits else 0
+            )
+        return self.max_queued_vcpus
+
+    def get_unfinished_jobs(self) -> int:
+        """
+        Return the number of jobs in the task that have not finished, including
+        jobs submitted by this pipeline that the task summary doesn't count yet.
+        """
+        summary = self.task.get_task_summary(self.rescale)
+        if self.task.task_summary_updated_at != self._summary_updated_at:
+            self._summary_updated_at = self.task.task_summary_updated_at
+            self._jobs_since_summary = 0
+        unfinished = sum(summary["jobStatuses"].get(status, 0) for status in UNFINISHED_JOB_STATUSES)
+        return unfinished + self._jobs_since_summary
+
+    # Whether the task has room for the jobs of a chunk
+    def _has_capacity(self, jobs: int, vcpus: int) -> bool:
+        if self.max_queued_jobs is None and self.get_max_queued_vcpus() == 0:
+            return True
+        unfinished_jobs = self.get_unfinished_jobs()
+        if self.max_queued_jobs is not None and unfinished_jobs >= self.max_queued_jobs:
+            return False
+        if self.get_max_queued_vcpus() > 0:
+            vcpus_per_job = (self.submitted_vcpus + vcpus) / (self.submitted_jobs + jobs)
+            if unfinished_jobs * vcpus_per_job >= self.max_queued_vcpus:
+                return False
+        return True
+
+    def _submit_chunk(self, index: int, offset: int, chunk: list[dict]) -> ChunkResult:
+        try:
+            job_batches = create_job_batches_raw(
+                self.rescale, self.task, chunk, max_batches_per_request=self.chunk_size,
+                journal=self.journal, journal_offset=offset,
+            )
+        except Exception as e:
+            logger.warning(f"Submitting chunk {index} of task {self.task.json['taskId']} failed: {repr(e)}")
+            return ChunkResult(index, offset, chunk, exception=e)
+        return ChunkResult(index, offset, chunk, job_batches=job_batches)
+
+    # Wait for at least one submission to complete, or until the timeout
+    def _collect(self, in_flight: set, timeout: Optional[float] = None) -> Iterator[ChunkResult]:
+        done, pending = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        in_flight.intersection_update(pending)
+        for future in sorted(done, key=lambda future: future.result().index):
+            yield future.result()
+
+    def submit(self, definitions: Iterable[dict]) -> Iterator[ChunkResult]:
+        """
+        Submit the job batch definitions, yielding a ChunkResult for every
+        chunk as its submission completes. Chunks may complete out of order.
+
+        Chunks with invalid definitions are not submitted, and yield a
+        ChunkResult with the validation error.
+
+        :param definitions: Any iterable of job batch definitions, e.g. a generator.
+        """
+        definitions = iter(definitions)
+        in_flight = set()
+        failed = False
+        with ThreadPoolExecutor(
+            max_workers=self.max_parallel_chunks, thread_name_prefix="rescalehtc-submission"
+        ) as executor:
+            index = 0
+            offset = 0
+            while not (failed and self.stop_on_error):
+                chunk = list(islice(definitions, self.chunk_size))
+                if len(chunk) == 0:
+                    break
+                chunk_index, chunk_offset = index, offset
+                index += 1
+                offset += len(chunk)
+
+                try:
+                    for definition in chunk:
+                        validate_definition(definition)
+                    # Chunks submitted by an earlier run are not submitted again
+                    if self.journal is not None:
+                        recorded = self.journal.get_submitted(self.task.json["taskId"], chunk_offset, chunk)
+                        if recorded is not None:
+                            job_batches = [HtcJobBatch(job_batch, self.task) for job_batch in recorded]
+                            yield ChunkResult(chunk_index, chunk_offset, chunk, job_batches=job_batches)
+                            continue
+                except HtcException as e:
+                    failed = True
+                    yield ChunkResult(chunk_index, chunk_offset, chunk, exception=e)
+                    continue
+
+                jobs = sum(definition["batchSize"] for definition in chunk)
+                vcpus = sum(
+                    definition["batchSize"] * definition["htcJobDefinition"].get("maxVCpus", 1)
+                    for definition in chunk
+                )
+
+                # Wait for a free slot, and for the task to have room for more jobs
+                while len(in_flight) >= self.max_parallel_chunks:
+                    for result in self._collect(in_flight):
+                        failed = failed or result.exception is not None
+                        yield result
+                while not self._has_capacity(jobs, vcpus):
+                    logger.debug(
+                        f"Task {self.task.json['taskId']} has enough unfinished jobs, waiting {self.poll_interval_seconds} seconds before submitting more."
+                    )
+                    if in_flight:
+                        for result in self._collect(in_flight, timeout=self.poll_interval_seconds):
+                            failed = failed or result.exception is not None
+                            yield result
+                    else:
+                        time.sleep(self.poll_interval_seconds)
+                if failed and self.stop_on_error:
+                    break
+
+                self.submitted_jobs += jobs
+                self.submitted_vcpus += vcpus
+                self._jobs_since_summary += jobs
+                in_flight.add(executor.submit(self._submit_chunk, chunk_index, chunk_offset, chunk))
+
+            while in_flight:
+                yield from self._collect(in_flight)
@@ -0,0 +1,82 @@
+# Benchmark decoding a large job listing with each JSON backend, into plain
+# dicts (the HtcJob path) and into JobRecord objects (the iter_job_records path).
+#
+# Run with: python tests/bench_codec.py [number of jobs]
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from rescalehtc.internals import codec
+from rescalehtc.records import JobRecord
+
+STATUSES = ["SUCCEEDED", "FAILED", "RUNNING", "RUNNABLE"]
+
+
+def make_listing(n_jobs):
+    return json.dumps({
+        "items": [
+            {
+                "jobUUID": f"{i:08x}",
+                "providerJobId": f"provider-id-{i}",
+                "region": "AWS_AP_SOUTHEAST_1",
+                "taskId": "task-12345",
+                "projectId": "project-12345",
+                "status": STATUSES[i % len(STATUSES)],
+                "statusReason": "Completed",
+                "container": {"exitCode": 0, "reason": "Container Exited"},
+                "createdAt": "2023-10-19T08:05:53.730Z",
+                "createdBy": "qWoUF",
+                "workspaceId": "04-8098234",
+                "group": "sample-group",
+                "commands": ["python", "script.py", str(i)],
+                "envs": [{"name": "FOO", "value": "bar"}],
+                "tags": [{"key": "HOME", "value": "/home/users/"}],
+                "imageName": "image",
+                "updatedAt": "2023-10-19T08:05:53.730Z",
+                "startedAt": "2023-10-19T08:05:53.730Z",
+                "completedAt": "2023-10-19T08:05:53.730Z",
+            }
+            for i in range(n_jobs)
+        ],
+        "next": None,
+    }).encode()
+
+
+def measure(function):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return elapsed, retained
+
+
+def main():
+    n_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    listing = make_listing(n_jobs)
+    print(f"{n_jobs} jobs, {len(listing) / 1e6:.1f} MB of JSON")
+    print(f"{'backend':<10}{'result':<12}{'seconds':>10}{'retained MB':>14}")
+
+    for backend in codec.BACKENDS:
+        try:
+            codec.set_backend(backend)
+        except Exception:
+            print(f"{backend:<10}not installed")
+            continue
+        for name, function in (
+            ("dicts", lambda: codec.loads(listing)["items"]),
+            ("records", lambda: [JobRecord.from_json(job) for job in codec.loads(listing)["items"]]),
+        ):
+            elapsed, retained = measure(function)
+            print(f"{backend:<10}{name:<12}{elapsed:>10.3f}{retained / 1e6:>14.1f}")
+    codec.set_backend()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ import threading
 import os
 import logging
 import shutil
+import asyncio
 import api_flask_mock
 
 # Unittest specific overrides, to be mocked into the rescalehtc module
@@ -21,6 +22,7 @@ logging.basicConfig(level=logging.NOTSET)
 import rescalehtc
 from rescalehtc import api
 from rescalehtc.api import *
+from rescalehtc.internals.concurrency import ConcurrencyController
 
 class TestsHighlevel(unittest.TestCase):
 
@@ -43,6 +45,8 @@ class TestsHighlevel(unittest.TestCase):
     def setUp(self):
         if "RESCALEHTC_MOCK_TARGET_STATUS" in os.environ:
             del os.environ["RESCALEHTC_MOCK_TARGET_STATUS"]
+        # Start every test without tokens shared from earlier tests
+        rescalehtc.internals.token_registry.token_registry.clear()
         # Mock URL and config folder in authenticate module
         with mock.patch.multiple("rescalehtc.htcsession.HtcSession",
                 get_rescale_api_base_url=lambda : TEST_BASE_URL,
@@ -138,3 +142,31 @@ class TestsHighlevel(unittest.TestCase):
         get_htc_task_retention_policy(self.rs, "workspace_example_id")
         put_htc_task_retention_policy(self.rs, "workspace_example_id", {"random": "payload"})
 
+    def test_api_async_session(self):
+        async def run_async_calls():
+            with mock.patch.multiple("rescalehtc.htcsession.HtcSession",
+                    get_rescale_api_base_url=lambda : TEST_BASE_URL,
+                    get_config_folder=lambda _ : TEST_CONFIG_FOLDER,
+                ):
+                concurrency = ConcurrencyController(initial_limits={"reads": 2})
+                async_rs = rescalehtc.AsyncHtcSession(max_concurrent_connections=4, concurrency=concurrency)
+            # The options of HtcSession are passed on
+            assert(async_rs.concurrency is concurrency)
+            async with async_rs:
+                results = await asyncio.gather(*[
+                    rescalehtc.api_async.get_htc_projects_tasks_jobs(async_rs, "example_project_id", "task_id", f"job_{i}")
+                    for i in range(20)
+                ])
+                assert(all(isinstance(result, dict) for result in results))
+                jobs = await rescalehtc.api_async.get_htc_projects_tasks_jobs(async_rs, "example_project_id", "task_id")
+                assert(isinstance(jobs, list) and len(jobs) > 0)
+                await rescalehtc.api_async.post_htc_projects_tasks_jobs_cancel(async_rs, "example_project_id", "task_id")
+
+                # A synchronous session can't be used with the async functions
+                try:
+                    await rescalehtc.api_async.get_htc_projects(self.rs)
+                    raise Exception
+                except HtcException:
+                    pass # Expecting this to give exception
+
+        asyncio.run(run_async_calls())
@@ -1,4 +1,6 @@
 import copy
+import multiprocessing
+import pickle
 from typing import Iterator
 import unittest
 from unittest import mock
@@ -22,6 +24,27 @@ import rescalehtc
 import rescalehtc.internals.authenticate
 from rescalehtc import api, htcjobs, htcprojects, htctasks, container_registry
 
+# Runs in worker processes, returns the number of projects and whether the
+# session rebuilt its connection pool instead of using the one of the parent
+def count_projects_in_worker(rs, parent_requests_session_id):
+    projects = htcprojects.get_projects(rs)
+    return len(projects), id(rs.requests_session) != parent_requests_session_id
+
+
+def count_projects_in_worker_inherited(parent_requests_session_id):
+    return count_projects_in_worker(inherited_rs, parent_requests_session_id)
+
+
+# Runs in forked worker processes, returns whether the rebuilt sessions of the
+# inherited MultiWorkspaceSession still share one concurrency controller
+def share_concurrency_in_worker(parent_concurrency_id):
+    sessions = list(inherited_workspaces.sessions.values())
+    for session in sessions:
+        session.check_fork()
+    controllers = {id(session.concurrency) for session in sessions}
+    return len(controllers) == 1 and parent_concurrency_id not in controllers
+
+
 class TestsHighlevel(unittest.TestCase):
 
     # Start flask, to be run in a thread
@@ -43,6 +66,8 @@ class TestsHighlevel(unittest.TestCase):
     def setUp(self):
         if "RESCALEHTC_MOCK_TARGET_STATUS" in os.environ:
             del os.environ["RESCALEHTC_MOCK_TARGET_STATUS"]
+        # Start every test without tokens shared from earlier tests
+        rescalehtc.internals.token_registry.token_registry.clear()
         # Mock URL and config folder in authenticate module
         with mock.patch.multiple("rescalehtc.htcsession.HtcSession",
                 get_rescale_api_base_url=lambda : TEST_BASE_URL,
@@ -83,6 +108,38 @@ class TestsHighlevel(unittest.TestCase):
         assert(len(jobs) > 0)
         assert(all(isinstance(job, rescalehtc.htcjobs.HtcJob) for job in jobs))
 
+    # Test streaming jobs and tasks, should match the full listings
+    def test_0004_iter_jobs_and_tasks(self):
+        project = rescalehtc.htcprojects.get_projects(self.rs)[0]
+        tasks_iter = htctasks.iter_tasks(self.rs, project, lifecycle_status="any")
+        assert(isinstance(tasks_iter, Iterator))
+        tasks = list(tasks_iter)
+        assert([task.json for task in tasks] == [task.json for task in htctasks.get_tasks(self.rs, project, lifecycle_status="any")])
+        jobs_iter = htcjobs.iter_jobs(self.rs, tasks[0])
+        assert(isinstance(jobs_iter, Iterator))
+        assert([job.json for job in jobs_iter] == [job.json for job in htcjobs.get_jobs(self.rs, tasks[0])])
+        assert(all(job.json["status"] == "SUCCEEDED" for job in htcjobs.iter_jobs(self.rs, tasks[0], job_status="SUCCEEDED")))
+        # Invalid arguments are reported on the call, not on the first item
+        for iter_function, argument in [
+            (htctasks.iter_tasks, tasks[0]), (htctasks.iter_task_records, tasks[0]),
+            (htcjobs.iter_jobs, project), (htcjobs.iter_job_records, project),
+        ]:
+            with self.assertRaises(rescalehtc.exceptions.HtcException):
+                iter_function(self.rs, argument)
+
+    def test_0005_records(self):
+        project = rescalehtc.htcprojects.get_projects(self.rs)[0]
+        task_records = list(htctasks.iter_task_records(self.rs, project, lifecycle_status="any"))
+        tasks = htctasks.get_tasks(self.rs, project, lifecycle_status="any")
+        assert([record.task_id for record in task_records] == [task.json["taskId"] for task in tasks])
+        job_records = list(htcjobs.iter_job_records(self.rs, tasks[0]))
+        jobs = htcjobs.get_jobs(self.rs, tasks[0])
+        assert(job_records == [rescalehtc.records.JobRecord.from_json(job.json) for job in jobs])
+        assert(job_records[0].status == jobs[0].json["status"])
+        assert(job_records[0].exit_code == jobs[0].json["container"]["exitCode"])
+        log_records = list(jobs[0].iter_log_records(self.rs))
+        assert([record.message for record in reversed(log_records)] == list(jobs[0].get_logs(self.rs)))
+
     def test_0010_basic_exception_handling(self):
         os.environ["RESCALEHTC_MOCK_TARGET_STATUS"] = "403"
         # If the API returns a 403 status, then expect a HtcException with that exit code
@@ -196,6 +253,197 @@ class TestsHighlevel(unittest.TestCase):
                 assert auth_spy.get_bearer_json.called is False
                 assert auth_spy.request_new_bearer_token.called is True
 
+    def test_0202_background_token_refresh(self):
+        session = self.rs
+        token, header, renew_at = session._credentials.auth
+        assert(header == f"Bearer {token}")
+        assert(renew_at > time.time())
+
+        # The refresher renews a token that is due, off the request path
+        session._credentials.auth = ("old-token", "Bearer old-token", time.time() - 1)
+        session.start_background_refresh()
+        for _ in range(50):
+            if session.RESCALE_HTC_BEARER_TOKEN != "old-token":
+                break
+            time.sleep(0.1)
+        assert(session.auth_header == f"Bearer {session.RESCALE_HTC_BEARER_TOKEN}")
+        assert(not session.needs_reauthentication())
+
+        # While it runs, API calls don't renew a token that is due but still valid
+        session._credentials.auth = ("due-token", "Bearer due-token", time.time() - 1)
+        with mock.patch.object(session, "do_authenticate") as do_authenticate:
+            session.reauthenticate_if_needed()
+            assert(not do_authenticate.called)
+        session.stop_background_refresh()
+        assert(session._refresher_thread is None)
+
+        # Without it, they do
+        with mock.patch.object(session, "do_authenticate") as do_authenticate:
+            session.reauthenticate_if_needed()
+            assert(do_authenticate.called)
+
+    def test_0203_shared_credentials(self):
+        with mock.patch.multiple("rescalehtc.htcsession.HtcSession",
+            get_rescale_api_base_url=lambda : TEST_BASE_URL,
+            get_config_folder=lambda _ : TEST_CONFIG_FOLDER):
+            auth_spy = mock.MagicMock(wraps=rescalehtc.internals.authenticate)
+            with mock.patch("rescalehtc.htcsession.authenticate", new=auth_spy):
+                # Further sessions with the same credentials reuse the token and connections
+                sessions = [rescalehtc.htcsession.HtcSession() for _ in range(10)]
+                assert(not auth_spy.get_bearer_json.called)
+                assert(all(session.requests_session is self.rs.requests_session for session in sessions))
+                assert(all(session.auth_header == self.rs.auth_header for session in sessions))
+
+                # Renewing the token in one session renews it for all of them
+                sessions[0].do_authenticate()
+                assert(auth_spy.get_bearer_json.call_count == 1)
+                assert(self.rs.bearer_expiry == sessions[0].bearer_expiry)
+
+                # Other credentials, or opting out, get their own
+                other = rescalehtc.htcsession.HtcSession(api_key="other-key==")
+                private = rescalehtc.htcsession.HtcSession(share_credentials=False)
+                assert(other.requests_session is not self.rs.requests_session)
+                assert(private.requests_session is not self.rs.requests_session)
+                assert(other.auth_identity != self.rs.auth_identity)
+                assert(private.auth_identity == self.rs.auth_identity)
+
+                # Setting the bearer JSON or expiry updates the token state together
+                bearer_json = dict(private.bearer_json, tokenValue="set-token")
+                private.bearer_json = bearer_json
+                assert(private.RESCALE_HTC_BEARER_TOKEN == "set-token")
+                assert(private.auth_header == "Bearer set-token")
+                assert(private.bearer_expiry.isoformat() == bearer_json["expiresAt"])
+                assert(not private.needs_reauthentication())
+                private.bearer_expiry = private.bearer_expiry.replace(year=2000)
+                assert(private.RESCALE_HTC_BEARER_TOKEN == "set-token")
+                assert(private.needs_reauthentication())
+
+    def test_0205_lazy_session(self):
+        with mock.patch.multiple("rescalehtc.htcsession.HtcSession",
+            get_rescale_api_base_url=lambda : TEST_BASE_URL,
+            get_config_folder=lambda _ : TEST_CONFIG_FOLDER):
+            auth_spy = mock.MagicMock(wraps=rescalehtc.internals.authenticate)
+            with mock.patch("rescalehtc.htcsession.authenticate", new=auth_spy):
+                # The first API call authenticates
+                session = rescalehtc.htcsession.HtcSession(share_credentials=False, lazy=True)
+                assert(not auth_spy.get_bearer_json.called)
+                assert(len(htcprojects.get_projects(session)) > 0)
+                assert(auth_spy.get_bearer_json.call_count == 1)
+
+                # As does the first use of the token
+                session = rescalehtc.htcsession.HtcSession(share_credentials=False, lazy=True)
+                assert(session.auth_header.startswith("Bearer "))
+                assert(auth_spy.get_bearer_json.call_count == 2)
+
+    def test_0204_pickle_and_fork(self):
+        # A pickled session doesn't carry its token, and authenticates on first use
+        pickled = pickle.dumps(self.rs)
+        assert(self.rs.RESCALE_HTC_BEARER_TOKEN.encode() not in pickled)
+        with mock.patch("rescalehtc.htcsession.authenticate", wraps=rescalehtc.internals.authenticate) as auth_spy:
+            rescalehtc.internals.token_registry.token_registry.clear()
+            rs = pickle.loads(pickled)
+            assert(not auth_spy.get_bearer_json.called)
+            assert(len(htcprojects.get_projects(rs)) > 0)
+            assert(auth_spy.get_bearer_json.call_count == 1)
+
+        # Sessions passed to, or inherited by, forked workers rebuild their connections
+        if not hasattr(os, "fork"):
+            return
+        self.rs.start_background_refresh()
+        context = multiprocessing.get_context("fork")
+        with context.Pool(2) as pool:
+            results = pool.starmap(
+                count_projects_in_worker, [(self.rs, id(self.rs.requests_session))] * 4
+            )
+        assert(all(count > 0 for count, _ in results))
+        global inherited_rs
+        inherited_rs = self.rs
+        with context.Pool(2) as pool:
+            results = pool.starmap(
+                count_projects_in_worker_inherited, [(id(self.rs.requests_session),)] * 4
+            )
+        assert(all(count > 0 and rebuilt for count, rebuilt in results))
+        self.rs.stop_background_refresh()
+
+    def test_0206_connection_pool(self):
+        with mock.patch.multiple("rescalehtc.htcsession.HtcSession",
+            get_rescale_api_base_url=lambda : TEST_BASE_URL,
+            get_config_folder=lambda _ : TEST_CONFIG_FOLDER):
+            # Repeated requests reuse the open connection
+            session = rescalehtc.htcsession.HtcSession(share_credentials=False)
+            for _ in range(5):
+                htcprojects.get_projects(session)
+            stats = session.get_connection_stats()
+            assert(stats["sessions"] == 1)
+            assert(stats["requests"] >= 5)
+            assert(stats["connections_reused"] > 0)
+            assert(stats["connections_created"] + stats["connections_reused"] == stats["requests"])
+
+            # With thread-local sessions, every thread gets its own
+            session = rescalehtc.htcsession.HtcSession(share_credentials=False, thread_local_sessions=True)
+            requests_sessions = []
+            def get_projects():
+                htcprojects.get_projects(session)
+                requests_sessions.append(session.requests_session)
+            threads = [threading.Thread(target=get_projects) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert(len(set(map(id, requests_sessions))) == 4)
+            assert(session.requests_session is session.requests_session)
+
+            # Pools are sized to the concurrency limits of the session
+            concurrency = rescalehtc.internals.concurrency.ConcurrencyController(max_limits={"reads": 200})
+            session = rescalehtc.htcsession.HtcSession(share_credentials=False, concurrency=concurrency)
+            adapter = session.requests_session.get_adapter(TEST_BASE_URL)
+            assert(adapter._pool_maxsize == concurrency.get_max_connections() > 200)
+
+    def test_0207_multi_workspace(self):
+        os.makedirs(TEST_CONFIG_FOLDER + "/second", exist_ok=True)
+        with open(TEST_CONFIG_FOLDER + "/second/rescale_api_token.txt", "w") as fp:
+            fp.write("mock-api-key-2==")
+        with mock.patch.multiple("rescalehtc.htcsession.HtcSession",
+            get_rescale_api_base_url=lambda : TEST_BASE_URL,
+            get_config_folder=lambda _ : TEST_CONFIG_FOLDER):
+            with rescalehtc.MultiWorkspaceSession(["default", "second"]) as workspaces:
+                # Every session has its own credentials, and all share the concurrency limits
+                assert(workspaces.sessions["default"].auth_identity != workspaces.sessions["second"].auth_identity)
+                assert(all(session.concurrency is workspaces.concurrency for session in workspaces.sessions.values()))
+
+                # Results are tagged by workspace
+                projects = workspaces.get_projects()
+                assert(len(projects) > 0)
+                assert({workspace for workspace, _ in projects} == {"default", "second"})
+                tasks = workspaces.get_tasks()
+                assert(len(tasks) > 0)
+                summaries = workspaces.get_task_summaries(tasks)
+                assert([(workspace, task) for workspace, task, _ in summaries] == tasks)
+                assert(all("still_running" in summary for _, _, summary in summaries))
+                workspaces.cancel_jobs_in_tasks(tasks[:2])
+
+                # Failures are raised after every workspace has been called, or returned
+                def fail_in_second(rescale):
+                    if rescale.workspace == "second":
+                        raise rescalehtc.exceptions.HtcException("failed")
+                    return rescale.workspace
+                with self.assertRaises(rescalehtc.exceptions.HtcException):
+                    workspaces.map(fail_in_second)
+                results = workspaces.map(fail_in_second, return_exceptions=True)
+                assert(results["default"] == "default")
+                assert(isinstance(results["second"], rescalehtc.exceptions.HtcException))
+
+                with self.assertRaises(rescalehtc.exceptions.HtcException):
+                    workspaces.map_items(lambda rescale, task: None, [("third", None)])
+
+                # Forked workers rebuild the sessions with one shared controller
+                if hasattr(os, "fork"):
+                    global inherited_workspaces
+                    inherited_workspaces = workspaces
+                    with multiprocessing.get_context("fork").Pool(2) as pool:
+                        results = pool.map(share_concurrency_in_worker, [id(workspaces.concurrency)] * 2)
+                    assert(all(results))
+
     # Test the various endpoints in Token Resource
     def test_0500_token_resource_tests(self):
         # Get a bearer token
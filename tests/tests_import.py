@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_FOLDER = os.path.dirname(os.path.abspath(__file__)) + "/../src"
+
+# Generous upper bound on the time to import the package, far above the few
+# milliseconds it takes, so that only eager imports of heavy modules trip it
+MAX_IMPORT_SECONDS = 0.5
+
+# Measure an import in a fresh interpreter, returning the best time of a few
+# runs and the modules that were loaded by it
+IMPORT_BENCHMARK = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module, runs=3):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_BENCHMARK.format(module=module)],
+            env={**os.environ, "PYTHONPATH": SRC_FOLDER},
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output))
+    return min(result["seconds"] for result in results), set(results[0]["modules"])
+
+
+class TestsImport(unittest.TestCase):
+    """
+    Guards against regressions in the import time of the package.
+    """
+
+    def test_import_package(self):
+        seconds, modules = measure_import("rescalehtc")
+        assert("requests" not in modules)
+        assert("rescalehtc.api" not in modules)
+        assert(seconds < MAX_IMPORT_SECONDS)
+
+    def test_import_bearer_token(self):
+        # Scripts that only inspect the claims of a token don't need the API
+        seconds, modules = measure_import("rescalehtc.bearer_token")
+        assert("requests" not in modules)
+        assert("rescalehtc.htcsession" not in modules)
+        assert(seconds < MAX_IMPORT_SECONDS)
+
+    def test_lazy_attributes(self):
+        _, modules = measure_import("rescalehtc; rescalehtc.HtcSession; rescalehtc.htcjobs")
+        assert("requests" in modules)
+        assert("rescalehtc.htcjobs" in modules)
@@ -0,0 +1,815 @@
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import threading
+import time
+
+# Enable verbose logging during test
+import logging
+logging.basicConfig(level=logging.NOTSET)
+
+# Library under test
+from rescalehtc.exceptions import HtcException
+from rescalehtc import api, htcjobs
+from rescalehtc.htcprojects import HtcProject
+from rescalehtc.htctasks import HtcTask
+from rescalehtc.internals import authenticate, codec, file_lock, rest_helpers
+from rescalehtc.internals.concurrency import AdaptiveLimiter, ConcurrencyController
+from rescalehtc.internals.image_readiness import ImageReadinessCache
+from rescalehtc.internals.polling import AdaptivePollingPolicy
+from rescalehtc.internals.retry import RetryPolicy, parse_retry_after
+from rescalehtc.internals.response_cache import ResponseCache
+from rescalehtc.journal import SubmissionJournal
+from rescalehtc.monitor import TaskMonitor
+from rescalehtc.records import JobRecord
+from rescalehtc.submission import SubmissionPipeline
+
+
+# Minimal stand-ins for HtcSession and requests, returning canned responses
+class FakeRequest:
+    method = "GET"
+    body = None
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers={}, json_value=None):
+        self.request = FakeRequest()
+        self.status_code = status_code
+        self.headers = headers
+        self.text = json.dumps(json_value)
+        self.content = self.text.encode()
+
+
+class FakeRequestsSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, endpoint, **kwargs):
+        self.requests.append((method, endpoint, kwargs))
+        return self.responses.pop(0)
+
+
+class FakeHtcSession:
+    is_async = False
+    RESCALE_HTC_BEARER_TOKEN = "token"
+    auth_header = "Bearer token"
+    RESCALE_API_BASE_URL = "http://x"
+
+    def __init__(self, responses=(), retry_policy=None, response_cache=None):
+        self.requests_session = FakeRequestsSession(responses)
+        self.concurrency = ConcurrencyController()
+        self.retry_policy = retry_policy or RetryPolicy(backoff_base_seconds=0.01)
+        self.response_cache = response_cache
+        self.auth_identity = "identity"
+        self.image_readiness = ImageReadinessCache(initial_poll_seconds=0.01)
+        self.polling_policy = AdaptivePollingPolicy()
+
+    def reauthenticate_if_needed(self):
+        pass
+
+    def check_fork(self):
+        pass
+
+
+def make_task(task_id="t"):
+    """Return a HtcTask in a project "p", without any API calls."""
+    return HtcTask(
+        {"projectId": "p", "taskId": task_id},
+        HtcProject({"projectId": "p", "regions": ["AWS_US_EAST_2"]}),
+    )
+
+
+class TestsInternals(unittest.TestCase):
+    """
+    Tests of internal helpers that do not need the mock API.
+    """
+
+    def test_prefetch_iterator(self):
+        # All values arrive in order
+        assert(list(rest_helpers.prefetch_iterator(iter(range(100)), 3)) == list(range(100)))
+
+        # The producer never runs more than depth values (plus the one being
+        # produced) ahead of the consumer
+        produced = []
+        def producer():
+            for i in range(100):
+                produced.append(i)
+                yield i
+        prefetched = rest_helpers.prefetch_iterator(producer(), 2)
+        assert(next(prefetched) == 0)
+        time.sleep(0.2)
+        assert(len(produced) <= 4)
+        # Stopping early also stops the background thread
+        prefetched.close()
+        time.sleep(0.3)
+        assert(len(produced) <= 5)
+
+        # Exceptions are raised in the consumer
+        def failing_producer():
+            yield 1
+            raise HtcException("page failed", 500)
+        prefetched = rest_helpers.prefetch_iterator(failing_producer(), 2)
+        assert(next(prefetched) == 1)
+        try:
+            next(prefetched)
+            raise Exception
+        except HtcException as e:
+            assert(e.status_code == 500)
+
+    def test_adaptive_limiter(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=4)
+        # Saturated, successful requests grow the limit up to the maximum
+        for _ in range(50):
+            in_flight = limiter.limit
+            for _ in range(in_flight):
+                limiter.acquire()
+            for _ in range(in_flight):
+                limiter.release(0.01, overloaded=False)
+        assert(limiter.limit == 4)
+        # An overload halves the limit
+        limiter.acquire()
+        limiter.release(0.01, overloaded=True)
+        assert(limiter.limit == 2)
+        # Never goes below the minimum
+        for _ in range(10):
+            time.sleep(0.02)
+            limiter.acquire()
+            limiter.release(0.01, overloaded=True)
+        assert(limiter.limit == 1)
+
+        # Coroutines wait for a free slot without blocking the event loop
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=2)
+        max_in_flight = 0
+
+        async def request():
+            nonlocal max_in_flight
+            await limiter.acquire_async()
+            max_in_flight = max(max_in_flight, limiter.in_flight)
+            await asyncio.sleep(0.01)
+            limiter.release(0.01, overloaded=False)
+
+        async def main():
+            await asyncio.gather(*[request() for _ in range(6)])
+
+        asyncio.run(main())
+        assert(max_in_flight == 2)
+        assert(limiter.in_flight == 0)
+
+    def test_concurrency_controller(self):
+        controller = ConcurrencyController(initial_limits={"reads": 3})
+        assert(controller.get_limits()["reads"] == 3)
+        assert(controller.classify("GET", "http://x/htc/projects/p/tasks/t/jobs") == "reads")
+        assert(controller.classify("GET", "http://x/htc/projects/p/tasks/t/jobs/j/logs") == "logs")
+        assert(controller.classify("POST", "http://x/htc/projects/p/tasks/t/jobs/batch") == "submissions")
+        with controller.request_slot("GET", "http://x/htc/projects") as slot:
+            assert(controller.limiters["reads"].in_flight == 1)
+            slot.record_status(429)
+        assert(controller.limiters["reads"].in_flight == 0)
+        assert(controller.get_limits()["reads"] == 1)
+
+        # Slow requests, like large pages of jobs, are not an overload
+        controller = ConcurrencyController(initial_limits={"reads": 8})
+        for latency in [0.01, 1.0, 0.01, 2.0]:
+            controller.limiters["reads"].acquire()
+            controller.limiters["reads"].release(latency, overloaded=False)
+        assert(controller.get_limits()["reads"] == 8)
+
+    def test_retry_policy(self):
+        # Transient errors on GET are retried until success
+        rs = FakeHtcSession([FakeResponse(503), FakeResponse(429, {"Retry-After": "0"}), FakeResponse(200, json_value={"a": 1})])
+        assert(rest_helpers.api_get(rs, "http://x/htc/projects/p") == {"a": 1})
+        assert(len(rs.requests_session.requests) == 3)
+
+        # POST is not retried unless marked as safe
+        rs = FakeHtcSession([FakeResponse(503), FakeResponse(200, json_value={})])
+        try:
+            rest_helpers.api_post(rs, "http://x/htc/projects", payload={})
+            raise Exception
+        except HtcException as e:
+            assert(e.status_code == 503)
+        rs = FakeHtcSession([FakeResponse(503), FakeResponse(200, json_value={})])
+        assert(rest_helpers.api_post(rs, "http://x/htc/projects", payload={}, retry_safe=True) == {})
+
+        # Attempts are limited, and non-transient errors are not retried
+        rs = FakeHtcSession([FakeResponse(500)] * 3, RetryPolicy(max_attempts=3, backoff_base_seconds=0.01))
+        try:
+            rest_helpers.api_get(rs, "http://x/htc/projects")
+            raise Exception
+        except HtcException as e:
+            assert(e.status_code == 500)
+        assert(len(rs.requests_session.requests) == 3)
+        rs = FakeHtcSession([FakeResponse(404)])
+        try:
+            rest_helpers.api_get(rs, "http://x/htc/projects")
+            raise Exception
+        except HtcException as e:
+            assert(e.status_code == 404)
+
+        # The retry budget stops retries once spent
+        policy = RetryPolicy(budget_max=1, budget_ratio=0)
+        assert(policy.should_retry(1))
+        assert(not policy.should_retry(1))
+
+        # Backoff is jittered and capped, Retry-After takes precedence
+        policy = RetryPolicy(backoff_base_seconds=1, backoff_max_seconds=8)
+        assert(all(0 <= policy.get_delay(attempt) <= 8 for attempt in range(1, 10)))
+        assert(30 <= RetryPolicy(backoff_max_seconds=60).get_delay(1, "30") <= 31.0)
+        assert(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0)
+        assert(parse_retry_after("garbage") is None)
+
+    def test_response_cache(self):
+        cache = ResponseCache(ttls=[(r"/htc/projects/[^/]+$", 60)])
+        rs = FakeHtcSession([
+            FakeResponse(200, {"ETag": '"v1"'}, {"projectName": "a"}),
+            FakeResponse(304),
+            FakeResponse(200, json_value={"id": "p"}),
+            FakeResponse(200, {"ETag": '"v2"'}, {"projectName": "b"}),
+            FakeResponse(200, json_value=[]),
+        ], response_cache=cache)
+
+        # The second read is served from memory, and callers get their own copy
+        project = rest_helpers.api_get(rs, "http://x/htc/projects/p")
+        project["projectName"] = "modified"
+        assert(rest_helpers.api_get(rs, "http://x/htc/projects/p") == {"projectName": "a"})
+        assert(len(rs.requests_session.requests) == 1)
+        assert((cache.hits, cache.misses) == (1, 1))
+
+        # Once stale, the response is revalidated with its ETag
+        for entry in cache._entries.values():
+            entry.expires_at = 0
+        assert(rest_helpers.api_get(rs, "http://x/htc/projects/p") == {"projectName": "a"})
+        assert(rs.requests_session.requests[1][2]["headers"]["If-None-Match"] == '"v1"')
+        assert(cache.revalidations == 1)
+
+        # Modifying the project invalidates it
+        rest_helpers.api_patch(rs, "http://x/htc/projects/p", payload={})
+        assert(rest_helpers.api_get(rs, "http://x/htc/projects/p") == {"projectName": "b"})
+        assert("If-None-Match" not in rs.requests_session.requests[3][2]["headers"])
+
+        # Endpoints without a TTL are never cached
+        rest_helpers.api_get(rs, "http://x/htc/projects/p/tasks")
+        assert(len(cache._entries) == 1)
+
+        # The least recently used entry is evicted first
+        cache = ResponseCache(max_entries=2)
+        for key in ("a", "b", "a", "c"):
+            if cache.lookup(key) is None:
+                cache.store(key, key, key, 60)
+        assert(list(cache._entries) == ["a", "c"])
+
+    def test_single_flight(self):
+        # Concurrent identical GETs share one request, and each caller gets its own copy
+        rs = FakeHtcSession([FakeResponse(200, json_value={"status": "RUNNING"})])
+        release = threading.Event()
+        request = rs.requests_session.request
+        def slow_request(*args, **kwargs):
+            release.wait()
+            return request(*args, **kwargs)
+        rs.requests_session.request = slow_request
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(rest_helpers.api_get(rs, "http://x/htc/projects/p/tasks/t/jobs/j")))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert(len(rs.requests_session.requests) == 1)
+        assert(results == [{"status": "RUNNING"}] * 10)
+        assert(len(set(id(result) for result in results)) == 10)
+
+        # Errors reach every waiter, and later calls make a new request
+        rs = FakeHtcSession([FakeResponse(404), FakeResponse(200, json_value={})])
+        try:
+            rest_helpers.api_get(rs, "http://x/htc/projects/p")
+            raise Exception
+        except HtcException as e:
+            assert(e.status_code == 404)
+        assert(rest_helpers.api_get(rs, "http://x/htc/projects/p") == {})
+
+    def test_codec(self):
+        # Every installed backend decodes to the same plain values
+        document = {"items": [{"jobUUID": "a", "status": "RUNNING", "container": {"exitCode": None}}], "next": None}
+        for backend in codec.BACKENDS:
+            try:
+                codec.set_backend(backend)
+            except HtcException:
+                continue
+            assert(codec.get_backend() == backend)
+            assert(codec.loads(json.dumps(document).encode()) == document)
+        codec.set_backend()
+        try:
+            codec.set_backend("unknown")
+            raise Exception
+        except HtcException:
+            pass
+
+        # Records keep the common fields, and share repeated strings
+        records = [JobRecord.from_json(job) for job in codec.loads(json.dumps(document["items"] * 2))]
+        assert(records[0] == records[1])
+        assert(records[0].status is records[1].status)
+        assert((records[0].job_uuid, records[0].status, records[0].exit_code) == ("a", "RUNNING", None))
+        assert(not hasattr(records[0], "__dict__"))
+
+    def test_list_filters(self):
+        # Filters and page size are sent as query params, and also applied to
+        # the items in case the API ignores them
+        jobs = [{"jobUUID": str(i), "status": "FAILED" if i % 3 == 0 else "SUCCEEDED"} for i in range(10)]
+        rs = FakeHtcSession([
+            FakeResponse(200, json_value={"items": jobs[:5], "next": "http://x/page2"}),
+            FakeResponse(200, json_value={"items": jobs[5:], "next": None}),
+        ])
+        failed = api.get_htc_projects_tasks_jobs(rs, "p", "t", status="FAILED", page_size=100)
+        assert([job["jobUUID"] for job in failed] == ["0", "3", "6", "9"])
+        assert(rs.requests_session.requests[0][2]["params"] == {"status": "FAILED", "pageSize": 100})
+
+        # max_items counts matching items only
+        rs = FakeHtcSession([
+            FakeResponse(200, json_value={"items": jobs[:5], "next": "http://x/page2"}),
+            FakeResponse(200, json_value={"items": jobs[5:], "next": None}),
+        ])
+        failed = list(rest_helpers.api_iter_items(rs, "http://x/jobs", max_items=3, filters={"status": "FAILED"}))
+        assert([job["jobUUID"] for job in failed] == ["0", "3", "6"])
+
+        # Without filters, nothing extra is sent
+        rs = FakeHtcSession([FakeResponse(200, json_value={"items": jobs, "next": None})])
+        assert(len(list(api.iter_htc_projects_tasks_jobs(rs, "p", "t"))) == 10)
+        assert(rs.requests_session.requests[0][2]["params"] == {})
+
+    def test_create_job_batches_raw(self):
+        task = make_task()
+        definitions = [
+            htcjobs.make_job_batch_definition(
+                task, batch_size=1, priority="ON_DEMAND_ECONOMY", image_name=f"image-{i % 2}",
+                exec_timeout_seconds=60, commands=["echo", str(i)],
+            )
+            for i in range(5)
+        ]
+        def batches(first, count):
+            return [{"parentJobId": f"job-{i}", "group": None, "projectId": "p", "taskId": "t", "batchSize": 1}
+                    for i in range(first, first + count)]
+
+        # Each image is checked once, and the definitions are submitted in chunks
+        rs = FakeHtcSession(
+            [FakeResponse(200, json_value={"status": "READY"})] * 2
+            + [FakeResponse(200, json_value=batches(0, 2)), FakeResponse(200, json_value=batches(2, 2)),
+               FakeResponse(200, json_value=batches(4, 1))]
+        )
+        job_batches = htcjobs.create_job_batches_raw(rs, task, definitions, max_batches_per_request=2)
+        assert([batch.json["parentJobId"] for batch in job_batches] == [f"job-{i}" for i in range(5)])
+        methods = [method for method, _, _ in rs.requests_session.requests]
+        assert(methods == ["GET", "GET", "POST", "POST", "POST"])
+        posted = [len(kwargs["json"]) for method, _, kwargs in rs.requests_session.requests if method == "POST"]
+        assert(posted == [2, 2, 1])
+
+        # A response that doesn't match the submitted definitions is returned as it is
+        rs = FakeHtcSession(
+            [FakeResponse(200, json_value={"status": "READY"})] * 2 + [FakeResponse(200, json_value=batches(0, 1))]
+        )
+        with self.assertLogs("RESCALEHTC", level="WARNING"):
+            job_batches = htcjobs.create_job_batches_raw(rs, task, definitions)
+        assert([batch.json["parentJobId"] for batch in job_batches] == ["job-0"])
+
+    def test_image_readiness_cache(self):
+        cache = ImageReadinessCache(initial_poll_seconds=0.05, max_poll_seconds=0.1, timeout_seconds=2)
+        statuses = ["PENDING", "PENDING", "PENDING", "READY"]
+        polled_at = []
+        def get_image_status():
+            polled_at.append(time.monotonic())
+            time.sleep(0.01)
+            return {"status": statuses.pop(0)}
+
+        # Concurrent waiters on a PENDING image share one poller, which backs off
+        threads = [threading.Thread(target=cache.wait_until_ready, args=(("p",), "image", get_image_status)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert(cache.polls == 4)
+        intervals = [b - a for a, b in zip(polled_at, polled_at[1:])]
+        assert(intervals[0] < intervals[1])
+
+        # READY images are remembered, per scope, until invalidated
+        cache.wait_until_ready(("p",), "image", get_image_status)
+        assert((cache.polls, cache.hits) == (4, 1))
+        statuses.extend(["READY", "READY"])
+        cache.wait_until_ready(("other",), "image", get_image_status)
+        cache.invalidate(("p",), "image")
+        cache.wait_until_ready(("p",), "image", get_image_status)
+        assert(cache.polls == 6)
+
+        # Images that stay PENDING time out
+        cache = ImageReadinessCache(initial_poll_seconds=0.05, timeout_seconds=0.2)
+        with self.assertRaises(HtcException):
+            cache.wait_until_ready(("p",), "image", lambda: {"status": "PENDING"})
+
+    def test_adaptive_polling_policy(self):
+        policy = AdaptivePollingPolicy(min_interval_seconds=10, max_interval_seconds=40, backoff_factor=2)
+
+        # Unchanged summaries back off up to the maximum, changes reset the interval
+        state = policy.new_state()
+        summary = {"jobStatuses": {"RUNNABLE": 100}}
+        intervals = []
+        for _ in range(4):
+            policy.observe_task_summary(state, summary)
+            intervals.append(state.interval)
+        assert(intervals == [10, 20, 40, 40])
+
+        # Completions every second expect the task to finish soon, which keeps the interval short
+        state.observed_at -= 1
+        policy.observe_task_summary(state, {"jobStatuses": {"RUNNING": 5, "SUCCEEDED": 95}})
+        assert(90 < state.completion_rate <= 95)
+        policy.observe_task_summary(state, {"jobStatuses": {"RUNNING": 5, "SUCCEEDED": 95}})
+        assert(state.interval == 10)
+
+        # Finished jobs are polled rarely, and their durations shorten the wait for running jobs
+        def job(status, started_seconds_ago, duration=None):
+            started_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=started_seconds_ago)
+            json = {"projectId": "p", "taskId": "t", "status": status, "startedAt": started_at.isoformat()}
+            if duration is not None:
+                json["completedAt"] = (started_at + datetime.timedelta(seconds=duration)).isoformat()
+            return json
+        state = policy.new_state()
+        policy.observe_job(state, job("RUNNING", 10))
+        policy.observe_job(state, job("RUNNING", 10))
+        assert(state.interval == 20)
+        policy.observe_job(state, job("SUCCEEDED", 200, duration=100))
+        assert(state.interval == 40)
+        assert(policy.get_typical_job_duration(("p", "t")) == 100)
+        state = policy.new_state()
+        policy.observe_job(state, job("RUNNING", 10))
+        policy.observe_job(state, job("RUNNING", 85))
+        assert(14 < state.interval < 16)
+
+        # Logs of finished jobs stop being polled once they stop growing
+        state = policy.new_state()
+        policy.observe_logs(state, 10, False)
+        policy.observe_logs(state, 20, False)
+        assert(state.interval == 10)
+        policy.observe_logs(state, 20, True)
+        assert(state.interval == 40)
+
+        # Durations are only kept for the most recently used tasks
+        with mock.patch("rescalehtc.internals.polling.ADAPTIVE_POLLING_MAX_TASKS", 2):
+            for task_id in ["t1", "t2", "t3"]:
+                policy.record_job_duration(("p", task_id), job("SUCCEEDED", 200, duration=100))
+        assert(list(policy._job_durations) == [("p", "t2"), ("p", "t3")])
+
+        # Tasks and jobs start with the polling state of the session's policy
+        rescale = FakeHtcSession()
+        rescale.polling_policy = AdaptivePollingPolicy(min_interval_seconds=5)
+        task = make_task()
+        assert(task.task_summary_polling is None)
+        sparse_job = htcjobs.HtcJob({"jobUUID": "j", "projectId": "p", "taskId": "t"}, task)
+        assert(sparse_job.is_due_for_update(rescale) and sparse_job.status_polling.interval == 5)
+
+    def test_submission_pipeline(self):
+        task = make_task()
+        consumed = []
+        def definitions(count):
+            for i in range(count):
+                consumed.append(i)
+                yield {"batchSize": 1, "htcJobDefinition": {"imageName": "image", "maxVCpus": 2}, "jobName": str(i)}
+
+        submitting = []
+        def create_job_batches_raw(rescale, task, chunk, max_batches_per_request, journal, journal_offset):
+            submitting.append(len(chunk))
+            assert(len(submitting) <= 2)
+            time.sleep(0.02)
+            submitting.pop()
+            return [htcjobs.HtcJobBatch({"parentJobId": definition["jobName"]}, task) for definition in chunk]
+
+        # Definitions are read as chunks are submitted, at most 2 chunks at a time
+        rs = FakeHtcSession()
+        pipeline = SubmissionPipeline(rs, task, chunk_size=5, max_parallel_chunks=2, max_queued_vcpus=0)
+        results = []
+        with mock.patch("rescalehtc.submission.create_job_batches_raw", create_job_batches_raw):
+            for result in pipeline.submit(definitions(23)):
+                assert(len(consumed) <= result.offset + 5 * 3)
+                results.append(result)
+        assert(sorted(result.index for result in results) == list(range(5)))
+        batches = sorted((batch for result in results for batch in result.job_batches), key=lambda batch: int(batch.json["parentJobId"]))
+        assert([batch.json["parentJobId"] for batch in batches] == [str(i) for i in range(23)])
+        assert((pipeline.submitted_jobs, pipeline.submitted_vcpus) == (23, 46))
+
+        # The pipeline waits while the task has too many unfinished jobs
+        unfinished = [30, 30, 12, 0, 0, 0]
+        def get_task_summary(rescale):
+            task.task_summary_updated_at = time.monotonic()
+            return {"jobStatuses": {"RUNNABLE": unfinished.pop(0)}}
+        consumed.clear()
+        pipeline = SubmissionPipeline(rs, task, chunk_size=5, max_queued_jobs=20, max_queued_vcpus=100, poll_interval_seconds=0.01)
+        with mock.patch("rescalehtc.submission.create_job_batches_raw", create_job_batches_raw), \
+                mock.patch.object(task, "get_task_summary", get_task_summary):
+            results = list(pipeline.submit(definitions(10)))
+        assert(len(results) == 2 and unfinished == [0, 0])
+
+        # Invalid definitions fail their chunk, and stop the submission
+        consumed.clear()
+        def invalid_definitions():
+            yield from definitions(5)
+            yield {"batchSize": 0}
+            yield from definitions(10)
+        pipeline = SubmissionPipeline(rs, task, chunk_size=5, max_queued_vcpus=0)
+        with mock.patch("rescalehtc.submission.create_job_batches_raw", create_job_batches_raw):
+            results = sorted(pipeline.submit(invalid_definitions()), key=lambda result: result.index)
+        assert(len(results) == 2)
+        assert(results[0].exception is None and isinstance(results[1].exception, HtcException))
+
+    def test_submission_journal(self):
+        task = make_task()
+        definitions = [
+            {"batchSize": 1, "htcJobDefinition": {"imageName": "image"}, "jobName": str(i)} for i in range(5)
+        ]
+        def batches(first, count):
+            return [{"parentJobId": f"job-{i}"} for i in range(first, first + count)]
+
+        with tempfile.TemporaryDirectory() as folder:
+            journal = SubmissionJournal(f"{folder}/journal.db", sweep="sweep")
+
+            # A submission fails in the second chunk, without knowing whether
+            # the API created its jobs
+            rs = FakeHtcSession([
+                FakeResponse(200, json_value={"status": "READY"}),
+                FakeResponse(200, json_value=batches(0, 2)),
+                FakeResponse(500),
+            ])
+            with self.assertRaises(HtcException):
+                htcjobs.create_job_batches_raw(rs, task, definitions, max_batches_per_request=2, journal=journal)
+            assert(journal.get_interrupted() == [("t", 2)])
+            assert(journal.count_submitted() == 1)
+
+            # The interrupted chunk is not submitted again until it is resolved
+            rs.requests_session.requests.clear()
+            with self.assertRaises(HtcException):
+                htcjobs.create_job_batches_raw(rs, task, definitions, max_batches_per_request=2, journal=journal)
+            assert(len(rs.requests_session.requests) == 0)
+
+            # Resuming submits only the chunks that weren't submitted, also
+            # after reopening the journal
+            journal.forget("t", 2)
+            journal = SubmissionJournal(f"{folder}/journal.db", sweep="sweep")
+            rs.requests_session.responses = [
+                FakeResponse(200, json_value=batches(2, 2)),
+                FakeResponse(200, json_value=batches(4, 1)),
+            ]
+            job_batches = htcjobs.create_job_batches_raw(rs, task, definitions, max_batches_per_request=2, journal=journal)
+            assert([batch.json["parentJobId"] for batch in job_batches] == [f"job-{i}" for i in range(5)])
+            assert(len(rs.requests_session.requests) == 2)
+            rs.requests_session.requests.clear()
+            job_batches = htcjobs.create_job_batches_raw(rs, task, definitions, max_batches_per_request=2, journal=journal)
+            assert(len(job_batches) == 5 and len(rs.requests_session.requests) == 0)
+
+            # The pipeline resumes from the journal as well
+            pipeline = SubmissionPipeline(rs, task, chunk_size=2, max_queued_vcpus=0, journal=journal)
+            results = list(pipeline.submit(iter(definitions)))
+            assert(len(results) == 3 and len(rs.requests_session.requests) == 0)
+            assert(pipeline.submitted_jobs == 0)
+
+            # Changed definitions are detected
+            changed = [dict(definition, jobName="changed") for definition in definitions]
+            with self.assertRaises(HtcException):
+                htcjobs.create_job_batches_raw(rs, task, changed, max_batches_per_request=2, journal=journal)
+
+            # Chunks the API rejected are not recorded
+            journal = SubmissionJournal(f"{folder}/journal.db", sweep="other")
+            rs.requests_session.responses = [FakeResponse(400)]
+            with self.assertRaises(HtcException):
+                htcjobs.create_job_batches_raw(rs, task, definitions, journal=journal)
+            assert(journal.get_interrupted() == [] and journal.count_submitted() == 0)
+
+            # Chunks whose images aren't ready are not sent, and can be submitted later
+            rs.image_readiness.clear()
+            rs.requests_session.responses = [FakeResponse(200, json_value={"status": "FAILED"})]
+            with self.assertRaises(HtcException):
+                htcjobs.create_job_batches_raw(rs, task, definitions, journal=journal)
+            assert(journal.get_interrupted() == [])
+            rs.requests_session.responses = [
+                FakeResponse(200, json_value={"status": "READY"}),
+                FakeResponse(200, json_value=batches(0, 5)),
+            ]
+            job_batches = htcjobs.create_job_batches_raw(rs, task, definitions, journal=journal)
+            assert(len(job_batches) == 5 and journal.count_submitted() == 1)
+            journal.close()
+
+    def test_task_monitor(self):
+        tasks = [make_task(f"t{i}") for i in range(20)]
+        # Task i completes on its (i % 4 + 1)th poll
+        polls = {task.json["taskId"]: 0 for task in tasks}
+        in_flight = []
+        def get_summary(rescale, project_id, task_id):
+            in_flight.append(task_id)
+            assert(len(in_flight) <= 3)
+            time.sleep(0.005)
+            in_flight.remove(task_id)
+            polls[task_id] += 1
+            running = 0 if polls[task_id] > int(task_id[1:]) % 4 else 1
+            return {"jobStatuses": {"SUBMITTED_TO_RESCALE": 0, "SUBMITTED_TO_PROVIDER": 0, "RUNNABLE": 0,
+                                    "STARTING": 0, "RUNNING": running, "SUCCEEDED": 1, "FAILED": 0}}
+
+        completed = []
+        with mock.patch("rescalehtc.htctasks.api.get_htc_projects_tasks_summary_statistics", get_summary):
+            with TaskMonitor(FakeHtcSession(), poll_interval_seconds=0.05, max_concurrent_polls=3,
+                             on_complete=lambda task, summary: completed.append(task)) as monitor:
+                monitor.add_all(tasks)
+                monitor.add(tasks[0])
+                first = monitor.wait_any(timeout=5)
+                assert(first is not None and int(first.json["taskId"][1:]) % 4 == 0)
+                in_order = list(monitor.as_completed(timeout=5))
+                assert(monitor.wait_all(timeout=0))
+        # Every task is polled until it completes, and no more
+        assert(sorted(polls.values()) == sorted(i % 4 + 1 for i in range(20)))
+        assert(monitor.polls == sum(polls.values()))
+        assert({id(task) for task in in_order} == {id(task) for task in tasks})
+        assert(sorted(map(id, completed)) == sorted(map(id, tasks)))
+        assert(all(not task.task_summary["still_running"] for task in tasks))
+
+    def test_refresh_jobs(self):
+        task = make_task()
+        batch = htcjobs.HtcJobBatch(
+            {"group": "g", "projectId": "p", "taskId": "t", "parentJobId": "b", "batchSize": 20}, task
+        )
+        def job_json(job_id):
+            return {"jobUUID": job_id, "projectId": "p", "taskId": "t", "status": "RUNNING"}
+        listed = []
+        def iter_jobs(rescale, project_id, task_id, prefetch_pages=0):
+            for i in range(40):
+                listed.append(i)
+                yield job_json(f"b:{i}")
+        requested = []
+        def get_job(rescale, project_id, task_id, job_id=None):
+            requested.append(job_id)
+            return job_json(job_id)
+
+        rescale = FakeHtcSession()
+        with mock.patch("rescalehtc.htcjobs.api.iter_htc_projects_tasks_jobs", iter_jobs), \
+             mock.patch("rescalehtc.htcjobs.api.get_htc_projects_tasks_jobs", get_job):
+            # Many jobs are updated from one listing, which stops once all jobs were found
+            jobs = batch.to_jobs()
+            assert(len(htcjobs.refresh_jobs(rescale, jobs)) == 20)
+            assert(len(listed) == 20 and requested == [])
+            assert(all(job.json["status"] == "RUNNING" for job in jobs))
+
+            # Jobs that were just updated are skipped, unless forced
+            assert(htcjobs.refresh_jobs(rescale, jobs) == [])
+            # A few jobs are requested one by one
+            assert(len(htcjobs.refresh_jobs(rescale, jobs[:3], force=True)) == 3)
+            assert(sorted(requested) == ["b:0", "b:1", "b:2"] and len(listed) == 20)
+
+        # Jobs that are not found are skipped, other errors are raised in both paths
+        def get_missing_job(rescale, project_id, task_id, job_id=None):
+            raise HtcException("Not found", status_code=404)
+        def fail(*args, **kwargs):
+            raise HtcException("Internal error", status_code=500)
+        with mock.patch("rescalehtc.htcjobs.api.get_htc_projects_tasks_jobs", get_missing_job):
+            assert(htcjobs.refresh_jobs(rescale, jobs[:3], force=True) == [])
+        for failing_iter_jobs, failing_get_job, refreshed in [(fail, get_job, jobs), (iter_jobs, fail, jobs[:3])]:
+            with mock.patch("rescalehtc.htcjobs.api.iter_htc_projects_tasks_jobs", failing_iter_jobs), \
+                 mock.patch("rescalehtc.htcjobs.api.get_htc_projects_tasks_jobs", failing_get_job):
+                try:
+                    htcjobs.refresh_jobs(rescale, refreshed, force=True)
+                    raise Exception
+                except HtcException as e:
+                    assert(e.status_code == 500)
+
+    def test_job_batch_view(self):
+        task = make_task()
+        batch = htcjobs.HtcJobBatch(
+            {"group": "g", "projectId": "p", "taskId": "t", "parentJobId": "b", "batchSize": 100000}, task
+        )
+        jobs = batch.to_jobs()
+        assert(len(jobs) == 100000 and len(jobs._jobs) == 0)
+
+        # Jobs are created on access, and the same object is returned afterwards
+        assert(jobs[-1].json["jobUUID"] == "b:99999")
+        assert(jobs[5] is jobs[5] and jobs[5].task is task)
+        assert(not hasattr(jobs[5], "__dict__"))
+        with self.assertRaises(IndexError):
+            jobs[100000]
+
+        # Slices are views sharing the created jobs
+        tail = jobs[10:20:2]
+        assert([job.json["jobUUID"] for job in tail] == ["b:10", "b:12", "b:14", "b:16", "b:18"])
+        assert(tail[0] is jobs[10] and tail[1:][0] is jobs[12])
+        assert(len(jobs._jobs) == 7)
+
+    def test_watch_jobs(self):
+        task = make_task()
+        syncs = [
+            {"j0": "RUNNING", "j1": "RUNNABLE", "j2": "SUCCEEDED", "j3": "RUNNABLE"},
+            {"j0": "RUNNING", "j1": "RUNNABLE", "j2": "SUCCEEDED", "j3": "RUNNABLE"},
+            {"j0": "SUCCEEDED", "j1": "RUNNABLE", "j2": "SUCCEEDED", "j3": "RUNNABLE"},
+            {"j0": "SUCCEEDED", "j1": "RUNNING", "j2": "SUCCEEDED", "j3": "RUNNABLE", "j4": "RUNNABLE"},
+            {"j0": "SUCCEEDED", "j1": "FAILED", "j2": "SUCCEEDED", "j3": "SUCCEEDED", "j4": "SUCCEEDED"},
+        ]
+        current = {}
+        listed = []
+        def get_summary(rescale, project_id, task_id):
+            current.clear()
+            current.update(syncs.pop(0))
+            job_statuses = {status: 0 for status in ["SUBMITTED_TO_RESCALE", "SUBMITTED_TO_PROVIDER", "RUNNABLE",
+                                                     "STARTING", "RUNNING", "SUCCEEDED", "FAILED"]}
+            for status in current.values():
+                job_statuses[status] += 1
+            return {"jobStatuses": job_statuses}
+        def iter_jobs(rescale, project_id, task_id, prefetch_pages=0):
+            listed.append([])
+            for job_uuid, job_status in current.items():
+                listed[-1].append(job_uuid)
+                yield {"jobUUID": job_uuid, "projectId": project_id, "taskId": task_id, "status": job_status}
+
+        with mock.patch("rescalehtc.htctasks.api.get_htc_projects_tasks_summary_statistics", get_summary), \
+             mock.patch("rescalehtc.htcjobs.api.iter_htc_projects_tasks_jobs", iter_jobs):
+            changes = list(htcjobs.watch_jobs(FakeHtcSession(), task, poll_interval_seconds=0.01))
+
+        # Only transitions are yielded, not the jobs that existed when watching started
+        assert([(c.job.json["jobUUID"], c.previous_status, c.status) for c in changes] == [
+            ("j0", "RUNNING", "SUCCEEDED"), ("j1", "RUNNABLE", "RUNNING"), ("j4", None, "RUNNABLE"),
+            ("j1", "RUNNING", "FAILED"), ("j3", "RUNNABLE", "SUCCEEDED"), ("j4", "RUNNABLE", "SUCCEEDED"),
+        ])
+        # The unchanged summary skipped the listing, and a listing stops once it adds up to the summary
+        assert(listed == [
+            ["j0", "j1", "j2", "j3"], ["j0", "j1"], ["j0", "j1", "j2", "j3", "j4"], ["j0", "j1", "j2", "j3", "j4"],
+        ])
+        # An invalid task is reported on the call
+        with self.assertRaises(HtcException):
+            htcjobs.watch_jobs(FakeHtcSession(), None)
+
+    def test_shared_bearer_token_file(self):
+        with tempfile.TemporaryDirectory() as config_folder:
+            os.makedirs(f"{config_folder}/default")
+            with open(f"{config_folder}/default/rescale_api_token.txt", "w") as fp:
+                fp.write("api-key")
+            bearer_token_file = f"{config_folder}/default/rescale_bearer_token.json"
+            with open(bearer_token_file, "w") as fp:
+                fp.write('{"tokenValue": "trunc')
+
+            def request_new_bearer_token(*args):
+                time.sleep(0.2)
+                expires_at = datetime.datetime.now() + datetime.timedelta(hours=3)
+                return {"tokenValue": "new", "expiresAt": expires_at.isoformat()}
+
+            # A corrupt token file is replaced, and concurrent callers share a
+            # single renewal instead of each requesting their own token
+            results = []
+            with mock.patch.object(
+                authenticate, "request_new_bearer_token", side_effect=request_new_bearer_token
+            ) as request_spy:
+                threads = [
+                    threading.Thread(target=lambda: results.append(
+                        authenticate.get_bearer_json(None, "default", config_folder, "http://x")
+                    ))
+                    for _ in range(8)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                assert(request_spy.call_count == 1)
+            assert([result["tokenValue"] for result in results] == ["new"] * 8)
+            with open(bearer_token_file) as fp:
+                assert(json.load(fp)["tokenValue"] == "new")
+            assert(os.stat(bearer_token_file).st_mode & 0o777 == 0o600)
+            # No temporary files are left behind
+            assert(sorted(os.listdir(f"{config_folder}/default")) == [
+                "rescale_api_token.txt", "rescale_bearer_token.json", "rescale_bearer_token.json.lock"
+            ])
+
+    def test_file_lock(self):
+        with tempfile.TemporaryDirectory() as folder:
+            # Locks on different files don't wait for each other
+            other_locked = threading.Event()
+
+            def lock_other_file():
+                with file_lock.file_lock(f"{folder}/b.lock"):
+                    other_locked.set()
+
+            with file_lock.file_lock(f"{folder}/a.lock"):
+                thread = threading.Thread(target=lock_other_file)
+                thread.start()
+                assert(other_locked.wait(5))
+            thread.join()
+
+            # The same file, through another path, is locked only once at a time
+            os.makedirs(f"{folder}/sub")
+            same_locked = threading.Event()
+
+            def lock_same_file():
+                with file_lock.file_lock(f"{folder}/sub/../a.lock"):
+                    same_locked.set()
+
+            with file_lock.file_lock(f"{folder}/a.lock"):
+                thread = threading.Thread(target=lock_same_file)
+                thread.start()
+                assert(not same_locked.wait(0.2))
+            thread.join()
+            assert(same_locked.is_set())